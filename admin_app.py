@@ -2,8 +2,11 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 from models import db, SanPham, DonHang, TaiKhoan, ChiTiet_DonHang, DiaChi, DangNhap, GioHang, GioHang_SanPham
-import cloudinary.uploader
-from services.services import AuthService, ProductService, OrderService
+import services.image_storage as image_storage
+from services.image_storage import resolve_images
+from models.migrations import report_missing_indexes, upgrade_schema
+from services.services import AuthService, ProductService, OrderService, CustomerService, DashboardService, \
+    RevenueRollupService, InventoryService, HotStockService, ImageUploadService
 from datetime import datetime, timedelta
 from sqlalchemy import func, extract
 
@@ -28,12 +31,12 @@ admin_app.config.from_object(Config)
 # Khởi tạo database
 db.init_app(admin_app)
 
-cloudinary.config(
-    cloud_name=admin_app.config['CLOUDINARY_CLOUD_NAME'],
-    api_key=admin_app.config['CLOUDINARY_API_KEY'],
-    api_secret=admin_app.config['CLOUDINARY_API_SECRET'],
-    secure=True
-)
+# Nơi lưu ảnh sản phẩm (Cloudinary hoặc đĩa cục bộ, xem IMAGE_STORAGE)
+image_storage.init_app(admin_app)
+
+# Phân trang cho các API danh sách của admin
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
 
 # Bảo mật admin - chỉ định admin accounts
 ADMIN_ACCOUNTS = {
@@ -98,6 +101,7 @@ def admin_index():
 
 @admin_app.route('/api/admin/upload-image', methods=['POST'])
 def admin_upload_image():
+    """Nhận ảnh và xếp hàng upload nền, trả mã tác vụ ngay"""
     if not require_admin_auth():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
@@ -110,44 +114,48 @@ def admin_upload_image():
             return jsonify({'error': 'No file selected'}), 400
 
         # Validate file type
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-        if not ('.' in file.filename and
-                file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+        if not ImageUploadService.allowed_file(file.filename):
             return jsonify({'error': 'Invalid file type'}), 400
 
-        # Tạo unique filename để tránh cache và conflict
-        import uuid
-        import time
-        unique_filename = f"product_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-
-        # Upload lên Cloudinary với overwrite=True để tránh conflict
-        result = cloudinary.uploader.upload(
-            file,
-            folder="pet_shop/products",
-            public_id=unique_filename,
-            resource_type="auto",
-            transformation=[
-                {'quality': 'auto:good'},
-                {'format': 'auto'},
-                {'width': 800, 'height': 600, 'crop': 'limit'}
-            ],
-            overwrite=True,  # Thay đổi từ False thành True
-            invalidate=True  # Thêm dòng này để clear cache
-        )
+        # Gắn ảnh vào sản phẩm khi upload xong (tùy chọn)
+        product_id = request.form.get('product_id', type=int)
+        kind = 'extra' if request.form.get('kind') == 'extra' else 'main'
 
+        job = ImageUploadService.submit(file, product_id=product_id, kind=kind)
+
+        # Ảnh đã upload trước đây thì có URL ngay (200), ảnh mới thì đang xử lý (202)
         return jsonify({
             'success': True,
             'data': {
-                'url': result['secure_url'],
-                'public_id': result['public_id']
+                'job_id': job.MaTacVu,
+                'status': job.TrangThai,
+                'url': job.URL,
+                'status_url': url_for('admin_upload_image_status', job_id=job.MaTacVu)
             }
-        })
+        }), 200 if job.TrangThai == 'done' else 202
 
     except Exception as e:
         print(f"Upload error: {str(e)}")
         return jsonify({'error': 'Upload failed', 'details': str(e)}), 500
 
 
+@admin_app.route('/api/admin/upload-image/<job_id>')
+def admin_upload_image_status(job_id):
+    """Trạng thái tác vụ upload ảnh (pending/processing/done/failed)"""
+    if not require_admin_auth():
+        return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
+
+    try:
+        job = ImageUploadService.get_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'message': 'Không tìm thấy tác vụ upload'}), 404
+
+        return jsonify({'success': True, 'data': job})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
+
+
 # Context processor cho admin
 @admin_app.context_processor
 def inject_admin_context():
@@ -174,15 +182,8 @@ def api_admin_products():
         for product_data in products_query:
             product, loai = product_data
 
-            # Xử lý hình ảnh
-            main_image = None
-            if hasattr(product, 'HinhAnh') and product.HinhAnh:
-                if product.HinhAnh.startswith('http'):
-                    main_image = product.HinhAnh
-                else:
-                    cloud_name = admin_app.config.get('CLOUDINARY_CLOUD_NAME')
-                    if cloud_name:
-                        main_image = f"https://res.cloudinary.com/{cloud_name}/image/upload/v1/pet_shop/products/{product.HinhAnh}"
+            # Xử lý hình ảnh (cùng cách tạo URL và bộ nhớ đệm với storefront)
+            main_image, _ = resolve_images(product.HinhAnh, product.HinhAnhPhu)
 
             result.append({
                 'id': product.MaSanPham,
@@ -236,6 +237,19 @@ with admin_app.app_context():
     except Exception as e:
         print(f"Admin app - Error creating database tables: {e}")
 
+    # Áp dụng migration còn thiếu; database vẫn thiếu cột thì dừng luôn (RuntimeError)
+    upgrade_schema(admin_app.config.get('AUTO_MIGRATE', True), 'Admin app - ')
+
+    try:
+        report_missing_indexes('Admin app - ')
+        if RevenueRollupService.ensure_backfilled():
+            print("Admin app - Backfilled DoanhThuNgay from DonHang")
+        resumed = ImageUploadService.resume_pending()
+        if resumed:
+            print(f"Admin app - Resumed {resumed} pending image uploads")
+    except Exception as e:
+        print(f"Admin app - Error preparing startup data: {e}")
+
 
 # Route thống kê admin
 @admin_app.route('/api/admin/statistics')
@@ -244,34 +258,18 @@ def admin_statistics():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        # Thống kê sản phẩm theo trạng thái kho
-        in_stock = SanPham.query.filter(SanPham.TrangThai == 1, SanPham.SoLuong > 10).count()
-        low_stock = SanPham.query.filter(SanPham.TrangThai == 1, SanPham.SoLuong.between(1, 10)).count()
-        out_of_stock = SanPham.query.filter(SanPham.TrangThai == 1, SanPham.SoLuong == 0).count()
-        total_products = SanPham.query.filter_by(TrangThai=1).count()
-
-        # Thống kê đơn hàng
-        total_orders = DonHang.query.count()
-        pending_orders = DonHang.query.filter_by(Status='pending').count()
-
-        # Thống kê người dùng
-        total_users = TaiKhoan.query.count()
+        stats = DashboardService.get_stats()
 
         return jsonify({
             'success': True,
             'data': {
-                'products': {
-                    'total': total_products,
-                    'in_stock': in_stock,
-                    'low_stock': low_stock,
-                    'out_of_stock': out_of_stock
-                },
+                'products': stats['products'],
                 'orders': {
-                    'total': total_orders,
-                    'pending': pending_orders
+                    'total': stats['orders']['total'],
+                    'pending': stats['orders']['pending']
                 },
                 'users': {
-                    'total': total_users
+                    'total': stats['users']['total']
                 }
             }
         })
@@ -312,10 +310,11 @@ def admin_dashboard():
 
     # Có thể lấy stats cơ bản để hiển thị ban đầu
     try:
+        dashboard_stats = DashboardService.get_stats()
         stats = {
-            'total_products': SanPham.query.filter_by(TrangThai=1).count(),
-            'total_orders': DonHang.query.count(),
-            'total_users': TaiKhoan.query.count()
+            'total_products': dashboard_stats['products']['total'],
+            'total_orders': dashboard_stats['orders']['total'],
+            'total_users': dashboard_stats['users']['total']
         }
     except:
         stats = {'total_products': 0, 'total_orders': 0, 'total_users': 0}
@@ -330,168 +329,28 @@ def admin_sales_chart():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        from models import DonHang, ChiTiet_DonHang
-
         # Lấy tham số thời gian (mặc định 7 ngày)
         period = request.args.get('period', '7')
 
-        # Tính toán khoảng thời gian
-        if period == '7':
-            # 7 ngày gần đây
-            start_date = datetime.now() - timedelta(days=6)  # Bao gồm hôm nay
-            labels = []
-            for i in range(7):
-                date = start_date + timedelta(days=i)
-                labels.append(date.strftime('%d/%m'))
-        elif period == '30':
-            # 30 ngày gần đây, nhóm theo tuần (4 tuần)
-            start_date = datetime.now() - timedelta(days=27)  # 4 tuần
-            labels = ['Tuần 1', 'Tuần 2', 'Tuần 3', 'Tuần 4']
-        else:  # 90 ngày
-            # 3 tháng gần đây
-            current_date = datetime.now()
-            labels = []
-            for i in range(3):
-                month_date = current_date - timedelta(days=30 * (2 - i))  # Sửa thứ tự
-                labels.append(f"Tháng {month_date.month}")
-
-        # Truy vấn dữ liệu doanh thu
-        if period == '7':
-            # Doanh thu theo ngày trong 7 ngày
-            sales_data = db.session.query(
-                func.date(DonHang.NgayDat).label('date'),
-                func.sum(DonHang.TongTien).label('total')
-            ).filter(
-                DonHang.NgayDat >= start_date,
-                DonHang.Status.in_(['delivered', 'shipped'])  # Sử dụng shipped thay vì completed
-            ).group_by(
-                func.date(DonHang.NgayDat)
-            ).all()
-
-
-        elif period == '30':
-
-            # Doanh thu theo tuần trong 30 ngày
-
-            values = [0, 0, 0, 0]  # 4 tuần
-
-            for week in range(4):
-                week_start = start_date + timedelta(days=week * 7)
-
-                week_end = week_start + timedelta(days=6)
-
-                week_total = db.session.query(
-
-                    func.sum(DonHang.TongTien)
-
-                ).filter(
-
-                    DonHang.NgayDat >= week_start,
-
-                    DonHang.NgayDat <= week_end,
-
-                    DonHang.Status.in_(['delivered', 'shipped'])
-
-                ).scalar() or 0
-
-                values[week] = float(week_total)
-
-
-        else:  # 90 ngày
-
-            # Doanh thu theo tháng trong 3 tháng
-
-            values = []
-
-            current_date = datetime.now()
-
-            for i in range(3):
-
-                # Tính 3 tháng: tháng hiện tại, tháng trước, 2 tháng trước
-
-                months_back = 2 - i  # 2, 1, 0
-
-                if months_back == 0:
-
-                    # Tháng hiện tại
-
-                    month_start = current_date.replace(day=1)
-
-                    month_end = current_date
-
-                else:
-
-                    # Tháng trước hoặc 2 tháng trước
-
-                    year = current_date.year
-
-                    month = current_date.month - months_back
-
-                    if month <= 0:
-                        month += 12
-
-                        year -= 1
-
-                    month_start = datetime(year, month, 1)
-
-                    # Tính ngày cuối tháng
-
-                    if month == 12:
-
-                        month_end = datetime(year + 1, 1, 1) - timedelta(days=1)
-
-                    else:
-
-                        month_end = datetime(year, month + 1, 1) - timedelta(days=1)
-
-                month_total = db.session.query(
-
-                    func.sum(DonHang.TongTien)
-
-                ).filter(
-
-                    DonHang.NgayDat >= month_start,
-
-                    DonHang.NgayDat <= month_end,
-
-                    DonHang.Status.in_(['delivered', 'shipped'])
-
-                ).scalar() or 0
-
-                values.append(float(month_total))
-
-        # Xử lý dữ liệu cho period='7'
-
-        if period == '7':
-
-            # Xử lý dữ liệu cho 7 ngày
-
-            sales_data = db.session.query(
-
-                func.date(DonHang.NgayDat).label('date'),
-
-                func.sum(DonHang.TongTien).label('total')
-
-            ).filter(
-
-                DonHang.NgayDat >= start_date,
-
-                DonHang.Status.in_(['delivered', 'shipped'])
-
-            ).group_by(
-
-                func.date(DonHang.NgayDat)
-
-            ).all()
-
-            values = []
-
-            sales_dict = {item[0].strftime('%Y-%m-%d'): float(item[1]) for item in sales_data}
+        if period == 'custom':
+            # Khoảng tùy chọn: ?period=custom&start=YYYY-MM-DD&end=YYYY-MM-DD&granularity=day|week|month
+            try:
+                start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+                end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Khoảng thời gian không hợp lệ'}), 400
+            if start_date > end_date or (end_date - start_date).days > 3660:
+                return jsonify({'success': False, 'message': 'Khoảng thời gian không hợp lệ'}), 400
+            granularity = request.args.get('granularity', 'day')
+        else:
+            start_date, end_date, granularity = DashboardService.get_period_range(period)
+            granularity = request.args.get('granularity', granularity)
 
-            for i in range(7):
-                date_key = (start_date + timedelta(days=i)).strftime('%Y-%m-%d')
+        if granularity not in ('day', 'week', 'month'):
+            granularity = 'day'
 
-                values.append(sales_dict.get(date_key, 0))
+        # Một truy vấn GROUP BY cho mọi period
+        labels, values = DashboardService.get_revenue_series(start_date, end_date, granularity)
 
         return jsonify({
             'success': True,
@@ -517,34 +376,10 @@ def admin_recent_orders():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        from models import DonHang, TaiKhoan
-
         # Lấy 10 đơn hàng gần đây nhất
-        recent_orders = db.session.query(DonHang, TaiKhoan).join(
-            TaiKhoan, DonHang.MaTaiKhoan == TaiKhoan.MaTaiKhoan
-        ).order_by(
-            DonHang.NgayDat.desc()
-        ).limit(10).all()
-
-        result = []
-        for order_data in recent_orders:
-            order, user = order_data
-            # Tạo tên đầy đủ từ Ho và Ten
-            customer_name = f"{user.Ho or ''} {user.Ten or ''}".strip()
-            if not customer_name:
-                customer_name = f"Khách hàng #{user.MaTaiKhoan}"
-
-            result.append({
-                'id': order.MaDonHang,
-                'customer_name': customer_name,
-                'total': float(order.TongTien) if order.TongTien else 0,
-                'date': order.NgayDat.strftime('%Y-%m-%d %H:%M:%S') if order.NgayDat else '',
-                'status': order.Status or 'pending'
-            })
-
         return jsonify({
             'success': True,
-            'orders': result
+            'orders': DashboardService.get_recent_orders(10)
         })
 
     except Exception as e:
@@ -562,32 +397,10 @@ def admin_low_stock_products():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        from models import SanPham, Loai
-
         # Lấy các sản phẩm có số lượng <= 10
-        low_stock_products = db.session.query(SanPham, Loai).join(
-            Loai, SanPham.MaLoai == Loai.MaLoai
-        ).filter(
-            SanPham.TrangThai == 1,
-            SanPham.SoLuong <= 10
-        ).order_by(
-            SanPham.SoLuong.asc()
-        ).limit(15).all()
-
-        result = []
-        for product_data in low_stock_products:
-            product, category = product_data
-            result.append({
-                'id': product.MaSanPham,
-                'name': product.TenSanPham,
-                'category': category.TenLoai,
-                'quantity': product.SoLuong,
-                'price': float(product.GiaBan) if product.GiaBan else 0
-            })
-
         return jsonify({
             'success': True,
-            'products': result
+            'products': DashboardService.get_low_stock_products(15)
         })
 
     except Exception as e:
@@ -605,77 +418,10 @@ def admin_quick_stats():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        # Thống kê sản phẩm theo trạng thái kho
-        in_stock = SanPham.query.filter(
-            SanPham.TrangThai == 1,
-            SanPham.SoLuong > 10
-        ).count()
-
-        low_stock = SanPham.query.filter(
-            SanPham.TrangThai == 1,
-            SanPham.SoLuong.between(1, 10)
-        ).count()
-
-        out_of_stock = SanPham.query.filter(
-            SanPham.TrangThai == 1,
-            SanPham.SoLuong == 0
-        ).count()
-
-        total_products = SanPham.query.filter_by(TrangThai=1).count()
-
-        # Thống kê đơn hàng
-        total_orders = DonHang.query.count()
-        pending_orders = DonHang.query.filter_by(Status='pending').count()
-        shipped_orders = DonHang.query.filter_by(Status='shipped').count()
-        delivered_orders = DonHang.query.filter_by(Status='delivered').count()
-
-        # Doanh thu hôm nay
-        today = datetime.now().date()
-        today_revenue = db.session.query(
-            func.sum(DonHang.TongTien)
-        ).filter(
-            func.date(DonHang.NgayDat) == today,
-            DonHang.Status.in_(['delivered', 'shipped'])
-        ).scalar() or 0
-
-        # Doanh thu tháng này
-        current_month = datetime.now().replace(day=1)
-        month_revenue = db.session.query(
-            func.sum(DonHang.TongTien)
-        ).filter(
-            DonHang.NgayDat >= current_month,
-            DonHang.Status.in_(['delivered', 'shipped'])
-        ).scalar() or 0
-
-        # Thống kê người dùng
-        total_users = TaiKhoan.query.count()
-        # Vì TaiKhoan không có NgayTao, chúng ta sẽ không thống kê user mới
-        new_users_this_month = 0
-
+        # Toàn bộ số liệu được tính trong 3 truy vấn và cache vài giây
         return jsonify({
             'success': True,
-            'data': {
-                'products': {
-                    'total': total_products,
-                    'in_stock': in_stock,
-                    'low_stock': low_stock,
-                    'out_of_stock': out_of_stock
-                },
-                'orders': {
-                    'total': total_orders,
-                    'pending': pending_orders,
-                    'shipped': shipped_orders,
-                    'delivered': delivered_orders
-                },
-                'revenue': {
-                    'today': float(today_revenue),
-                    'month': float(month_revenue)
-                },
-                'users': {
-                    'total': total_users,
-                    'new_this_month': new_users_this_month
-                }
-            }
+            'data': DashboardService.get_quick_stats()
         })
 
     except Exception as e:
@@ -693,27 +439,14 @@ def admin_dashboard_overview():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        # Gọi các API khác để lấy dữ liệu
-        stats_response = admin_quick_stats()
-        stats_data = stats_response.get_json() if stats_response.status_code == 200 else {'data': {}}
-
-        chart_response = admin_sales_chart()
-        chart_data = chart_response.get_json() if chart_response.status_code == 200 else {'chartData': {}}
-
-        orders_response = admin_recent_orders()
-        orders_data = orders_response.get_json() if orders_response.status_code == 200 else {'orders': []}
-
-        products_response = admin_low_stock_products()
-        products_data = products_response.get_json() if products_response.status_code == 200 else {'products': []}
+        # Gọi thẳng các hàm lấy dữ liệu, chạy song song trên thread pool
+        overview, timings, errors = DashboardService.get_overview(request.args.get('period', '7'))
 
         return jsonify({
             'success': True,
-            'overview': {
-                'statistics': stats_data.get('data', {}),
-                'chart': chart_data.get('chartData', {}),
-                'recent_orders': orders_data.get('orders', []),
-                'low_stock_products': products_data.get('products', [])
-            }
+            'overview': overview,
+            'timings': timings,
+            'errors': errors
         })
 
     except Exception as e:
@@ -731,21 +464,9 @@ def admin_order_stats():
         return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
 
     try:
-        total_orders = DonHang.query.count()
-        pending_orders = DonHang.query.filter_by(Status='pending').count()
-        shipped_orders = DonHang.query.filter_by(Status='shipped').count()
-        delivered_orders = DonHang.query.filter_by(Status='delivered').count()
-        canceled_orders = DonHang.query.filter_by(Status='canceled').count()
-
         return jsonify({
             'success': True,
-            'stats': {
-                'total': total_orders,
-                'pending': pending_orders,
-                'shipped': shipped_orders,
-                'delivered': delivered_orders,
-                'canceled': canceled_orders
-            }
+            'stats': DashboardService.get_stats()['orders']
         })
 
     except Exception as e:
@@ -766,58 +487,31 @@ def admin_orders():
         status_filter = request.args.get('status')
         date_filter = request.args.get('date')
         search_filter = request.args.get('search')
-
-        # Query cơ bản với JOIN
-        orders_query = db.session.query(DonHang, TaiKhoan).join(
-            TaiKhoan, DonHang.MaTaiKhoan == TaiKhoan.MaTaiKhoan
-        )
-
-        # Áp dụng các bộ lọc
-        if status_filter:
-            orders_query = orders_query.filter(DonHang.Status == status_filter)
+        cursor = request.args.get('cursor')
+        limit = min(max(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), 1), ADMIN_MAX_PAGE_SIZE)
+        with_total = request.args.get('with_total') in ('1', 'true')
 
         if date_filter:
-            orders_query = orders_query.filter(
-                func.date(DonHang.NgayDat) == date_filter
-            )
-
-        if search_filter:
-            orders_query = orders_query.filter(
-                db.or_(
-                    DonHang.MaDonHang.like(f'%{search_filter}%'),
-                    TaiKhoan.Ho.like(f'%{search_filter}%'),
-                    TaiKhoan.Ten.like(f'%{search_filter}%')
-                )
-            )
-
-        # Sắp xếp theo ngày đặt giảm dần
-        orders_query = orders_query.order_by(DonHang.NgayDat.desc())
-
-        # Lấy kết quả
-        orders_data = orders_query.all()
-
-        result = []
-        for order_data in orders_data:
-            order, user = order_data
+            try:
+                datetime.strptime(date_filter, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Ngày không hợp lệ'}), 400
 
-            # Tạo tên đầy đủ từ Ho và Ten
-            customer_name = f"{user.Ho or ''} {user.Ten or ''}".strip()
-            if not customer_name:
-                customer_name = f"Khách hàng #{user.MaTaiKhoan}"
-
-            result.append({
-                'id': order.MaDonHang,
-                'customer_name': customer_name,
-                'date': order.NgayDat.isoformat() if order.NgayDat else '',
-                'total': float(order.TongTien) if order.TongTien else 0,
-                'status': order.Status or 'pending'
-            })
+        orders, next_cursor, total = OrderService.get_admin_orders_page(
+            status_filter, date_filter, search_filter, cursor, limit, with_total
+        )
 
-        return jsonify({
+        result = {
             'success': True,
-            'orders': result,
-            'total': len(result)
-        })
+            'orders': orders,
+            'count': len(orders),
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        # total luôn là tổng số khớp bộ lọc, chỉ có khi yêu cầu with_total
+        if with_total:
+            result['total'] = total
+        return jsonify(result)
 
     except Exception as e:
         print(f"Error loading orders: {str(e)}")
@@ -920,17 +614,25 @@ def admin_update_order_status(order_id):
                 'message': 'Trạng thái không hợp lệ'
             }), 400
 
-        # Tìm đơn hàng
-        order = DonHang.query.get(order_id)
+        # Tìm đơn hàng (khóa dòng để tồn kho chỉ được hoàn/giữ một lần)
+        order = DonHang.query.filter_by(MaDonHang=order_id).with_for_update().first()
         if not order:
             return jsonify({
                 'success': False,
                 'message': 'Không tìm thấy đơn hàng'
             }), 404
 
-        # Cập nhật trạng thái
+        # Hủy đơn thì hoàn kho, mở lại đơn đã hủy thì giữ kho lại
+        success, message = InventoryService.apply_status_change(order.MaDonHang, order.Status, new_status)
+        if not success:
+            return jsonify({'success': False, 'message': message}), 400
+
+        # Cập nhật trạng thái (và bảng tổng hợp doanh thu trong cùng transaction)
+        RevenueRollupService.record_status_change(order.NgayDat, order.TongTien, order.Status, new_status)
         order.Status = new_status
         db.session.commit()
+        DashboardService.invalidate()
+        ProductService.invalidate_catalog()
 
         return jsonify({
             'success': True,
@@ -946,6 +648,29 @@ def admin_update_order_status(order_id):
         }), 500
 
 
+# API bật/tắt tồn kho chia mảnh cho sản phẩm bán chạy
+@admin_app.route('/api/admin/products/<int:product_id>/hot-stock', methods=['POST'])
+def admin_product_hot_stock(product_id):
+    """API bật/tắt tồn kho chia mảnh ({"enabled": true, "shards": 8})"""
+    if not require_admin_auth():
+        return jsonify({'success': False, 'message': 'Không có quyền truy cập!'}), 403
+
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get('enabled', True):
+            success, message = HotStockService.enable(product_id, data.get('shards'))
+        else:
+            success, message = HotStockService.disable(product_id)
+        if not success:
+            return jsonify({'success': False, 'message': message}), 400
+
+        ProductService.invalidate_catalog()
+        return jsonify({'success': True, 'message': message})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
+
+
 # API thống kê khách hàng
 @admin_app.route('/api/admin/customer-stats')
 def admin_customer_stats():
@@ -1003,81 +728,27 @@ def admin_customers():
         status_filter = request.args.get('status')
         order_filter = request.args.get('order')
         search_filter = request.args.get('search')
+        sort = request.args.get('sort', 'id')
+        direction = request.args.get('dir', 'desc')
+        cursor = request.args.get('cursor')
+        limit = min(max(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), 1), ADMIN_MAX_PAGE_SIZE)
+        with_total = request.args.get('with_total') in ('1', 'true')
+
+        customers, next_cursor, total = CustomerService.get_admin_customers_page(
+            status_filter, order_filter, search_filter, sort, direction, cursor, limit, with_total
+        )
 
-        # Query cơ bản với LEFT JOIN để lấy thông tin email và thống kê đơn hàng
-        from sqlalchemy import case
-
-        customers_query = db.session.query(
-            TaiKhoan,
-            DangNhap.DiaChiEmail,
-            func.count(DonHang.MaDonHang).label('total_orders'),
-            func.sum(
-                case(
-                    (DonHang.Status.in_(['delivered', 'shipped']), DonHang.TongTien),
-                    else_=0
-                )
-            ).label('total_spent')
-        ).outerjoin(
-            DangNhap, TaiKhoan.MaTaiKhoan == DangNhap.MaTaiKhoan
-        ).outerjoin(
-            DonHang, TaiKhoan.MaTaiKhoan == DonHang.MaTaiKhoan
-        ).group_by(TaiKhoan.MaTaiKhoan, DangNhap.DiaChiEmail)
-
-        # Áp dụng các bộ lọc
-        if search_filter:
-            customers_query = customers_query.filter(
-                db.or_(
-                    TaiKhoan.MaTaiKhoan.like(f'%{search_filter}%'),
-                    TaiKhoan.Ho.like(f'%{search_filter}%'),
-                    TaiKhoan.Ten.like(f'%{search_filter}%'),
-                    DangNhap.DiaChiEmail.like(f'%{search_filter}%')
-                )
-            )
-
-        # Sắp xếp theo mã tài khoản giảm dần
-        customers_query = customers_query.order_by(TaiKhoan.MaTaiKhoan.desc())
-
-        # Lấy kết quả
-        customers_data = customers_query.all()
-
-        result = []
-        for customer_data in customers_data:
-            customer, email, total_orders, total_spent = customer_data
-
-            # Tạo tên đầy đủ
-            full_name = f"{customer.Ho or ''} {customer.Ten or ''}".strip()
-            if not full_name:
-                full_name = f"Khách hàng #{customer.MaTaiKhoan}"
-
-            # Xác định trạng thái
-            status = 'active' if total_orders > 0 else 'inactive'
-
-            # Áp dụng bộ lọc trạng thái
-            if status_filter and status != status_filter:
-                continue
-
-            # Áp dụng bộ lọc đơn hàng
-            if order_filter:
-                if order_filter == 'has_orders' and total_orders == 0:
-                    continue
-                elif order_filter == 'no_orders' and total_orders > 0:
-                    continue
-
-            result.append({
-                'id': customer.MaTaiKhoan,
-                'full_name': full_name,
-                'email': email,
-                'phone': customer.SoDienThoai,
-                'total_orders': total_orders or 0,
-                'total_spent': float(total_spent) if total_spent else 0,
-                'status': status
-            })
-
-        return jsonify({
+        result = {
             'success': True,
-            'customers': result,
-            'total': len(result)
-        })
+            'customers': customers,
+            'count': len(customers),
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        # total luôn là tổng số khớp bộ lọc, chỉ có khi yêu cầu with_total
+        if with_total:
+            result['total'] = total
+        return jsonify(result)
 
     except Exception as e:
         print(f"Error loading customers: {str(e)}")
@@ -1,10 +1,13 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-import cloudinary
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 from models import db, TaiKhoan, DangNhap, DonHang, ChiTiet_DonHang, DiaChi, SanPham, GioHang, GioHang_SanPham
-from sqlalchemy import desc
-from services import AuthService, ProductService, CartService, OrderService
+from sqlalchemy import desc, insert
+from sqlalchemy.exc import IntegrityError
+from models.migrations import report_missing_indexes, upgrade_schema
+import services.image_storage as image_storage
+from services import AuthService, ProductService, CartService, OrderService, RevenueRollupService, \
+    InventoryService
 
 # Import controllers
 try:
@@ -53,12 +56,8 @@ app.config.from_object(Config)
 # Khởi tạo database
 db.init_app(app)
 
-cloudinary.config(
-    cloud_name=app.config['CLOUDINARY_CLOUD_NAME'],
-    api_key=app.config['CLOUDINARY_API_KEY'],
-    api_secret=app.config['CLOUDINARY_API_SECRET'],
-    secure=True
-)
+# Nơi lưu ảnh sản phẩm (Cloudinary hoặc đĩa cục bộ, xem IMAGE_STORAGE)
+image_storage.init_app(app)
 
 # Đăng ký blueprints
 if auth_imported:
@@ -81,6 +80,10 @@ with app.app_context():
     except Exception as e:
         print(f"Error creating database tables: {e}")
 
+    # Áp dụng migration còn thiếu; database vẫn thiếu cột thì dừng luôn (RuntimeError)
+    upgrade_schema(app.config.get('AUTO_MIGRATE', True))
+    report_missing_indexes('')
+
 
 # Route trang chủ
 @app.route('/')
@@ -96,34 +99,19 @@ def shop():
     category = request.args.get('category', '')
     search = request.args.get('search', '')
     sort_by = request.args.get('sort', 'name')
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    per_page = app.config.get('PRODUCTS_PER_PAGE', 24)
 
-    products = ProductService.get_all_products()
-
-    # Filter theo category
-    if category:
-        products = [p for p in products if p['type'].lower() == category.lower()]
-
-    # Filter theo search
-    if search:
-        search_lower = search.lower()
-        products = [p for p in products if
-                    search_lower in p['name'].lower() or
-                    search_lower in p['brand'].lower() or
-                    search_lower in p['description'].lower()]
-
-    # Sorting
-    if sort_by == 'price_low':
-        products.sort(key=lambda x: x['price'])
-    elif sort_by == 'price_high':
-        products.sort(key=lambda x: x['price'], reverse=True)
-    else:  # sort by name
-        products.sort(key=lambda x: x['name'])
+    # Lọc, sắp xếp, phân trang trong SQL (trang sâu đi tiếp bằng cursor)
+    products, next_cursor, total = ProductService.query_products(category, search, sort_by, page, per_page, cursor)
 
     return render_template('products.html',  # SỬA: Dùng products.html thay vì layout/products.html
                            products=products,
                            current_category=category,
                            current_search=search,
-                           current_sort=sort_by)
+                           current_sort=sort_by,
+                           pagination=ProductService.pagination(page, per_page, total, cursor, next_cursor))
 
 
 # Route chi tiết sản phẩm
@@ -189,8 +177,7 @@ def add_to_cart():
 
         if success:
             # Lấy số lượng cart hiện tại để trả về
-            cart_items = CartService.get_cart_items(session['user_id'])
-            cart_count = sum(item['quantity'] for item in cart_items)
+            cart_count = CartService.get_cart_count(session['user_id'])
 
             return jsonify({
                 'success': True,
@@ -223,7 +210,8 @@ def checkout():
     return render_template('checkout.html',
                            cart_items=cart_items,
                            total=total,
-                           addresses=addresses)
+                           addresses=addresses,
+                           order_token=OrderService.new_order_token())
 
 
 # Route đặt hàng
@@ -239,6 +227,12 @@ def place_order():
         note = request.form.get('note', '')
         selected_products = request.form.getlist('selected_products[]')
         selected_quantities = request.form.getlist('selected_quantities[]')
+        order_token = request.form.get('order_token') or None
+
+        # Gửi lại cùng một form (double click, retry): trả về đơn đã tạo
+        existing_order_id = OrderService.find_order_by_token(session['user_id'], order_token)
+        if existing_order_id:
+            return redirect(url_for('order_success', order_id=existing_order_id))
 
         if not address_id:
             flash('Vui lòng chọn địa chỉ giao hàng!', 'error')
@@ -255,71 +249,67 @@ def place_order():
             return redirect(url_for('cart'))
 
         # Tạo danh sách sản phẩm được chọn với thông tin chi tiết
-        selected_items = []
-        total_amount = 0
-
+        cart_by_id = {item['id']: item for item in all_cart_items}
+        ordered = {}
         for i, product_id in enumerate(selected_products):
+            product_id = int(product_id)
             quantity = int(selected_quantities[i])
+            # Bỏ qua sản phẩm không còn trong giỏ hàng
+            if product_id in cart_by_id and quantity > 0:
+                ordered[product_id] = ordered.get(product_id, 0) + quantity
 
-            # Tìm sản phẩm trong giỏ hàng
-            cart_item = next((item for item in all_cart_items if item['id'] == int(product_id)), None)
-
-            if cart_item:
-                selected_items.append({
-                    'id': int(product_id),
-                    'quantity': quantity,
-                    'price': cart_item['price']
-                })
-                total_amount += cart_item['price'] * quantity
+        selected_items = [
+            {'id': product_id, 'quantity': quantity, 'price': cart_by_id[product_id]['price']}
+            for product_id, quantity in ordered.items()
+        ]
+        total_amount = sum(item['price'] * item['quantity'] for item in selected_items)
 
         if not selected_items:
             flash('Không tìm thấy sản phẩm được chọn!', 'error')
             return redirect(url_for('checkout'))
 
         # Tạo đơn hàng mới
-        from models import DonHang, ChiTiet_DonHang, GioHang, GioHang_SanPham
+        from models import DonHang, ChiTiet_DonHang
 
         new_order = DonHang(
             MaTaiKhoan=session['user_id'],
             MaDiaChi=int(address_id),
             TongTien=total_amount,
-            Status='pending'
+            Status='pending',
+            MaYeuCau=order_token
         )
 
         db.session.add(new_order)
-        db.session.flush()  # Để lấy MaDonHang
-
-        # Thêm chi tiết đơn hàng cho các sản phẩm được chọn
-        for item in selected_items:
-            order_detail = ChiTiet_DonHang(
-                MaDonHang=new_order.MaDonHang,
-                MaSanPham=item['id'],
-                SoLuong=item['quantity'],
-                DonGia=item['price']
-            )
-            db.session.add(order_detail)
-
-        # Chỉ xóa những sản phẩm được chọn khỏi giỏ hàng
-        user_cart = GioHang.query.filter_by(MaTaiKhoan=session['user_id']).first()
-        if user_cart:
-            for item in selected_items:
-                # Xóa sản phẩm được chọn khỏi giỏ hàng
-                cart_product = GioHang_SanPham.query.filter_by(
-                    MaGioHang=user_cart.MaGioHang,
-                    MaSanPham=item['id']
-                ).first()
-
-                if cart_product:
-                    if cart_product.SoLuong <= item['quantity']:
-                        # Nếu số lượng đặt hàng >= số lượng trong giỏ, xóa hoàn toàn
-                        db.session.delete(cart_product)
-                    else:
-                        # Nếu chỉ đặt một phần, giảm số lượng trong giỏ
-                        cart_product.SoLuong -= item['quantity']
-
-            # Cập nhật tổng số lượng trong giỏ hàng
-            remaining_items = GioHang_SanPham.query.filter_by(MaGioHang=user_cart.MaGioHang).all()
-            user_cart.TongSoLuong = sum(item.SoLuong for item in remaining_items)
+        try:
+            db.session.flush()  # Để lấy MaDonHang
+        except IntegrityError:
+            # Request trùng mã yêu cầu vừa tạo đơn xong
+            db.session.rollback()
+            existing_order_id = OrderService.find_order_by_token(session['user_id'], order_token)
+            if existing_order_id:
+                return redirect(url_for('order_success', order_id=existing_order_id))
+            raise
+        RevenueRollupService.record_order(new_order.NgayDat, 'pending', total_amount)
+
+        # Thêm chi tiết đơn hàng cho các sản phẩm được chọn (một lệnh insert nhiều dòng)
+        db.session.execute(insert(ChiTiet_DonHang), [
+            {
+                'MaDonHang': new_order.MaDonHang,
+                'MaSanPham': item['id'],
+                'SoLuong': item['quantity'],
+                'DonGia': item['price']
+            }
+            for item in selected_items
+        ])
+
+        # Chỉ bỏ những sản phẩm được chọn khỏi giỏ hàng
+        CartService.remove_ordered_items(session['user_id'], ordered)
+
+        # Giữ tồn kho ngay trước commit, hết hàng thì hủy toàn bộ đơn
+        if not InventoryService.reserve(ordered):
+            db.session.rollback()
+            flash(InventoryService.shortage_message(ordered), 'error')
+            return redirect(url_for('checkout'))
 
         db.session.commit()
 
@@ -379,11 +369,11 @@ def cancel_order():
         if not order_id:
             return jsonify({'success': False, 'message': 'Thiếu thông tin đơn hàng!'}), 400
 
-        # Tìm đơn hàng
+        # Tìm đơn hàng (khóa dòng để không hoàn kho hai lần)
         order = DonHang.query.filter_by(
             MaDonHang=order_id,
             MaTaiKhoan=session['user_id']
-        ).first()
+        ).with_for_update().first()
 
         if not order:
             return jsonify({'success': False, 'message': 'Không tìm thấy đơn hàng!'}), 404
@@ -396,16 +386,15 @@ def cancel_order():
             }), 400
 
         # Cập nhật trạng thái đơn hàng thành 'canceled'
-        order.Status = 'canceled'
+        RevenueRollupService.record_status_change(order.NgayDat, order.TongTien, order.Status, 'canceled')
 
-        # Hoàn lại số lượng sản phẩm trong kho
-        for chi_tiet in order.chi_tiets:
-            san_pham = SanPham.query.get(chi_tiet.MaSanPham)
-            if san_pham:
-                san_pham.SoLuong += chi_tiet.SoLuong
+        # Hoàn lại số lượng sản phẩm trong kho bằng một câu UPDATE
+        InventoryService.apply_status_change(order.MaDonHang, order.Status, 'canceled')
+        order.Status = 'canceled'
 
         # Lưu thay đổi
         db.session.commit()
+        ProductService.invalidate_catalog()
 
         return jsonify({
             'success': True,
@@ -472,8 +461,8 @@ def inject_user():
     cart_count = 0
     if 'user_id' in session:
         try:
-            cart_items = CartService.get_cart_items(session['user_id'])
-            cart_count = sum(item['quantity'] for item in cart_items)
+            # Đọc TongSoLuong đã lưu sẵn thay vì load toàn bộ giỏ hàng
+            cart_count = CartService.get_cart_count(session['user_id'])
         except:
             cart_count = 0
 
@@ -0,0 +1,17 @@
+from flask import Flask
+from config import Config
+from models import db
+import services.image_storage as image_storage
+
+
+def create_app():
+    """App tối thiểu (config, database, nơi lưu ảnh) cho các script bảo trì
+
+    Khác app.py/admin_app.py: không tạo bảng, không backfill, không chạy lại
+    upload dang dở và không khởi động thread nền khi import.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    image_storage.init_app(app)
+    return app
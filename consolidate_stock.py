@@ -0,0 +1,43 @@
+import sys
+import time
+
+from app_factory import create_app
+from models import db
+from services.services import HotStockService
+
+
+def main():
+    """Gộp tồn kho chia mảnh (TonKhoManh) về SanPham.SoLuong
+
+    Chạy đúng một process này cho cả hai app: lặp mỗi
+    STOCK_CONSOLIDATION_INTERVAL giây (mặc định 5), hoặc chạy một lần với
+    --once (ví dụ từ cron).
+    """
+    app = create_app()
+    once = '--once' in sys.argv[1:]
+    interval = app.config.get('STOCK_CONSOLIDATION_INTERVAL', HotStockService.DEFAULT_INTERVAL)
+    if not once and (not interval or interval <= 0):
+        print("   ⚠️  STOCK_CONSOLIDATION_INTERVAL <= 0, nothing to do.")
+        return
+
+    print("📦 Consolidating hot stock shards...")
+    while True:
+        with app.app_context():
+            try:
+                rebalanced = HotStockService.consolidate()
+                if rebalanced:
+                    print(f"   🔁 Rebalanced shards of {rebalanced} products.")
+            except Exception as e:
+                db.session.rollback()
+                print(f"   ❌ Consolidation failed: {e}")
+            finally:
+                db.session.remove()
+
+        if once:
+            print("   ✅ Done!")
+            return
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from services.services import ProductService, AuthService, OrderService
+from services.services import ProductService, AuthService, OrderService, RevenueRollupService, InventoryService, \
+    HotStockService, ImageUploadService
 from models import db, SanPham, Loai, TaiKhoan, DonHang
 
 # Tạo blueprint cho admin
@@ -91,24 +92,12 @@ def add_product():
             # Ưu tiên lấy URL từ hidden input (khi upload qua API /api/admin/upload-image)
             hinh_anh_url = request.form.get('hinhAnhUrl')
 
-            # Nếu không có URL thì fallback sang upload trực tiếp file từ form
+            # Nếu không có URL thì fallback sang upload file từ form (chạy nền sau khi tạo sản phẩm)
+            file = None
             if not hinh_anh_url and 'hinhAnh' in request.files and request.files['hinhAnh'].filename != '':
                 file = request.files['hinhAnh']
-                try:
-                    import cloudinary.uploader
-                    result = cloudinary.uploader.upload(
-                        file,
-                        folder="pet_shop/products",
-                        resource_type="auto",
-                        transformation=[
-                            {'quality': 'auto:good'},
-                            {'format': 'auto'},
-                            {'width': 800, 'height': 600, 'crop': 'limit'}
-                        ]
-                    )
-                    hinh_anh_url = result['secure_url']
-                except Exception as e:
-                    flash(f'Lỗi upload ảnh: {str(e)}', 'error')
+                if not ImageUploadService.allowed_file(file.filename):
+                    flash('Lỗi upload ảnh: định dạng file không hợp lệ', 'error')
                     categories = Loai.query.all()
                     return render_template('manage_product.html', categories=categories, mode='add')
 
@@ -133,6 +122,15 @@ def add_product():
 
             db.session.add(san_pham)
             db.session.commit()
+            ProductService.invalidate_catalog()
+
+            if file:
+                try:
+                    ImageUploadService.submit(file, product_id=san_pham.MaSanPham)
+                    flash('Thêm sản phẩm thành công! Ảnh đang được xử lý.', 'success')
+                except Exception as e:
+                    flash(f'Thêm sản phẩm thành công nhưng lỗi upload ảnh: {str(e)}', 'error')
+                return redirect(url_for('admin.manage_products'))
 
             flash('Thêm sản phẩm thành công!', 'success')
             return redirect(url_for('admin.manage_products'))
@@ -170,6 +168,8 @@ def edit_product(product_id):
             product.GiaNhap = float(request.form.get('giaNhap', '0')) if request.form.get('giaNhap') else None
             product.GiaBan = float(request.form.get('giaBan', '0'))
             product.SoLuong = int(request.form.get('soLuong', '0'))
+            # Sản phẩm đang chia mảnh: chia lại số lượng mới cho các mảnh
+            HotStockService.set_stock(product.MaSanPham, product.SoLuong)
             product.ThungHieu = request.form.get('thuongHieu', '').strip()
             product.MoTa = request.form.get('moTa', '').strip()
             product.MaLoai = int(request.form.get('maLoai'))
@@ -183,6 +183,7 @@ def edit_product(product_id):
             # ===============================================
 
             db.session.commit()
+            ProductService.invalidate_catalog()
             flash('Cập nhật sản phẩm thành công!', 'success')
             return redirect(url_for('admin.manage_products'))
 
@@ -210,6 +211,7 @@ def delete_product(product_id):
         product = SanPham.query.get_or_404(product_id)
         product.TrangThai = 0  # Soft delete
         db.session.commit()
+        ProductService.invalidate_catalog()
 
         return jsonify({'success': True, 'message': 'Xóa sản phẩm thành công!'})
 
@@ -308,9 +310,15 @@ def update_order_status():
         if not order_id or not new_status:
             return jsonify({'success': False, 'message': 'Thiếu thông tin!'}), 400
 
-        order = DonHang.query.get_or_404(order_id)
+        order = DonHang.query.filter_by(MaDonHang=order_id).with_for_update().first_or_404()
+        success, message = InventoryService.apply_status_change(order.MaDonHang, order.Status, new_status)
+        if not success:
+            return jsonify({'success': False, 'message': message}), 400
+
+        RevenueRollupService.record_status_change(order.NgayDat, order.TongTien, order.Status, new_status)
         order.Status = new_status
         db.session.commit()
+        ProductService.invalidate_catalog()
 
         return jsonify({'success': True, 'message': 'Cập nhật trạng thái thành công!'})
 
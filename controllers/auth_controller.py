@@ -1,5 +1,5 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from services import AuthService
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from services import AuthService, OrderService
 from models import TaiKhoan, DangNhap, DonHang, ChiTiet_DonHang, DiaChi
 from sqlalchemy import desc
 
@@ -79,11 +79,15 @@ def profile():
         # Lấy danh sách địa chỉ
         addresses = AuthService.get_user_addresses(session['user_id'])
 
-        # Lấy danh sách đơn hàng (sắp xếp theo ngày đặt mới nhất)
-        orders = DonHang.query.filter_by(MaTaiKhoan=session['user_id']).order_by(desc(DonHang.NgayDat)).all()
+        # Lấy một trang đơn hàng (sắp xếp theo ngày đặt mới nhất), chi tiết được load theo lô
+        orders, next_orders_cursor = OrderService.get_user_orders_page(
+            session['user_id'], request.args.get('orders_before'),
+            current_app.config.get('ORDERS_PER_PAGE', 20)
+        )
 
         # Truyền orders vào template
-        return render_template('profile.html', user=user_info, addresses=addresses, orders=orders)
+        return render_template('profile.html', user=user_info, addresses=addresses, orders=orders,
+                               next_orders_cursor=next_orders_cursor)
 
     except Exception as e:
         flash(f'Có lỗi xảy ra: {str(e)}', 'error')
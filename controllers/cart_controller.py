@@ -79,8 +79,7 @@ def add_to_cart():
 
         if success:
             # Lấy số lượng item trong giỏ hàng để cập nhật UI
-            cart_items = CartService.get_cart_items(session['user_id'])
-            cart_count = len(cart_items)
+            cart_count = CartService.get_cart_line_count(session['user_id'])
 
             return jsonify({
                 'success': True,
@@ -251,10 +250,10 @@ def api_cart_count():
         return jsonify({'count': 0})
 
     try:
-        cart_items = CartService.get_cart_items(session['user_id'])
+        # Đếm bằng COUNT và cột TongSoLuong, không load các item trong giỏ
         return jsonify({
-            'count': len(cart_items),
-            'total_quantity': sum(item['quantity'] for item in cart_items)
+            'count': CartService.get_cart_line_count(session['user_id']),
+            'total_quantity': CartService.get_cart_count(session['user_id'])
         })
     except Exception as e:
         return jsonify({'count': 0})
\ No newline at end of file
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app
 from services import ProductService
 
 # Tạo blueprint cho products
@@ -9,53 +9,24 @@ product_bp = Blueprint('product', __name__)
 def list_products():
     """Danh sách tất cả sản phẩm"""
 
-    # DEBUG: Kiểm tra dữ liệu
-    from models.models import SanPham, Loai
-    print("=== DEBUG INFO ===")
-    san_phams = SanPham.query.all()
-    print(f"Tổng số sản phẩm trong DB: {len(san_phams)}")
-    for sp in san_phams[:3]:  # In 3 sản phẩm đầu
-        print(f"ID: {sp.MaSanPham}, Tên: {sp.TenSanPham}, Trạng thái: {sp.TrangThai}")
-
-    loais = Loai.query.all()
-    print(f"Tổng số loại: {len(loais)}")
-    for loai in loais:
-        print(f"Loại ID: {loai.MaLoai}, Tên: {loai.TenLoai}")
-    print("=== END DEBUG ===")
-
     # Lấy parameters từ query string
     category = request.args.get('category', '')
     search = request.args.get('search', '')
     sort_by = request.args.get('sort', 'name')  # name, price_low, price_high
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    per_page = current_app.config.get('PRODUCTS_PER_PAGE', 24)
 
-    products = ProductService.get_all_products()
-
-    # Filter theo category
-    if category:
-        products = [p for p in products if p['type'].lower() == category.lower()]
-
-    # Filter theo search
-    if search:
-        search_lower = search.lower()
-        products = [p for p in products if
-                    search_lower in p['name'].lower() or
-                    search_lower in p['brand'].lower() or
-                    search_lower in p['description'].lower()]
-
-    # Sorting
-    if sort_by == 'price_low':
-        products.sort(key=lambda x: x['price'])
-    elif sort_by == 'price_high':
-        products.sort(key=lambda x: x['price'], reverse=True)
-    else:  # sort by name
-        products.sort(key=lambda x: x['name'])
+    # Lọc, sắp xếp, phân trang trong SQL (trang sâu đi tiếp bằng cursor)
+    products, next_cursor, total = ProductService.query_products(category, search, sort_by, page, per_page, cursor)
 
     # SỬA: Đổi từ 'products/list.html' thành 'products.html'
     return render_template('products.html',
                            products=products,
                            current_category=category,
                            current_search=search,
-                           current_sort=sort_by)
+                           current_sort=sort_by,
+                           pagination=ProductService.pagination(page, per_page, total, cursor, next_cursor))
 
 
 @product_bp.route('/product/<int:product_id>')
@@ -84,60 +55,40 @@ def api_products():
     try:
         category = request.args.get('category', '')
         search = request.args.get('search', '')
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', current_app.config.get('PRODUCTS_PER_PAGE', 24), type=int)
+        per_page = min(max(per_page, 1), ProductService.MAX_PER_PAGE)
+
+        # Không tìm kiếm: lọc + phân trang trong SQL
+        if not search:
+            cursor = request.args.get('cursor')
+            products, next_cursor, total = ProductService.query_products(
+                category, None, request.args.get('sort', 'name'), page, per_page, cursor
+            )
+            result = {
+                'success': True,
+                'products': products,
+                'page': None if cursor else page,
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+            # total chỉ có khi đã đếm đủ (trang đầu/OFFSET và không quá COUNT_LIMIT)
+            if total is not None and total <= ProductService.COUNT_LIMIT:
+                result['total'] = total
+            return jsonify(result)
 
-        products = ProductService.get_all_products()
-
-        # Filter theo category
-        if category:
-            products = [p for p in products if p['type'].lower() == category.lower()]
-
-        # Filter theo search - Improved fuzzy search
-        if search:
-            search_lower = search.lower().strip()
-            search_words = search_lower.split()  # Tách thành từng từ
-
-            filtered_products = []
-            for product in products:
-                # Tạo chuỗi tìm kiếm từ tất cả thông tin sản phẩm
-                searchable_text = f"{product['name']} {product.get('brand', '')} {product.get('description', '')} {product['type']}".lower()
-
-                # Tính điểm matching
-                score = 0
-
-                # Kiểm tra từng từ khóa
-                for word in search_words:
-                    if word in searchable_text:
-                        # Bonus điểm nếu từ khóa xuất hiện trong tên
-                        if word in product['name'].lower():
-                            score += 3
-                        # Bonus điểm nếu từ khóa xuất hiện trong brand
-                        elif word in product.get('brand', '').lower():
-                            score += 2
-                        # Điểm thường nếu xuất hiện trong mô tả hoặc type
-                        else:
-                            score += 1
-
-                # Kiểm tra tìm kiếm mờ (fuzzy search) cho từ khóa dài
-                if len(search_lower) > 3:
-                    if any(word in search_lower for word in searchable_text.split() if len(word) > 2):
-                        score += 1
-
-                # Nếu có điểm > 0 thì thêm vào kết quả
-                if score > 0:
-                    product['search_score'] = score
-                    filtered_products.append(product)
-
-            # Sắp xếp theo điểm cao nhất
-            products = sorted(filtered_products, key=lambda x: x.get('search_score', 0), reverse=True)
-
-            # Xóa search_score khỏi kết quả trả về
-            for product in products:
-                product.pop('search_score', None)
+        # Tìm kiếm qua inverted index (không dấu, khớp tiền tố, ưu tiên tên > thương hiệu > mô tả)
+        products = ProductService.search_products(search, category)
+        total = len(products)
+        start = (max(page, 1) - 1) * per_page
 
         return jsonify({
             'success': True,
-            'products': products,
-            'total': len(products)
+            'products': products[start:start + per_page],
+            'total': total,
+            'page': page,
+            'per_page': per_page
         })
 
     except Exception as e:
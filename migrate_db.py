@@ -0,0 +1,28 @@
+from app_factory import create_app
+from models import db
+from models.migrations import MIGRATIONS, apply_migrations, missing_indexes
+
+
+def main():
+    """Áp dụng các migration schema còn thiếu (index, ràng buộc)"""
+    print("🛠️  Applying schema migrations...")
+    with create_app().app_context():
+        try:
+            db.create_all()
+            applied = apply_migrations()
+        except Exception as e:
+            print(f"   ❌ Migration failed: {e}")
+            return
+
+        descriptions = {version: description for version, description, _ in MIGRATIONS}
+        for version in applied:
+            print(f"   ✅ {version}: {descriptions[version]}")
+        if not applied:
+            print("   ✅ Schema is up to date.")
+
+        for table_name, index_name, columns in missing_indexes():
+            print(f"   ⚠️  Still missing {index_name} on {table_name}({', '.join(columns)})")
+
+
+if __name__ == '__main__':
+    main()
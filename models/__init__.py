@@ -10,5 +10,11 @@ from .models import (
     GioHang,
     GioHang_SanPham,
     DonHang,
-    ChiTiet_DonHang
+    ChiTiet_DonHang,
+    DoanhThuNgay,
+    TonKhoManh,
+    TacVuTaiAnh,
+    AnhSanPham,
+    PhienBanCache,
+    PhienBanCSDL
 )
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""Migration schema có đánh số phiên bản.
+
+db.create_all() chỉ tạo bảng còn thiếu, không thêm index/ràng buộc vào bảng
+đã có. Các migration ở đây được áp dụng lần lượt theo số phiên bản và ghi
+lại trong bảng PhienBanCSDL; mỗi bước đều kiểm tra trạng thái hiện tại nên
+chạy lại trên database mới tạo bằng create_all() cũng không lỗi.
+
+Hai app tự áp dụng migration còn thiếu khi khởi động (upgrade_schema, tắt
+bằng AUTO_MIGRATE = False); chạy tay bằng: python migrate_db.py
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, func, select, update, delete, text
+from sqlalchemy.schema import CreateColumn
+from models.models import db, GioHang, GioHang_SanPham, PhienBanCSDL
+
+
+def _model_index(name):
+    """Tìm Index khai báo trong models theo tên"""
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+
+def _index_exists(inspector, index):
+    """Index được coi là đã có nếu trùng tên, hoặc có index khác bắt đầu
+    bằng đúng các cột đó (ví dụ index MySQL tự tạo cho khóa ngoại)"""
+    table_name = index.table.name
+    columns = [column.name for column in index.columns]
+
+    existing = [
+        (item['name'], item['column_names'], bool(item.get('unique')))
+        for item in inspector.get_indexes(table_name)
+    ]
+    existing += [
+        (item['name'], item['column_names'], True)
+        for item in inspector.get_unique_constraints(table_name)
+    ]
+    pk_columns = inspector.get_pk_constraint(table_name).get('constrained_columns') or []
+    if pk_columns:
+        existing.append(('PRIMARY', pk_columns, True))
+
+    for name, column_names, unique in existing:
+        if name == index.name:
+            return True
+        if index.unique:
+            # Ràng buộc duy nhất chỉ được thay bằng index duy nhất trên đúng các cột đó
+            if unique and column_names == columns:
+                return True
+        elif column_names[:len(columns)] == columns:
+            return True
+    return False
+
+
+def _create_indexes(*names):
+    """Tạo các index khai báo trong models nếu database chưa có"""
+    def migrate(connection):
+        inspector = inspect(connection)
+        for name in names:
+            index = _model_index(name)
+            if not _index_exists(inspector, index):
+                index.create(connection)
+    return migrate
+
+
+def _add_columns(table_name, *column_names):
+    """Thêm các cột khai báo trong models vào bảng đã có nếu database chưa có"""
+    def migrate(connection):
+        table = db.metadata.tables[table_name]
+        existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+        preparer = connection.dialect.identifier_preparer
+        for name in column_names:
+            if name in existing:
+                continue
+            column_spec = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_spec}"))
+    return migrate
+
+
+def _run_all(*steps):
+    """Gộp nhiều bước vào cùng một phiên bản migration"""
+    def migrate(connection):
+        for step in steps:
+            step(connection)
+    return migrate
+
+
+def _merge_duplicate_carts(connection):
+    """Gộp các giỏ hàng trùng MaTaiKhoan vào giỏ có mã nhỏ nhất
+    để có thể thêm ràng buộc duy nhất trên GioHang.MaTaiKhoan"""
+    duplicates = connection.execute(
+        select(GioHang.MaTaiKhoan, func.min(GioHang.MaGioHang))
+        .group_by(GioHang.MaTaiKhoan)
+        .having(func.count(GioHang.MaGioHang) > 1)
+    ).all()
+
+    for ma_tai_khoan, keep_id in duplicates:
+        other_ids = connection.execute(
+            select(GioHang.MaGioHang).where(
+                GioHang.MaTaiKhoan == ma_tai_khoan,
+                GioHang.MaGioHang != keep_id
+            )
+        ).scalars().all()
+
+        kept = dict(connection.execute(
+            select(GioHang_SanPham.MaSanPham, GioHang_SanPham.SoLuong)
+            .where(GioHang_SanPham.MaGioHang == keep_id)
+        ).all())
+
+        items = connection.execute(
+            select(GioHang_SanPham.MaSanPham, GioHang_SanPham.SoLuong)
+            .where(GioHang_SanPham.MaGioHang.in_(other_ids))
+        ).all()
+        for ma_san_pham, so_luong in items:
+            kept[ma_san_pham] = kept.get(ma_san_pham, 0) + (so_luong or 0)
+
+        # Ghi lại toàn bộ dòng của giỏ được giữ
+        connection.execute(delete(GioHang_SanPham).where(
+            GioHang_SanPham.MaGioHang.in_(other_ids + [keep_id])
+        ))
+        if kept:
+            connection.execute(GioHang_SanPham.__table__.insert(), [
+                {'MaGioHang': keep_id, 'MaSanPham': ma_san_pham, 'SoLuong': so_luong}
+                for ma_san_pham, so_luong in kept.items()
+            ])
+        connection.execute(delete(GioHang).where(GioHang.MaGioHang.in_(other_ids)))
+        connection.execute(
+            update(GioHang).where(GioHang.MaGioHang == keep_id).values(TongSoLuong=sum(kept.values()))
+        )
+
+
+# (phiên bản, mô tả, hàm nhận connection) - chỉ thêm vào cuối, không sửa bước đã phát hành
+MIGRATIONS = [
+    (1, 'Gộp giỏ hàng trùng tài khoản', _merge_duplicate_carts),
+    (2, 'Index cho các điều kiện truy vấn thường dùng', _create_indexes(
+        'ix_DonHang_MaTaiKhoan_NgayDat',
+        'ix_DonHang_Status_NgayDat',
+        'ix_SanPham_TrangThai_MaLoai_GiaBan',
+        'ix_DangNhap_MaTaiKhoan',
+        'ix_DiaChi_MaTaiKhoan',
+        'ix_ChiTiet_DonHang_MaDonHang',
+        'ix_ChiTiet_DonHang_MaSanPham',
+    )),
+    (3, 'Ràng buộc mỗi tài khoản một giỏ hàng', _create_indexes('uq_GioHang_MaTaiKhoan')),
+    (4, 'Index tìm kiếm khách hàng theo email và tên', _create_indexes(
+        'ix_DangNhap_DiaChiEmail',
+        'ix_TaiKhoan_Ten',
+        'ft_TaiKhoan_Ho_Ten',
+    )),
+    (5, 'Mã yêu cầu đặt hàng chống tạo đơn trùng', _run_all(
+        _add_columns('DonHang', 'MaYeuCau'),
+        _create_indexes('uq_DonHang_MaYeuCau'),
+    )),
+    (6, 'Mã băm nội dung ảnh chống upload trùng', _run_all(
+        _add_columns('AnhSanPham', 'MaBam'),
+        _create_indexes('uq_AnhSanPham_MaBam'),
+    )),
+    (7, 'Index sắp xếp trang sản phẩm', _create_indexes(
+        'ix_SanPham_TrangThai_MaLoai_TenSanPham',
+        'ix_SanPham_TrangThai_TenSanPham',
+        'ix_SanPham_TrangThai_GiaBan',
+    )),
+]
+
+
+# Nhiều process khởi động cùng lúc chỉ để một process chạy migration (MySQL GET_LOCK)
+MIGRATION_LOCK = 'pet_shop_schema_migrations'
+MIGRATION_LOCK_TIMEOUT = 300
+
+
+@contextmanager
+def _migration_lock():
+    """Khóa toàn database trong lúc áp dụng migration (chỉ MySQL)"""
+    if db.engine.dialect.name != 'mysql':
+        yield
+        return
+
+    with db.engine.connect() as connection:
+        locked = connection.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"),
+            {'name': MIGRATION_LOCK, 'timeout': MIGRATION_LOCK_TIMEOUT}
+        ).scalar()
+        if not locked:
+            raise RuntimeError(f"Hết thời gian chờ process khác áp dụng migration ({MIGRATION_LOCK})")
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': MIGRATION_LOCK})
+
+
+def applied_versions():
+    """Các phiên bản migration đã áp dụng"""
+    PhienBanCSDL.__table__.create(db.engine, checkfirst=True)
+    return set(db.session.execute(select(PhienBanCSDL.PhienBan)).scalars())
+
+
+def apply_migrations():
+    """Áp dụng các migration chưa chạy theo thứ tự, trả về danh sách phiên bản vừa áp dụng"""
+    with _migration_lock():
+        done = applied_versions()
+        db.session.commit()
+
+        applied = []
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            with db.engine.begin() as connection:
+                migrate(connection)
+                connection.execute(PhienBanCSDL.__table__.insert().values(
+                    PhienBan=version, MoTa=description
+                ))
+            applied.append(version)
+        return applied
+
+
+def upgrade_schema(auto_migrate=True, prefix=''):
+    """Đưa database lên schema models cần khi app khởi động
+
+    auto_migrate: áp dụng các migration còn thiếu; False thì chỉ kiểm tra.
+    Raise RuntimeError nếu database vẫn thiếu cột models đang map (mọi truy
+    vấn trên bảng đó sẽ lỗi), để app dừng ngay thay vì chạy với schema cũ.
+    Trả về danh sách phiên bản vừa áp dụng.
+    """
+    applied = []
+    if auto_migrate:
+        try:
+            applied = apply_migrations()
+        except Exception as e:
+            db.session.rollback()
+            raise RuntimeError(f"Áp dụng migration schema thất bại: {e}") from e
+        for version in applied:
+            print(f"{prefix}Applied schema migration {version}")
+
+    columns = missing_columns()
+    if columns:
+        names = ', '.join(f"{table_name}.{column_name}" for table_name, column_name in columns)
+        raise RuntimeError(f"Database thiếu cột {names}. Chạy 'python migrate_db.py' rồi khởi động lại")
+    return applied
+
+
+def missing_indexes():
+    """Liệt kê index khai báo trong models nhưng chưa có trong database
+
+    Trả về [(tên bảng, tên index, [các cột])].
+    """
+    inspector = inspect(db.engine)
+    table_names = set(inspector.get_table_names())
+
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        for index in sorted(table.indexes, key=lambda item: item.name):
+            if not _index_exists(inspector, index):
+                missing.append((table.name, index.name, [column.name for column in index.columns]))
+    return missing
+
+
+def missing_columns():
+    """Liệt kê cột khai báo trong models nhưng bảng đã có trong database chưa có
+
+    Trả về [(tên bảng, tên cột)].
+    """
+    inspector = inspect(db.engine)
+    table_names = set(inspector.get_table_names())
+
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend((table.name, column.name) for column in table.columns if column.name not in existing)
+    return missing
+
+
+def report_missing_indexes(prefix=''):
+    """In cảnh báo khi khởi động nếu database còn thiếu cột hoặc index, trả về số mục thiếu"""
+    columns = missing_columns()
+    for table_name, column_name in columns:
+        print(f"{prefix}Warning: thiếu cột {table_name}.{column_name}, các truy vấn trên bảng này sẽ lỗi")
+
+    missing = missing_indexes()
+    for table_name, index_name, index_columns in missing:
+        print(f"{prefix}Warning: thiếu index {index_name} trên {table_name}({', '.join(index_columns)})")
+
+    if columns or missing:
+        print(f"{prefix}Chạy 'python migrate_db.py' để cập nhật schema")
+    return len(columns) + len(missing)
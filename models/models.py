@@ -20,6 +20,13 @@ class Loai(db.Model):
 
 class SanPham(db.Model):
     __tablename__ = 'SanPham'
+    __table_args__ = (
+        db.Index('ix_SanPham_TrangThai_MaLoai_GiaBan', 'TrangThai', 'MaLoai', 'GiaBan'),
+        # Sắp xếp/phân trang keyset của trang sản phẩm
+        db.Index('ix_SanPham_TrangThai_MaLoai_TenSanPham', 'TrangThai', 'MaLoai', 'TenSanPham'),
+        db.Index('ix_SanPham_TrangThai_TenSanPham', 'TrangThai', 'TenSanPham'),
+        db.Index('ix_SanPham_TrangThai_GiaBan', 'TrangThai', 'GiaBan'),
+    )
 
     MaSanPham = db.Column(db.Integer, primary_key=True, autoincrement=True)
     TenSanPham = db.Column(db.String(255), nullable=False)
@@ -39,6 +46,11 @@ class SanPham(db.Model):
 
 class TaiKhoan(db.Model):
     __tablename__ = 'TaiKhoan'
+    __table_args__ = (
+        # Tìm khách hàng theo tên trong trang admin (FULLTEXT trên MySQL)
+        db.Index('ft_TaiKhoan_Ho_Ten', 'Ho', 'Ten', mysql_prefix='FULLTEXT'),
+        db.Index('ix_TaiKhoan_Ten', 'Ten'),
+    )
 
     MaTaiKhoan = db.Column(db.Integer, primary_key=True, autoincrement=True)
     Ho = db.Column(db.String(100))
@@ -58,6 +70,10 @@ class TaiKhoan(db.Model):
 
 class DangNhap(db.Model):
     __tablename__ = 'DangNhap'
+    __table_args__ = (
+        db.Index('ix_DangNhap_MaTaiKhoan', 'MaTaiKhoan'),
+        db.Index('ix_DangNhap_DiaChiEmail', 'DiaChiEmail'),
+    )
 
     TenTaiKhoan = db.Column(db.String(100), primary_key=True)
     MatKhau = db.Column(db.String(255), nullable=False)
@@ -84,6 +100,9 @@ class QuyenTaiKhoan(db.Model):
 
 class DiaChi(db.Model):
     __tablename__ = 'DiaChi'
+    __table_args__ = (
+        db.Index('ix_DiaChi_MaTaiKhoan', 'MaTaiKhoan'),
+    )
 
     MaDiaChi = db.Column(db.Integer, primary_key=True, autoincrement=True)
     MaTaiKhoan = db.Column(db.Integer, db.ForeignKey('TaiKhoan.MaTaiKhoan'), nullable=False)
@@ -97,6 +116,10 @@ class DiaChi(db.Model):
 
 class GioHang(db.Model):
     __tablename__ = 'GioHang'
+    __table_args__ = (
+        # Mỗi tài khoản chỉ có một giỏ hàng
+        db.Index('uq_GioHang_MaTaiKhoan', 'MaTaiKhoan', unique=True),
+    )
 
     MaGioHang = db.Column(db.Integer, primary_key=True, autoincrement=True)
     MaTaiKhoan = db.Column(db.Integer, db.ForeignKey('TaiKhoan.MaTaiKhoan'), nullable=False)
@@ -121,6 +144,11 @@ class GioHang_SanPham(db.Model):
 
 class DonHang(db.Model):
     __tablename__ = 'DonHang'
+    __table_args__ = (
+        db.Index('ix_DonHang_MaTaiKhoan_NgayDat', 'MaTaiKhoan', 'NgayDat'),
+        db.Index('ix_DonHang_Status_NgayDat', 'Status', 'NgayDat'),
+        db.Index('uq_DonHang_MaYeuCau', 'MaYeuCau', unique=True),
+    )
 
     MaDonHang = db.Column(db.Integer, primary_key=True, autoincrement=True)
     MaTaiKhoan = db.Column(db.Integer, db.ForeignKey('TaiKhoan.MaTaiKhoan'), nullable=False)
@@ -128,6 +156,7 @@ class DonHang(db.Model):
     NgayDat = db.Column(db.DateTime, default=datetime.utcnow)
     Status = db.Column(db.Enum('pending', 'shipped', 'delivered', 'canceled'), default='pending')
     TongTien = db.Column(db.Numeric(12, 2), nullable=False)
+    MaYeuCau = db.Column(db.String(64))  # Mã yêu cầu đặt hàng (idempotency key) cấp ở trang checkout
 
     # Relationships
     dia_chi = db.relationship('DiaChi', backref='don_hangs', lazy=True)
@@ -136,6 +165,10 @@ class DonHang(db.Model):
 
 class ChiTiet_DonHang(db.Model):
     __tablename__ = 'ChiTiet_DonHang'
+    __table_args__ = (
+        db.Index('ix_ChiTiet_DonHang_MaDonHang', 'MaDonHang'),
+        db.Index('ix_ChiTiet_DonHang_MaSanPham', 'MaSanPham'),
+    )
 
     MaChiTietDH = db.Column(db.Integer, primary_key=True, autoincrement=True)
     MaDonHang = db.Column(db.Integer, db.ForeignKey('DonHang.MaDonHang'), nullable=False)
@@ -144,4 +177,73 @@ class ChiTiet_DonHang(db.Model):
     DonGia = db.Column(db.Numeric(12, 2), nullable=False)
 
     # Relationship
-    san_pham = db.relationship('SanPham', backref='chi_tiet_don_hangs', lazy=True)
\ No newline at end of file
+    san_pham = db.relationship('SanPham', backref='chi_tiet_don_hangs', lazy=True)
+
+
+class TonKhoManh(db.Model):
+    """Tồn kho của sản phẩm bán chạy được chia thành nhiều mảnh (xem HotStockService)"""
+    __tablename__ = 'TonKhoManh'
+
+    MaSanPham = db.Column(db.Integer, db.ForeignKey('SanPham.MaSanPham'), primary_key=True)
+    MaManh = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    SoLuong = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AnhSanPham(db.Model):
+    """Ảnh sản phẩm đã upload và các biến thể tạo sẵn của nó"""
+    __tablename__ = 'AnhSanPham'
+    __table_args__ = (
+        db.Index('uq_AnhSanPham_URL', 'URL', unique=True),
+        db.Index('uq_AnhSanPham_MaBam', 'MaBam', unique=True),
+    )
+
+    MaAnh = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    URL = db.Column(db.String(500), nullable=False)
+    MaBam = db.Column(db.String(64))  # SHA-256 nội dung file, dùng để không upload lại ảnh trùng
+    PublicId = db.Column(db.String(255))
+    BienThe = db.Column(db.Text)  # JSON {tên biến thể: URL}, xem services/image_storage.py
+    NgayTao = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class TacVuTaiAnh(db.Model):
+    """Tác vụ upload ảnh chạy nền (xem ImageUploadService)"""
+    __tablename__ = 'TacVuTaiAnh'
+
+    MaTacVu = db.Column(db.String(32), primary_key=True)
+    MaSanPham = db.Column(db.Integer, db.ForeignKey('SanPham.MaSanPham'))
+    LoaiAnh = db.Column(db.Enum('main', 'extra'), nullable=False, default='main')
+    TenFile = db.Column(db.String(255))
+    DuongDanTam = db.Column(db.String(500))
+    TrangThai = db.Column(db.Enum('pending', 'processing', 'done', 'failed'), nullable=False, default='pending')
+    URL = db.Column(db.String(500))
+    PublicId = db.Column(db.String(255))
+    LoiNhan = db.Column(db.String(500))
+    NgayTao = db.Column(db.DateTime, default=datetime.utcnow)
+    NgayCapNhat = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DoanhThuNgay(db.Model):
+    """Bảng tổng hợp doanh thu theo ngày và trạng thái đơn hàng"""
+    __tablename__ = 'DoanhThuNgay'
+
+    Ngay = db.Column(db.Date, primary_key=True)
+    Status = db.Column(db.Enum('pending', 'shipped', 'delivered', 'canceled'), primary_key=True)
+    SoDonHang = db.Column(db.Integer, nullable=False, default=0)
+    DoanhThu = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+class PhienBanCache(db.Model):
+    """Bộ đếm phiên bản dữ liệu dùng chung giữa các process để biết cache trong bộ nhớ đã cũ"""
+    __tablename__ = 'PhienBanCache'
+
+    Ten = db.Column(db.String(50), primary_key=True)
+    PhienBan = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PhienBanCSDL(db.Model):
+    """Các migration schema đã được áp dụng (xem models/migrations.py)"""
+    __tablename__ = 'PhienBanCSDL'
+
+    PhienBan = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    MoTa = db.Column(db.String(255))
+    NgayApDung = db.Column(db.DateTime, default=datetime.utcnow)
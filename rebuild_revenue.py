@@ -0,0 +1,18 @@
+from app_factory import create_app
+from services.services import RevenueRollupService
+
+
+def main():
+    """Tính lại bảng tổng hợp DoanhThuNgay từ toàn bộ DonHang"""
+    print("📊 Rebuilding DoanhThuNgay from DonHang...")
+    with create_app().app_context():
+        success, result = RevenueRollupService.rebuild()
+
+    if success:
+        print(f"   ✅ Done! {result} rollup rows written.")
+    else:
+        print(f"   ❌ Rebuild failed: {result}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+from app_factory import create_app
+from services.services import CartService
+
+
+def main():
+    """Đối soát GioHang.TongSoLuong với các dòng GioHang_SanPham
+
+    Chạy định kỳ (ví dụ cron mỗi giờ) để phát hiện và sửa sai lệch do
+    thao tác giỏ hàng bị lỗi giữa chừng hoặc sửa dữ liệu trực tiếp.
+    """
+    print("🧮 Reconciling cart totals...")
+    with create_app().app_context():
+        try:
+            checked, fixed = CartService.reconcile_cart_totals()
+        except Exception as e:
+            print(f"   ❌ Reconciliation failed: {e}")
+            return
+
+    print(f"   ✅ Checked {checked} carts, fixed {len(fixed)}.")
+    if fixed:
+        print(f"   ⚠️  Drifted carts: {', '.join(str(cart_id) for cart_id in fixed)}")
+
+
+if __name__ == '__main__':
+    main()
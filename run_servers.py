@@ -18,6 +18,12 @@ def run_admin_app():
     subprocess.run([sys.executable, "admin_app.py"])
 
 
+def run_stock_consolidation():
+    """Chạy process gộp tồn kho chia mảnh (một process cho cả hai app)"""
+    print("📦 Đang khởi động tiến trình gộp tồn kho...")
+    subprocess.run([sys.executable, "consolidate_stock.py"])
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("🐾 PET SHOP - MULTI-SERVER LAUNCHER")
@@ -32,10 +38,12 @@ if __name__ == "__main__":
         # Tạo thread cho từng ứng dụng
         main_thread = threading.Thread(target=run_main_app, daemon=True)
         admin_thread = threading.Thread(target=run_admin_app, daemon=True)
+        stock_thread = threading.Thread(target=run_stock_consolidation, daemon=True)
 
         # Khởi động các thread
         main_thread.start()
         admin_thread.start()
+        stock_thread.start()
 
         print("✅ Cả hai server đã được khởi động!")
         print("🔄 Nhấn Ctrl+C để dừng tất cả server...")
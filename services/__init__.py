@@ -2,5 +2,11 @@ from .services import (
     AuthService,
     ProductService,
     CartService,
-    OrderService
+    OrderService,
+    CustomerService,
+    DashboardService,
+    RevenueRollupService,
+    InventoryService,
+    HotStockService,
+    ImageUploadService
 )
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""Nơi lưu ảnh sản phẩm.
+
+Chọn backend bằng config IMAGE_STORAGE:
+- 'cloudinary' (mặc định): upload lên Cloudinary, URL trỏ tới res.cloudinary.com
+- 'local': lưu trong IMAGE_LOCAL_DIR và tự phục vụ qua IMAGE_LOCAL_URL, dùng
+  khi chạy shop/benchmark/test không gọi ra ngoài
+
+Cả hai app gọi init_app(app) khi khởi động; code khác lấy backend bằng
+get_storage(); resolve_images() đổi giá trị thô HinhAnh/HinhAnhPhu thành URL
+(có nhớ đệm) để storefront và admin dùng chung một cách tạo URL.
+
+Mỗi ảnh upload được tạo sẵn các biến thể trong VARIANTS một lần lúc upload;
+image_set() gom chúng thành cấu trúc dùng cho src/srcset ở template.
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from flask import current_app, send_from_directory
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Biến thể tạo sẵn cho mỗi ảnh: (tên, rộng, cao, kiểu cắt, định dạng)
+# fill: cắt vừa khung; limit: thu nhỏ giữ tỉ lệ, không phóng to
+VARIANTS = (
+    ('thumb', 150, 150, 'fill', None),
+    ('card', 400, 300, 'limit', None),
+    ('detail', 800, 600, 'limit', None),
+    ('webp', 800, 600, 'limit', 'webp'),
+)
+# Các biến thể cùng định dạng gốc dùng cho srcset, theo chiều rộng
+SRCSET_VARIANTS = ('card', 'detail')
+
+
+def image_set(url, variants=None):
+    """Cấu trúc ảnh cho template: src gốc, URL từng biến thể, srcset
+
+    Biến thể chưa có (ảnh cũ, hoặc backend không tạo được) dùng URL gốc.
+    """
+    if not url:
+        return None
+    variants = variants or {}
+    widths = {name: width for name, width, _, _, _ in VARIANTS}
+
+    result = {'src': url}
+    for name, _, _, _, _ in VARIANTS:
+        result[name] = variants.get(name, url)
+    result['srcset'] = ', '.join(
+        f"{variants[name]} {widths[name]}w" for name in SRCSET_VARIANTS if name in variants
+    ) or None
+    result['webp_srcset'] = f"{variants['webp']} {widths['webp']}w" if 'webp' in variants else None
+    return result
+
+
+def content_hash(path):
+    """SHA-256 (hex) nội dung file, đọc theo từng khối"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageStorage:
+    """Giao diện chung của các backend lưu ảnh"""
+
+    def upload(self, path, public_id):
+        """Lưu file ở path với tên public_id và tạo các biến thể
+
+        Trả về {'url', 'public_id', 'variants': {tên biến thể: URL}}.
+        """
+        raise NotImplementedError
+
+    def url(self, name):
+        """URL công khai của ảnh đã lưu (tên/public id, hoặc URL đầy đủ thì trả nguyên)"""
+        raise NotImplementedError
+
+
+class CloudinaryStorage(ImageStorage):
+    """Lưu ảnh trên Cloudinary"""
+    FOLDER = 'pet_shop/products'
+    TRANSFORMATION = [
+        {'quality': 'auto:good'},
+        {'format': 'auto'},
+        {'width': 800, 'height': 600, 'crop': 'limit'}
+    ]
+
+    def __init__(self, cloud_name, api_key=None, api_secret=None):
+        self.cloud_name = cloud_name
+        if cloud_name:
+            import cloudinary
+            cloudinary.config(
+                cloud_name=cloud_name,
+                api_key=api_key,
+                api_secret=api_secret,
+                secure=True
+            )
+
+    @staticmethod
+    def _eager():
+        """Transformation tạo sẵn (eager) cho từng biến thể, cùng thứ tự VARIANTS"""
+        eager = []
+        for _, width, height, crop, image_format in VARIANTS:
+            transformation = {'width': width, 'height': height, 'crop': crop, 'quality': 'auto:good'}
+            if image_format:
+                transformation['format'] = image_format
+            eager.append(transformation)
+        return eager
+
+    def upload(self, path, public_id):
+        import cloudinary.uploader
+        result = cloudinary.uploader.upload(
+            path,
+            folder=self.FOLDER,
+            public_id=public_id,
+            resource_type="auto",
+            transformation=self.TRANSFORMATION,
+            eager=self._eager(),
+            overwrite=True,
+            invalidate=True
+        )
+        variants = {
+            name: derived['secure_url']
+            for (name, _, _, _, _), derived in zip(VARIANTS, result.get('eager') or [])
+        }
+        missing = [name for name, _, _, _, _ in VARIANTS if name not in variants]
+        if missing:
+            print(f"Error: Cloudinary không trả về biến thể {', '.join(missing)} cho {result['public_id']}, "
+                  f"template sẽ dùng ảnh gốc")
+        return {'url': result['secure_url'], 'public_id': result['public_id'], 'variants': variants}
+
+    def url(self, name):
+        if not name:
+            return None
+        if name.startswith('http'):
+            return name
+        if not self.cloud_name:
+            return None
+        # Giữ cách tạo URL cũ của storefront: tên lưu trong database là public id đầy đủ
+        return f"https://res.cloudinary.com/{self.cloud_name}/image/upload/v1/{name}"
+
+
+class LocalStorage(ImageStorage):
+    """Lưu ảnh trên đĩa và tự phục vụ qua base_url.
+
+    Biến thể được tạo bằng Pillow (requirement.txt); thiếu Pillow thì chỉ lưu
+    ảnh gốc và báo lỗi khi khởi động và mỗi lần upload. Tên file chứa thời gian + uuid nên không bao giờ bị ghi đè; send() trả
+    header cache dài hạn (immutable) và để send_file dùng wsgi.file_wrapper
+    (sendfile) hoặc X-Sendfile (USE_X_SENDFILE) thay vì đọc file vào Python.
+    delay giả lập thời gian xử lý của dịch vụ thật khi test.
+    """
+    CACHE_MAX_AGE = 365 * 24 * 3600
+
+    def __init__(self, directory, base_url='/uploads', max_age=CACHE_MAX_AGE, delay=0):
+        self.directory = os.path.abspath(directory)
+        self.base_url = base_url.rstrip('/')
+        self.max_age = max_age
+        self.delay = delay
+
+    def upload(self, path, public_id):
+        if self.delay:
+            time.sleep(self.delay)
+        os.makedirs(self.directory, exist_ok=True)
+        extension = os.path.splitext(path)[1].lower()
+        filename = public_id + extension
+        shutil.copyfile(path, os.path.join(self.directory, filename))
+        return {
+            'url': f"{self.base_url}/{filename}",
+            'public_id': public_id,
+            'variants': self._make_variants(path, public_id, extension)
+        }
+
+    def _make_variants(self, path, public_id, extension):
+        """Ghi các biến thể trong VARIANTS cạnh ảnh gốc, trả về {tên: URL}"""
+        if Image is None:
+            print(f"Error: chưa cài Pillow, không tạo được biến thể cho {public_id}, template sẽ dùng ảnh gốc")
+            return {}
+
+        variants = {}
+        with Image.open(path) as original:
+            original = ImageOps.exif_transpose(original)
+            for name, width, height, crop, image_format in VARIANTS:
+                if crop == 'fill':
+                    resized = ImageOps.fit(original, (width, height))
+                else:
+                    resized = original.copy()
+                    resized.thumbnail((width, height))
+                target_extension = '.' + image_format if image_format else extension
+                if resized.mode not in ('RGB', 'RGBA'):
+                    resized = resized.convert('RGBA')
+                if resized.mode == 'RGBA' and target_extension in ('.jpg', '.jpeg'):
+                    resized = resized.convert('RGB')
+
+                filename = f"{public_id}_{name}{target_extension}"
+                resized.save(os.path.join(self.directory, filename))
+                variants[name] = f"{self.base_url}/{filename}"
+        return variants
+
+    def url(self, name):
+        if not name:
+            return None
+        if name.startswith('http') or name.startswith(self.base_url + '/'):
+            return name
+        return f"{self.base_url}/{name.lstrip('/')}"
+
+    def send(self, filename):
+        """View phục vụ file ảnh đã lưu"""
+        response = send_from_directory(self.directory, filename, max_age=self.max_age, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_images(storage, main_image, extra_images):
+    main_url = storage.url(main_image)
+
+    extra_urls = []
+    if extra_images:
+        try:
+            names = json.loads(extra_images)
+        except ValueError:
+            names = []
+        if isinstance(names, list):
+            extra_urls = [storage.url(name) for name in names if isinstance(name, str) and name]
+
+    all_urls = ([main_url] if main_url else []) + [url for url in extra_urls if url]
+    return main_url, tuple(all_urls)
+
+
+def resolve_images(main_image, extra_images):
+    """URL ảnh chính và tuple URL mọi ảnh từ giá trị thô HinhAnh, HinhAnhPhu (JSON)
+
+    Kết quả được nhớ theo đúng cặp giá trị thô, nên danh sách ảnh của mỗi sản
+    phẩm chỉ được parse lại khi HinhAnh/HinhAnhPhu thay đổi.
+    """
+    return _resolve_images(get_storage(), main_image, extra_images)
+
+
+def create_storage(app):
+    """Tạo backend lưu ảnh theo config của app"""
+    backend = app.config.get('IMAGE_STORAGE', 'cloudinary')
+    if backend == 'local':
+        return LocalStorage(
+            app.config.get('IMAGE_LOCAL_DIR') or os.path.join(app.root_path, 'uploads'),
+            base_url=app.config.get('IMAGE_LOCAL_URL', '/uploads'),
+            max_age=app.config.get('IMAGE_CACHE_MAX_AGE', LocalStorage.CACHE_MAX_AGE)
+        )
+    if backend == 'cloudinary':
+        return CloudinaryStorage(
+            app.config.get('CLOUDINARY_CLOUD_NAME'),
+            app.config.get('CLOUDINARY_API_KEY'),
+            app.config.get('CLOUDINARY_API_SECRET')
+        )
+    raise ValueError(f"IMAGE_STORAGE không hợp lệ: {backend}")
+
+
+def init_app(app):
+    """Gắn backend lưu ảnh vào app (và route phục vụ file nếu lưu cục bộ)"""
+    storage = create_storage(app)
+    app.extensions['image_storage'] = storage
+    if isinstance(storage, LocalStorage):
+        if Image is None:
+            print("Error: chưa cài Pillow (pip install -r requirement.txt), ảnh upload sẽ không có biến thể "
+                  "thumb/card/detail/webp")
+        app.add_url_rule(f"{storage.base_url}/<path:filename>", 'uploaded_image', storage.send)
+    return storage
+
+
+def get_storage():
+    """Backend lưu ảnh của app hiện tại"""
+    return current_app.extensions['image_storage']
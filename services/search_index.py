@@ -0,0 +1,144 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+
+def fold_text(text):
+    """Chuẩn hóa chuỗi để tìm kiếm: chữ thường, bỏ dấu tiếng Việt (đ -> d)"""
+    if not text:
+        return ''
+    text = text.lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    """Tách chuỗi đã chuẩn hóa thành các từ"""
+    return re.findall(r'\w+', fold_text(text))
+
+
+class ProductSearchIndex:
+    """Inverted index trong bộ nhớ cho tìm kiếm sản phẩm.
+
+    Mỗi token trỏ tới {mã sản phẩm: trọng số cao nhất}, với trọng số theo
+    trường: tên 3, thương hiệu 2, mô tả/loại 1. Từ khóa được so khớp theo
+    tiền tố trên danh sách token đã sắp xếp, nên chi phí một lần tìm chỉ phụ
+    thuộc số token/sản phẩm khớp chứ không phụ thuộc kích thước catalog.
+    """
+    FIELD_WEIGHTS = (('name', 3), ('brand', 2), ('description', 1), ('type', 1))
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._vocab = []
+        self._docs = {}
+        self._source = None
+
+    @classmethod
+    def _signature(cls, product):
+        return tuple(product.get(field) or '' for field, _ in cls.FIELD_WEIGHTS)
+
+    @classmethod
+    def _document_tokens(cls, product):
+        tokens = {}
+        for field, weight in cls.FIELD_WEIGHTS:
+            for token in tokenize(product.get(field)):
+                if tokens.get(token, 0) < weight:
+                    tokens[token] = weight
+        return tokens
+
+    def _add(self, product):
+        product_id = product['id']
+        tokens = self._document_tokens(product)
+        for token, weight in tokens.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                bisect.insort(self._vocab, token)
+            posting[product_id] = weight
+        self._docs[product_id] = (self._signature(product), tokens)
+
+    def _remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if not doc:
+            return
+        for token in doc[1]:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[token]
+                index = bisect.bisect_left(self._vocab, token)
+                if index < len(self._vocab) and self._vocab[index] == token:
+                    del self._vocab[index]
+
+    def upsert(self, product):
+        """Thêm hoặc cập nhật một sản phẩm trong index"""
+        with self._lock:
+            self._remove(product['id'])
+            self._add(product)
+
+    def remove(self, product_id):
+        """Xóa một sản phẩm khỏi index"""
+        with self._lock:
+            self._remove(product_id)
+
+    def sync(self, products):
+        """Đồng bộ index với danh sách sản phẩm, chỉ index lại sản phẩm thay đổi"""
+        if products is self._source:
+            return
+
+        with self._lock:
+            if products is self._source:
+                return
+
+            seen = set()
+            for product in products:
+                product_id = product['id']
+                seen.add(product_id)
+                doc = self._docs.get(product_id)
+                if doc is None or doc[0] != self._signature(product):
+                    self._remove(product_id)
+                    self._add(product)
+
+            for product_id in [pid for pid in self._docs if pid not in seen]:
+                self._remove(product_id)
+
+            self._source = products
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self._vocab, prefix)
+        end = bisect.bisect_right(self._vocab, prefix + '\uffff', lo=start)
+        return self._vocab[start:end]
+
+    def search(self, query, match_all=False):
+        """Tìm sản phẩm theo từ khóa, trả về [(mã sản phẩm, điểm)] theo điểm giảm dần
+
+        match_all: chỉ giữ sản phẩm khớp mọi từ khóa (mặc định khớp ít nhất một từ).
+        """
+        words = set(tokenize(query))
+        if not words:
+            return []
+
+        scores = {}
+        matched = {}
+        with self._lock:
+            for word in words:
+                # Mỗi từ khóa chỉ cộng trọng số cao nhất của sản phẩm
+                best = {}
+                for token in self._prefix_tokens(word):
+                    for product_id, weight in self._postings[token].items():
+                        if best.get(product_id, 0) < weight:
+                            best[product_id] = weight
+                for product_id, weight in best.items():
+                    scores[product_id] = scores.get(product_id, 0) + weight
+                    matched[product_id] = matched.get(product_id, 0) + 1
+
+        if match_all:
+            scores = {product_id: score for product_id, score in scores.items() if matched[product_id] == len(words)}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+product_search_index = ProductSearchIndex()
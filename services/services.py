@@ -1,10 +1,60 @@
 from models.models import db, TaiKhoan, DangNhap, SanPham, Loai, GioHang, GioHang_SanPham, DonHang, ChiTiet_DonHang, \
-    DiaChi
+    DiaChi, DoanhThuNgay, TonKhoManh, TacVuTaiAnh, AnhSanPham, PhienBanCache
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta, date
+from decimal import Decimal, InvalidOperation
 from flask import current_app
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, func, case, insert, update, delete, select, literal, inspect
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+from services.search_index import product_search_index
+from services.image_storage import get_storage, image_set, content_hash, resolve_images
 import json
+import os
+import random
+import tempfile
+import threading
+import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _upsert_increment(model, keys, increments):
+    """Cộng dồn các cột increments vào dòng có khóa keys, tạo dòng mới nếu chưa có.
+
+    Dùng INSERT ... ON DUPLICATE KEY UPDATE (MySQL) hoặc ON CONFLICT (SQLite,
+    PostgreSQL) để chỉ tốn một câu lệnh và không bị race khi hai request cùng
+    tạo dòng mới.
+    """
+    table = model.__table__
+    values = dict(keys, **increments)
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update({col: table.c[col] + stmt.inserted[col] for col in increments})
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={col: table.c[col] + stmt.excluded[col] for col in increments}
+        )
+    else:
+        # Dialect khác: UPDATE trước, chưa có dòng thì INSERT
+        result = db.session.execute(
+            update(table).where(and_(*[table.c[col] == value for col, value in keys.items()])).values(
+                {col: table.c[col] + value for col, value in increments.items()})
+        )
+        if result.rowcount:
+            return
+        stmt = insert(table).values(**values)
+
+    db.session.execute(stmt)
 
 
 class AuthService:
@@ -232,122 +282,437 @@ class AuthService:
             return []
 
 
+class CatalogCache:
+    """Cache danh sách sản phẩm đang bán trong bộ nhớ tiến trình.
+
+    Mỗi lần sản phẩm thay đổi thì tăng version; lần đọc tiếp theo sẽ nạp lại
+    từ database đúng một lần rồi dùng chung cho mọi request. version được ghi
+    vào dòng PhienBanCache 'catalog' để process khác (admin_app chạy riêng với
+    app) cũng thấy: mỗi process đọc lại dòng này tối đa một lần mỗi
+    CATALOG_VERSION_CHECK giây. TTL (CATALOG_CACHE_TTL, giây) vẫn giới hạn độ
+    cũ khi dữ liệu bị sửa thẳng trong database.
+    """
+    DEFAULT_TTL = 60
+    DEFAULT_VERSION_CHECK = 1
+    SHARED_KEY = 'catalog'
+
+    _lock = threading.Lock()
+    _version = 0
+    _shared_version = None
+    _checked_at = 0.0
+    _loaded_version = -1
+    _loaded_at = 0.0
+    _catalog = None  # (danh sách sản phẩm, dict theo mã sản phẩm)
+
+    @classmethod
+    def _ttl(cls):
+        try:
+            return current_app.config.get('CATALOG_CACHE_TTL', cls.DEFAULT_TTL)
+        except RuntimeError:
+            return cls.DEFAULT_TTL
+
+    @classmethod
+    def _sync_shared_version(cls):
+        """Đọc version dùng chung (có giới hạn tần suất), đổi thì coi cache là cũ"""
+        now = time.monotonic()
+        interval = current_app.config.get('CATALOG_VERSION_CHECK', cls.DEFAULT_VERSION_CHECK)
+        if now - cls._checked_at < interval:
+            return
+        cls._checked_at = now
+
+        try:
+            shared = db.session.execute(
+                select(PhienBanCache.PhienBan).where(PhienBanCache.Ten == cls.SHARED_KEY)
+            ).scalar()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error reading catalog version: {e}")
+            return
+
+        with cls._lock:
+            if shared != cls._shared_version:
+                if cls._shared_version is not None:
+                    cls._version += 1
+                cls._shared_version = shared
+
+    @classmethod
+    def _is_fresh(cls):
+        return (cls._catalog is not None
+                and cls._loaded_version == cls._version
+                and time.monotonic() - cls._loaded_at < cls._ttl())
+
+    @classmethod
+    def get_catalog(cls, loader):
+        """Trả về (danh sách sản phẩm, dict theo mã) đã cache, nạp lại bằng loader nếu cũ"""
+        cls._sync_shared_version()
+        catalog = cls._catalog
+        if cls._is_fresh():
+            return catalog
+
+        with cls._lock:
+            # Một request khác có thể đã nạp xong trong lúc chờ lock
+            if cls._is_fresh():
+                return cls._catalog
+
+            version = cls._version
+            products = loader()
+            cls._catalog = (products, {product['id']: product for product in products})
+            cls._loaded_version = version
+            cls._loaded_at = time.monotonic()
+            return cls._catalog
+
+    @classmethod
+    def get_products(cls, loader):
+        """Trả về danh sách sản phẩm đã cache"""
+        return cls.get_catalog(loader)[0]
+
+    @classmethod
+    def get_product(cls, product_id):
+        """Tra sản phẩm theo ID trong cache (None nếu cache cũ hoặc không có)"""
+        cls._sync_shared_version()
+        catalog = cls._catalog
+        if not cls._is_fresh():
+            return None
+        return catalog[1].get(product_id)
+
+    @classmethod
+    def invalidate(cls):
+        """Đánh dấu cache cũ ở process này và tăng version dùng chung cho process khác
+
+        Gọi sau khi đã commit thay đổi; tự commit phần tăng version.
+        """
+        with cls._lock:
+            cls._version += 1
+        try:
+            _upsert_increment(PhienBanCache, {'Ten': cls.SHARED_KEY}, {'PhienBan': 1})
+            shared = db.session.execute(
+                select(PhienBanCache.PhienBan).where(PhienBanCache.Ten == cls.SHARED_KEY)
+            ).scalar()
+            db.session.commit()
+            # Lần tăng của chính process này không cần nạp lại thêm lần nữa
+            with cls._lock:
+                cls._shared_version = shared
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error bumping catalog version: {e}")
+
+
 class ProductService:
+    MAX_PER_PAGE = 100
+    # Số sản phẩm đếm tối đa cho phân trang (và giới hạn độ sâu OFFSET)
+    COUNT_LIMIT = 10000
+
     @staticmethod
-    def get_cloudinary_url(image_filename):
-        """Tạo URL Cloudinary từ tên file"""
-        if not image_filename:
-            return None
+    def get_image_url(image_filename):
+        """Tạo URL ảnh từ tên file theo backend lưu ảnh đang dùng (URL đầy đủ thì giữ nguyên)"""
+        return get_storage().url(image_filename)
 
-        cloud_name = current_app.config.get('CLOUDINARY_CLOUD_NAME')
-        if not cloud_name:
-            return None
+    @staticmethod
+    def serialize_product(product, loai):
+        """Chuyển SanPham + Loai thành dict dùng cho storefront"""
+        return ProductService.serialize_products([(product, loai)])[0]
+
+    @staticmethod
+    def serialize_products(rows):
+        """Chuyển các dòng (SanPham, Loai) thành dict, đọc biến thể ảnh bằng một truy vấn"""
+        products = [ProductService._serialize_fields(product, loai) for product, loai in rows]
+        ProductService._attach_image_sets(products)
+        return products
 
-        # Nếu đã là URL đầy đủ thì return luôn
-        if image_filename.startswith('http'):
-            return image_filename
+    @staticmethod
+    def _attach_image_sets(products):
+        """Thêm image_set (ảnh chính) và image_sets (mọi ảnh) dạng src/srcset cho template"""
+        urls = {url for product in products for url in product['images']}
+        variants = {}
+        if urls:
+            rows = db.session.query(AnhSanPham.URL, AnhSanPham.BienThe).filter(AnhSanPham.URL.in_(urls)).all()
+            for url, raw_variants in rows:
+                try:
+                    variants[url] = json.loads(raw_variants) if raw_variants else {}
+                except ValueError:
+                    variants[url] = {}
 
-        # Tạo URL Cloudinary theo format: folder/filename
-        return f"https://res.cloudinary.com/{cloud_name}/image/upload/v1/{image_filename}"
+        for product in products:
+            product['image_set'] = image_set(product['image'], variants.get(product['image']))
+            product['image_sets'] = [image_set(url, variants.get(url)) for url in product['images']]
+
+    @staticmethod
+    def _serialize_fields(product, loai):
+        # Hình ảnh chính + phụ (nhớ đệm theo giá trị HinhAnh/HinhAnhPhu)
+        main_image, all_images = resolve_images(
+            getattr(product, 'HinhAnh', None),
+            getattr(product, 'HinhAnhPhu', None)
+        )
+
+        return {
+            'id': product.MaSanPham,
+            'name': product.TenSanPham,
+            'type': loai.TenLoai if loai else 'unknown',
+            'brand': product.ThungHieu or '',
+            'price': float(product.GiaBan) if product.GiaBan else 0,
+            'description': product.MoTa or '',
+            'quantity': product.SoLuong,
+            'image': main_image,
+            'images': list(all_images)
+        }
+
+    @staticmethod
+    def _copy_product(product):
+        """Bản sao dict sản phẩm lấy từ cache, kể cả list/dict ảnh lồng bên trong"""
+        result = dict(product)
+        result['images'] = list(product['images'])
+        if product.get('image_set'):
+            result['image_set'] = dict(product['image_set'])
+        if 'image_sets' in product:
+            result['image_sets'] = [dict(item) if item else item for item in product['image_sets']]
+        return result
+
+    @staticmethod
+    def load_catalog():
+        """Đọc toàn bộ sản phẩm đang bán từ database (không qua cache)"""
+        rows = db.session.query(SanPham, Loai).join(Loai, SanPham.MaLoai == Loai.MaLoai).filter(
+            SanPham.TrangThai == 1).all()
+        return ProductService.serialize_products(rows)
+
+    @staticmethod
+    def invalidate_catalog():
+        """Đánh dấu cache catalog đã cũ sau khi sản phẩm/tồn kho thay đổi"""
+        CatalogCache.invalidate()
 
     @staticmethod
     def get_all_products():
         """Lấy tất cả sản phẩm"""
         try:
-            # Thử cách khác
-            products = db.session.query(SanPham).join(Loai, SanPham.MaLoai == Loai.MaLoai).filter(
-                SanPham.TrangThai == 1).all()
+            products = CatalogCache.get_products(ProductService.load_catalog)
+            # Trả về bản sao để caller có thể sort/sửa dict mà không ảnh hưởng cache
+            return [ProductService._copy_product(product) for product in products]
+        except Exception as e:
+            print(f"Error getting products: {e}")
+            return []
 
-            result = []
-            for product in products:
-                # Xử lý hình ảnh chính
-                main_image = ProductService.get_cloudinary_url(
-                    getattr(product, 'HinhAnh', None)
-                )
+    @staticmethod
+    def _product_sort(sort):
+        """(cột sắp xếp, giảm dần?) cho các kiểu sắp xếp của trang sản phẩm; hòa thì xét MaSanPham"""
+        if sort == 'price_low':
+            return SanPham.GiaBan, False
+        if sort == 'price_high':
+            return SanPham.GiaBan, True
+        return SanPham.TenSanPham, False
+
+    @staticmethod
+    def encode_product_cursor(value, ma_san_pham):
+        """Tạo cursor từ giá trị cột sắp xếp và mã sản phẩm của dòng cuối trang"""
+        return f"{'' if value is None else value}_{ma_san_pham}"
+
+    @staticmethod
+    def decode_product_cursor(cursor, sort):
+        """Đọc cursor phân trang, trả về (giá trị sắp xếp, MaSanPham) hoặc None nếu không hợp lệ
+
+        Giá trị rỗng là giá NULL (tên sản phẩm luôn có giá trị).
+        """
+        try:
+            value, ma_san_pham = cursor.rsplit('_', 1)
+            if sort in ('price_low', 'price_high'):
+                value = Decimal(value) if value else None
+            return value, int(ma_san_pham)
+        except (AttributeError, ValueError, InvalidOperation):
+            return None
 
-                # Xử lý hình ảnh phụ
-                additional_images = []
-                if hasattr(product, 'HinhAnhPhu') and product.HinhAnhPhu:
-                    try:
-                        import json
-                        image_list = json.loads(product.HinhAnhPhu)
-                        additional_images = [ProductService.get_cloudinary_url(img) for img in image_list if img]
-                        additional_images = [img for img in additional_images if img]
-                    except:
-                        additional_images = []
-
-                # Tạo danh sách tất cả hình ảnh
-                all_images = []
-                if main_image:
-                    all_images.append(main_image)
-                all_images.extend(additional_images)
-
-                result.append({
-                    'id': product.MaSanPham,
-                    'name': product.TenSanPham,
-                    'type': product.loai.TenLoai if product.loai else 'unknown',
-                    'brand': product.ThungHieu or '',
-                    'price': float(product.GiaBan) if product.GiaBan else 0,
-                    'description': product.MoTa or '',
-                    'quantity': product.SoLuong,
-                    'image': main_image,
-                    'images': all_images
-                })
-
-            print(f"ProductService trả về {len(result)} sản phẩm")
+    @staticmethod
+    def _after_cursor(column, descending, value, ma_san_pham):
+        """Điều kiện keyset: các dòng sau (value, ma_san_pham) theo thứ tự sắp xếp
+
+        MySQL/SQLite xếp NULL trước khi tăng dần và sau cùng khi giảm dần.
+        """
+        if value is None:
+            if descending:
+                return and_(column.is_(None), SanPham.MaSanPham < ma_san_pham)
+            return or_(column.isnot(None), and_(column.is_(None), SanPham.MaSanPham > ma_san_pham))
+        if descending:
+            return or_(
+                column < value,
+                and_(column == value, SanPham.MaSanPham < ma_san_pham),
+                column.is_(None)
+            )
+        return or_(column > value, and_(column == value, SanPham.MaSanPham > ma_san_pham))
+
+    @staticmethod
+    def _category_id(category):
+        """MaLoai theo tên loại (không phân biệt hoa thường), None nếu không có loại đó"""
+        return db.session.query(Loai.MaLoai).filter(
+            func.lower(Loai.TenLoai) == category.strip().lower()
+        ).scalar()
+
+    @staticmethod
+    def query_products(category=None, search=None, sort='name', page=1, per_page=24, cursor=None):
+        """Lọc, sắp xếp và phân trang sản phẩm
+
+        Lọc loại theo MaLoai và sắp xếp theo cột có index; chỉ đếm tối đa
+        COUNT_LIMIT + 1 dòng và chỉ cho nhảy trang bằng OFFSET trong phạm vi
+        đó, các trang sâu hơn đi tiếp bằng cursor (keyset). Có từ khóa thì tìm
+        qua inverted index trong bộ nhớ thay vì LIKE '%...%' trên database.
+
+        Trả về (sản phẩm của trang, next_cursor, tổng số); tổng số lớn hơn
+        COUNT_LIMIT nghĩa là có nhiều hơn COUNT_LIMIT sản phẩm khớp bộ lọc.
+        """
+        try:
+            page = max(int(page or 1), 1)
+            per_page = min(max(int(per_page or 1), 1), ProductService.MAX_PER_PAGE)
+
+            if search and search.strip():
+                return ProductService._search_page(category, search, sort, page, per_page)
+
+            query = db.session.query(SanPham, Loai).join(Loai, SanPham.MaLoai == Loai.MaLoai).filter(
+                SanPham.TrangThai == 1)
+
+            if category:
+                category_id = ProductService._category_id(category)
+                if category_id is None:
+                    return [], None, 0
+                query = query.filter(SanPham.MaLoai == category_id)
+
+            column, descending = ProductService._product_sort(sort)
+            position = ProductService.decode_product_cursor(cursor, sort) if cursor else None
+
+            total = None
+            if not position:
+                counted = query.with_entities(SanPham.MaSanPham).order_by(None).limit(
+                    ProductService.COUNT_LIMIT + 1).subquery()
+                total = db.session.query(func.count()).select_from(counted).scalar() or 0
+                if total == 0:
+                    return [], None, 0
+                # Nhảy trang bằng OFFSET chỉ trong phạm vi đã đếm
+                last_page = (min(total, ProductService.COUNT_LIMIT) + per_page - 1) // per_page
+                page = min(page, last_page)
+            else:
+                query = query.filter(ProductService._after_cursor(column, descending, *position))
+
+            if descending:
+                order_by = [column.desc(), SanPham.MaSanPham.desc()]
+            else:
+                order_by = [column.asc(), SanPham.MaSanPham.asc()]
+            query = query.order_by(*order_by)
+            if not position:
+                query = query.offset((page - 1) * per_page)
+
+            # Lấy dư 1 dòng để biết còn trang sau hay không
+            rows = query.limit(per_page + 1).all()
+
+            next_cursor = None
+            if len(rows) > per_page:
+                rows = rows[:per_page]
+                last = rows[-1].SanPham
+                next_cursor = ProductService.encode_product_cursor(getattr(last, column.key), last.MaSanPham)
+
+            return ProductService.serialize_products(rows), next_cursor, total
+        except Exception as e:
+            print(f"Error querying products: {e}")
+            return [], None, 0
+
+    @staticmethod
+    def _search_page(category, search, sort, page, per_page):
+        """Một trang kết quả tìm kiếm qua inverted index, sắp xếp như query_products
+
+        Trả về (sản phẩm của trang, None, tổng số).
+        """
+        products, by_id = CatalogCache.get_catalog(ProductService.load_catalog)
+        product_search_index.sync(products)
+        category = category.strip().lower() if category else None
+
+        # Trang sản phẩm lọc theo cả cụm từ khóa như trước: sản phẩm phải khớp mọi từ
+        matches = [
+            by_id[product_id]
+            for product_id, _ in product_search_index.search(search, match_all=True)
+            if product_id in by_id
+        ]
+        if category:
+            matches = [product for product in matches if product['type'].lower() == category]
+
+        if sort == 'price_low':
+            matches.sort(key=lambda product: (product['price'], product['id']))
+        elif sort == 'price_high':
+            matches.sort(key=lambda product: (product['price'], product['id']), reverse=True)
+        else:
+            matches.sort(key=lambda product: (product['name'], product['id']))
+
+        start = (page - 1) * per_page
+        page_products = [ProductService._copy_product(product) for product in matches[start:start + per_page]]
+        return page_products, None, len(matches)
+
+    @staticmethod
+    def pagination(page, per_page, total, cursor=None, next_cursor=None):
+        """Dữ liệu phân trang cho template từ kết quả query_products
+
+        Trang đi bằng cursor không có số trang (total là None).
+        """
+        capped = total is not None and total > ProductService.COUNT_LIMIT
+        counted = min(total, ProductService.COUNT_LIMIT) if total is not None else None
+        pages = (counted + per_page - 1) // per_page if counted is not None else None
+        return {
+            'page': min(max(page, 1), pages) if pages else None,
+            'per_page': per_page,
+            'total': counted,
+            'total_capped': capped,
+            'pages': pages,
+            'cursor': cursor,
+            'next_cursor': next_cursor
+        }
+
+    @staticmethod
+    def search_products(search, category=None):
+        """Tìm sản phẩm bằng inverted index, sắp xếp theo điểm liên quan"""
+        try:
+            products, by_id = CatalogCache.get_catalog(ProductService.load_catalog)
+            product_search_index.sync(products)
+            category = category.strip().lower() if category else None
+
+            result = []
+            for product_id, _ in product_search_index.search(search):
+                product = by_id.get(product_id)
+                if not product:
+                    continue
+                if category and product['type'].lower() != category:
+                    continue
+                result.append(ProductService._copy_product(product))
             return result
         except Exception as e:
-            print(f"Error getting products: {e}")
+            print(f"Error searching products: {e}")
             return []
 
     @staticmethod
     def get_product_by_id(product_id):
         """Lấy sản phẩm theo ID"""
         try:
+            cached = CatalogCache.get_product(product_id)
+            if cached:
+                return ProductService._copy_product(cached)
+
             product = db.session.query(SanPham, Loai).join(Loai).filter(
                 and_(SanPham.MaSanPham == product_id, SanPham.TrangThai == 1)
             ).first()
 
             if product:
-                # Xử lý hình ảnh chính
-                main_image = ProductService.get_cloudinary_url(
-                    getattr(product.SanPham, 'HinhAnh', None)
-                )
-
-                # Xử lý hình ảnh phụ
-                additional_images = []
-                if hasattr(product.SanPham, 'HinhAnhPhu') and product.SanPham.HinhAnhPhu:
-                    try:
-                        import json
-                        image_list = json.loads(product.SanPham.HinhAnhPhu)
-                        additional_images = [ProductService.get_cloudinary_url(img) for img in image_list if img]
-                        additional_images = [img for img in additional_images if img]
-                    except:
-                        additional_images = []
-
-                # Tạo danh sách tất cả hình ảnh
-                all_images = []
-                if main_image:
-                    all_images.append(main_image)
-                all_images.extend(additional_images)
-
-                return {
-                    'id': product.SanPham.MaSanPham,
-                    'name': product.SanPham.TenSanPham,
-                    'type': product.Loai.TenLoai,
-                    'brand': product.SanPham.ThungHieu or '',
-                    'price': float(product.SanPham.GiaBan) if product.SanPham.GiaBan else 0,
-                    'description': product.SanPham.MoTa or '',
-                    'quantity': product.SanPham.SoLuong,
-                    'image': main_image,
-                    'images': all_images
-                }
+                return ProductService.serialize_product(product.SanPham, product.Loai)
             return None
         except Exception as e:
             print(f"Error getting product: {e}")
             return None
 
 
+def _dialect_insert(table):
+    """INSERT hỗ trợ upsert của dialect hiện tại (MySQL, SQLite, PostgreSQL), None nếu không hỗ trợ"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(table)
+
+
 class CartService:
     @staticmethod
     def get_or_create_cart(ma_tai_khoan):
@@ -357,7 +722,12 @@ class CartService:
             if not cart:
                 cart = GioHang(MaTaiKhoan=ma_tai_khoan)
                 db.session.add(cart)
-                db.session.commit()
+                try:
+                    db.session.commit()
+                except IntegrityError:
+                    # Request khác vừa tạo giỏ cho tài khoản này (uq_GioHang_MaTaiKhoan)
+                    db.session.rollback()
+                    cart = GioHang.query.filter_by(MaTaiKhoan=ma_tai_khoan).first()
             return cart
         except Exception as e:
             db.session.rollback()
@@ -365,44 +735,113 @@ class CartService:
             return None
 
     @staticmethod
-    def add_to_cart(ma_tai_khoan, ma_san_pham, so_luong=1):
-        """Thêm sản phẩm vào giỏ hàng"""
-        try:
-            cart = CartService.get_or_create_cart(ma_tai_khoan)
-            if not cart:
-                return False, "Không thể tạo giỏ hàng"
+    def _create_cart(ma_tai_khoan):
+        """Tạo giỏ hàng rỗng nếu tài khoản chưa có (không lỗi khi request khác vừa tạo)"""
+        table = GioHang.__table__
+        values = {'MaTaiKhoan': ma_tai_khoan, 'TongSoLuong': 0}
+        stmt = _dialect_insert(table)
+        if stmt is None:
+            if not db.session.query(GioHang.MaGioHang).filter_by(MaTaiKhoan=ma_tai_khoan).first():
+                db.session.execute(insert(table).values(**values))
+            return
+
+        stmt = stmt.values(**values)
+        if hasattr(stmt, 'on_duplicate_key_update'):
+            stmt = stmt.on_duplicate_key_update(MaTaiKhoan=table.c.MaTaiKhoan)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['MaTaiKhoan'])
+        db.session.execute(stmt)
 
-            # Kiểm tra sản phẩm có tồn tại và còn hàng
-            product = SanPham.query.filter_by(MaSanPham=ma_san_pham, TrangThai=1).first()
-            if not product:
-                return False, "Sản phẩm không tồn tại"
+    @staticmethod
+    def _upsert_cart_line(ma_tai_khoan, ma_san_pham, so_luong):
+        """Cộng so_luong vào dòng giỏ hàng (tạo dòng nếu chưa có) bằng một câu lệnh
+
+        Điều kiện tồn kho nằm trong SELECT nguồn: sản phẩm đang bán và tồn kho
+        >= số lượng đã có trong giỏ + so_luong. Trả về False nếu không có dòng
+        nào được ghi (hết hàng, sản phẩm không tồn tại hoặc chưa có giỏ hàng).
+        """
+        table = GioHang_SanPham.__table__
+        line = aliased(GioHang_SanPham)
+        source = select(
+            GioHang.MaGioHang,
+            SanPham.MaSanPham,
+            literal(so_luong)
+        ).select_from(GioHang).join(
+            SanPham, and_(SanPham.MaSanPham == ma_san_pham, SanPham.TrangThai == 1)
+        ).outerjoin(
+            line, and_(line.MaGioHang == GioHang.MaGioHang, line.MaSanPham == SanPham.MaSanPham)
+        ).where(
+            GioHang.MaTaiKhoan == ma_tai_khoan,
+            SanPham.SoLuong >= func.coalesce(line.SoLuong, 0) + so_luong
+        )
+        columns = ['MaGioHang', 'MaSanPham', 'SoLuong']
+
+        stmt = _dialect_insert(table)
+        if stmt is None:
+            # Dialect khác: UPDATE trước, chưa có dòng thì INSERT
+            result = db.session.execute(
+                update(table).where(
+                    table.c.MaGioHang == source.with_only_columns(GioHang.MaGioHang).scalar_subquery(),
+                    table.c.MaSanPham == ma_san_pham
+                ).values(SoLuong=table.c.SoLuong + so_luong, NgayCapNhat=datetime.utcnow())
+            )
+            if result.rowcount:
+                return True
+            return db.session.execute(insert(table).from_select(columns, source)).rowcount > 0
+
+        if hasattr(stmt, 'on_duplicate_key_update'):
+            # MySQL: bọc SELECT nguồn trong bảng dẫn xuất để ON DUPLICATE KEY UPDATE
+            # chỉ thấy cột của GioHang_SanPham và dt (SanPham/alias cũng có SoLuong,
+            # NgayCapNhat -> lỗi 1052), và không cần VALUES() đã deprecated từ 8.0.20
+            derived = source.with_only_columns(
+                GioHang.MaGioHang.label('GioHangMoi'),
+                SanPham.MaSanPham.label('SanPhamMoi'),
+                literal(so_luong).label('SoLuongThem')
+            ).subquery('dt')
+            stmt = stmt.from_select(columns, select(derived)).on_duplicate_key_update(
+                SoLuong=table.c.SoLuong + derived.c.SoLuongThem,
+                NgayCapNhat=datetime.utcnow()
+            )
+        else:
+            stmt = stmt.from_select(columns, source)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['MaGioHang', 'MaSanPham'],
+                set_={'SoLuong': table.c.SoLuong + stmt.excluded.SoLuong, 'NgayCapNhat': datetime.utcnow()}
+            )
+        return db.session.execute(stmt).rowcount > 0
 
-            if product.SoLuong < so_luong:
-                return False, "Không đủ hàng trong kho"
+    @staticmethod
+    def add_to_cart(ma_tai_khoan, ma_san_pham, so_luong=1):
+        """Thêm sản phẩm vào giỏ hàng
 
-            # Kiểm tra sản phẩm đã có trong giỏ hàng chưa
-            cart_item = GioHang_SanPham.query.filter_by(
-                MaGioHang=cart.MaGioHang,
-                MaSanPham=ma_san_pham
-            ).first()
+        Một transaction: upsert dòng giỏ hàng kèm điều kiện tồn kho, rồi cộng
+        TongSoLuong theo số lượng vừa thêm. Chỉ khi upsert không ghi được dòng
+        nào mới đọc thêm để tạo giỏ hoặc báo lỗi.
+        """
+        try:
+            so_luong = int(so_luong)
+            if so_luong <= 0:
+                return False, "Số lượng không hợp lệ"
+
+            added = CartService._upsert_cart_line(ma_tai_khoan, ma_san_pham, so_luong)
+            if not added and not db.session.query(GioHang.MaGioHang).filter_by(MaTaiKhoan=ma_tai_khoan).first():
+                # Lần đầu thêm vào giỏ: tạo giỏ hàng rồi thử lại
+                CartService._create_cart(ma_tai_khoan)
+                added = CartService._upsert_cart_line(ma_tai_khoan, ma_san_pham, so_luong)
+
+            if not added:
+                db.session.rollback()
+                product = db.session.query(SanPham.MaSanPham).filter_by(MaSanPham=ma_san_pham, TrangThai=1).first()
+                if not product:
+                    return False, "Sản phẩm không tồn tại"
+                return False, "Không đủ hàng trong kho"
 
-            if cart_item:
-                # Cập nhật số lượng
-                new_quantity = cart_item.SoLuong + so_luong
-                if product.SoLuong < new_quantity:
-                    return False, "Không đủ hàng trong kho"
-                cart_item.SoLuong = new_quantity
-            else:
-                # Thêm mới
-                cart_item = GioHang_SanPham(
-                    MaGioHang=cart.MaGioHang,
-                    MaSanPham=ma_san_pham,
-                    SoLuong=so_luong
+            # Cập nhật tổng số lượng trong giỏ hàng theo phần chênh lệch
+            db.session.execute(
+                update(GioHang).where(GioHang.MaTaiKhoan == ma_tai_khoan).values(
+                    TongSoLuong=func.coalesce(GioHang.TongSoLuong, 0) + so_luong
                 )
-                db.session.add(cart_item)
-
-            # Cập nhật tổng số lượng trong giỏ hàng
-            CartService.update_cart_total(cart.MaGioHang)
+            )
 
             db.session.commit()
             return True, "Thêm vào giỏ hàng thành công"
@@ -415,22 +854,32 @@ class CartService:
     def get_cart_items(ma_tai_khoan):
         """Lấy các item trong giỏ hàng"""
         try:
-            cart = GioHang.query.filter_by(MaTaiKhoan=ma_tai_khoan).first()
-            if not cart:
-                return []
-
-            cart_items = db.session.query(GioHang_SanPham, SanPham).join(SanPham).filter(
-                GioHang_SanPham.MaGioHang == cart.MaGioHang
+            # Một câu SQL duy nhất: giỏ hàng + item + sản phẩm + loại
+            cart_items = db.session.query(
+                SanPham.MaSanPham,
+                SanPham.TenSanPham,
+                SanPham.ThungHieu,
+                SanPham.GiaBan,
+                Loai.TenLoai,
+                GioHang_SanPham.SoLuong
+            ).join(
+                GioHang, GioHang_SanPham.MaGioHang == GioHang.MaGioHang
+            ).join(
+                SanPham, GioHang_SanPham.MaSanPham == SanPham.MaSanPham
+            ).outerjoin(
+                Loai, SanPham.MaLoai == Loai.MaLoai
+            ).filter(
+                GioHang.MaTaiKhoan == ma_tai_khoan
             ).all()
 
             return [
                 {
-                    'id': item.SanPham.MaSanPham,
-                    'name': item.SanPham.TenSanPham,
-                    'brand': item.SanPham.ThungHieu or '',
-                    'category': item.SanPham.loai.TenLoai if item.SanPham.loai else '',
-                    'price': float(item.SanPham.GiaBan) if item.SanPham.GiaBan else 0,
-                    'quantity': item.GioHang_SanPham.SoLuong,
+                    'id': item.MaSanPham,
+                    'name': item.TenSanPham,
+                    'brand': item.ThungHieu or '',
+                    'category': item.TenLoai or '',
+                    'price': float(item.GiaBan) if item.GiaBan else 0,
+                    'quantity': item.SoLuong,
                     'image': '/static/images/products/default.jpg'  # Thêm ảnh mặc định
                 }
                 for item in cart_items
@@ -441,40 +890,78 @@ class CartService:
             return []
 
     @staticmethod
-    def update_cart_total(ma_gio_hang):
-        """Cập nhật tổng số lượng trong giỏ hàng"""
+    def get_cart_count(ma_tai_khoan):
+        """Lấy tổng số lượng sản phẩm trong giỏ (đọc cột TongSoLuong, không load item)"""
         try:
-            total = db.session.query(db.func.sum(GioHang_SanPham.SoLuong)).filter_by(
-                MaGioHang=ma_gio_hang
+            row = db.session.query(GioHang.TongSoLuong).filter_by(MaTaiKhoan=ma_tai_khoan).first()
+            return (row[0] or 0) if row else 0
+        except Exception as e:
+            print(f"Error getting cart count: {e}")
+            return 0
+
+    @staticmethod
+    def get_cart_line_count(ma_tai_khoan):
+        """Đếm số sản phẩm khác nhau trong giỏ bằng COUNT, không load item"""
+        try:
+            return db.session.query(func.count(GioHang_SanPham.MaSanPham)).join(
+                GioHang, GioHang_SanPham.MaGioHang == GioHang.MaGioHang
+            ).filter(
+                GioHang.MaTaiKhoan == ma_tai_khoan
             ).scalar() or 0
+        except Exception as e:
+            print(f"Error getting cart line count: {e}")
+            return 0
 
-            cart = GioHang.query.get(ma_gio_hang)
-            if cart:
-                cart.TongSoLuong = total
+    @staticmethod
+    def adjust_cart_total(ma_gio_hang, delta):
+        """Cộng delta vào TongSoLuong bằng một câu UPDATE, không đọc lại các dòng giỏ hàng"""
+        if delta:
+            db.session.execute(
+                update(GioHang).where(GioHang.MaGioHang == ma_gio_hang).values(
+                    TongSoLuong=func.coalesce(GioHang.TongSoLuong, 0) + delta
+                )
+            )
 
-        except Exception as e:
-            print(f"Error updating cart total: {e}")
+    @staticmethod
+    def update_cart_total(ma_gio_hang):
+        """Tính lại TongSoLuong từ các dòng giỏ hàng (dùng khi đối soát)"""
+        db.session.execute(
+            update(GioHang).where(GioHang.MaGioHang == ma_gio_hang).values(
+                TongSoLuong=select(func.coalesce(func.sum(GioHang_SanPham.SoLuong), 0)).where(
+                    GioHang_SanPham.MaGioHang == ma_gio_hang
+                ).scalar_subquery()
+            )
+        )
+
+    @staticmethod
+    def _locked_cart_item(ma_tai_khoan, ma_san_pham):
+        """Lấy dòng giỏ hàng của tài khoản (khóa dòng để tính delta chính xác)"""
+        return GioHang_SanPham.query.join(
+            GioHang, GioHang_SanPham.MaGioHang == GioHang.MaGioHang
+        ).filter(
+            GioHang.MaTaiKhoan == ma_tai_khoan,
+            GioHang_SanPham.MaSanPham == ma_san_pham
+        ).with_for_update().first()
+
+    @staticmethod
+    def _missing_item_message(ma_tai_khoan):
+        if not db.session.query(GioHang.MaGioHang).filter_by(MaTaiKhoan=ma_tai_khoan).first():
+            return "Không tìm thấy giỏ hàng"
+        return "Sản phẩm không có trong giỏ hàng"
 
     @staticmethod
     def remove_from_cart(ma_tai_khoan, ma_san_pham):
         """Xóa sản phẩm khỏi giỏ hàng"""
         try:
-            cart = GioHang.query.filter_by(MaTaiKhoan=ma_tai_khoan).first()
-            if not cart:
-                return False, "Không tìm thấy giỏ hàng"
-
-            cart_item = GioHang_SanPham.query.filter_by(
-                MaGioHang=cart.MaGioHang,
-                MaSanPham=ma_san_pham
-            ).first()
-
+            cart_item = CartService._locked_cart_item(ma_tai_khoan, ma_san_pham)
             if not cart_item:
-                return False, "Sản phẩm không có trong giỏ hàng"
+                return False, CartService._missing_item_message(ma_tai_khoan)
 
+            ma_gio_hang, so_luong = cart_item.MaGioHang, cart_item.SoLuong or 0
             db.session.delete(cart_item)
 
-            # Cập nhật tổng số lượng
-            CartService.update_cart_total(cart.MaGioHang)
+            # Cập nhật tổng số lượng theo phần chênh lệch
+            CartService.adjust_cart_total(ma_gio_hang, -so_luong)
 
             db.session.commit()
             return True, "Đã xóa sản phẩm khỏi giỏ hàng"
@@ -487,22 +974,15 @@ class CartService:
     def update_cart_item(ma_tai_khoan, ma_san_pham, so_luong):
         """Cập nhật số lượng sản phẩm trong giỏ hàng"""
         try:
-            cart = GioHang.query.filter_by(MaTaiKhoan=ma_tai_khoan).first()
-            if not cart:
-                return False, "Không tìm thấy giỏ hàng"
-
-            cart_item = GioHang_SanPham.query.filter_by(
-                MaGioHang=cart.MaGioHang,
-                MaSanPham=ma_san_pham
-            ).first()
-
+            cart_item = CartService._locked_cart_item(ma_tai_khoan, ma_san_pham)
             if not cart_item:
-                return False, "Sản phẩm không có trong giỏ hàng"
+                return False, CartService._missing_item_message(ma_tai_khoan)
 
+            delta = so_luong - (cart_item.SoLuong or 0)
             cart_item.SoLuong = so_luong
 
-            # Cập nhật tổng số lượng
-            CartService.update_cart_total(cart.MaGioHang)
+            # Cập nhật tổng số lượng theo phần chênh lệch
+            CartService.adjust_cart_total(cart_item.MaGioHang, delta)
 
             db.session.commit()
             return True, "Đã cập nhật số lượng"
@@ -529,6 +1009,228 @@ class CartService:
             db.session.rollback()
             return False, f"Lỗi: {str(e)}"
 
+    @staticmethod
+    def remove_ordered_items(ma_tai_khoan, ordered):
+        """Bỏ các sản phẩm vừa đặt khỏi giỏ hàng, không commit
+
+        ordered là {mã sản phẩm: số lượng đã đặt}. Dòng có số lượng <= số đã
+        đặt bị xóa bằng một câu DELETE, các dòng còn lại bị trừ bằng một câu
+        UPDATE; TongSoLuong được trừ theo tổng phần đã bỏ. Số câu lệnh không
+        phụ thuộc số sản phẩm được chọn. Trả về tổng số lượng đã bỏ khỏi giỏ.
+        """
+        if not ordered:
+            return 0
+
+        lines = db.session.query(
+            GioHang_SanPham.MaGioHang,
+            GioHang_SanPham.MaSanPham,
+            GioHang_SanPham.SoLuong
+        ).join(
+            GioHang, GioHang_SanPham.MaGioHang == GioHang.MaGioHang
+        ).filter(
+            GioHang.MaTaiKhoan == ma_tai_khoan,
+            GioHang_SanPham.MaSanPham.in_(list(ordered))
+        ).with_for_update().all()
+
+        if not lines:
+            return 0
+
+        ma_gio_hang = lines[0].MaGioHang
+        removed = sum(min(line.SoLuong or 0, ordered[line.MaSanPham]) for line in lines)
+        ordered_quantity = case(ordered, value=GioHang_SanPham.MaSanPham)
+        selected = and_(
+            GioHang_SanPham.MaGioHang == ma_gio_hang,
+            GioHang_SanPham.MaSanPham.in_([line.MaSanPham for line in lines])
+        )
+
+        # Đặt hết số lượng trong giỏ: xóa dòng
+        db.session.execute(
+            delete(GioHang_SanPham).where(selected, GioHang_SanPham.SoLuong <= ordered_quantity),
+            execution_options={'synchronize_session': False}
+        )
+        # Đặt một phần: giảm số lượng
+        db.session.execute(
+            update(GioHang_SanPham).where(selected, GioHang_SanPham.SoLuong > ordered_quantity).values(
+                SoLuong=GioHang_SanPham.SoLuong - ordered_quantity,
+                NgayCapNhat=datetime.utcnow()
+            ),
+            execution_options={'synchronize_session': False}
+        )
+
+        CartService.adjust_cart_total(ma_gio_hang, -removed)
+        return removed
+
+    @staticmethod
+    def reconcile_cart_totals(batch_size=1000):
+        """Đối soát TongSoLuong với tổng thực tế của các dòng giỏ hàng
+
+        Duyệt giỏ hàng theo từng lô MaGioHang, tính lại những giỏ bị lệch rồi
+        commit sau mỗi lô. Trả về (số giỏ đã kiểm tra, [mã các giỏ đã sửa]).
+        """
+        checked = 0
+        fixed = []
+        last_id = 0
+        actual = func.coalesce(func.sum(GioHang_SanPham.SoLuong), 0)
+
+        while True:
+            rows = db.session.query(
+                GioHang.MaGioHang,
+                GioHang.TongSoLuong,
+                actual.label('actual')
+            ).outerjoin(
+                GioHang_SanPham, GioHang_SanPham.MaGioHang == GioHang.MaGioHang
+            ).filter(
+                GioHang.MaGioHang > last_id
+            ).group_by(
+                GioHang.MaGioHang, GioHang.TongSoLuong
+            ).order_by(
+                GioHang.MaGioHang
+            ).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            for row in rows:
+                if (row.TongSoLuong or 0) != row.actual:
+                    # Tính lại trong chính câu UPDATE để không ghi đè thay đổi vừa xảy ra
+                    CartService.update_cart_total(row.MaGioHang)
+                    fixed.append(row.MaGioHang)
+
+            db.session.commit()
+            checked += len(rows)
+            last_id = rows[-1].MaGioHang
+
+        return checked, fixed
+
+
+class AdminSearch:
+    """Chuyển từ khóa tìm kiếm của admin thành điều kiện dùng được index.
+
+    - Chuỗi số (có thể kèm '#'): tra khóa chính chính xác hoặc theo tiền tố
+      số, biểu diễn bằng các khoảng [p*10^k, (p+1)*10^k) thay vì LIKE trên id.
+    - Chuỗi có '@': so khớp tiền tố trên DangNhap.DiaChiEmail.
+    - Còn lại là tên: FULLTEXT trên TaiKhoan(Ho, Ten) với MySQL khi đã có
+      index ft_TaiKhoan_Ho_Ten, tiền tố trên Ho/Ten khi chưa có index đó, với
+      các database khác và với từ ngắn hơn FULLTEXT_MIN_TOKEN.
+    """
+    MAX_ID_DIGITS = 10
+    FULLTEXT_MIN_TOKEN = 3
+    FULLTEXT_INDEX = 'ft_TaiKhoan_Ho_Ten'
+    # Chưa có index FULLTEXT thì kiểm tra lại sau bấy nhiêu giây (ví dụ sau khi chạy migrate_db.py)
+    FULLTEXT_RECHECK = 60
+
+    _fulltext_checked = {}
+    _fulltext_lock = threading.Lock()
+
+    @staticmethod
+    def plan(search):
+        """Phân loại từ khóa, trả về (loại, giá trị) với loại là 'id', 'email', 'name' hoặc None"""
+        text = (search or '').strip()
+        if not text:
+            return None, None
+
+        digits = text.lstrip('#')
+        if digits.isdigit():
+            return 'id', digits
+        if '@' in text:
+            return 'email', text.lower()
+        return 'name', text.split()
+
+    @staticmethod
+    def _like_prefix(text):
+        """Mẫu LIKE 'text%' đã escape ký tự đại diện"""
+        return text.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+
+    @staticmethod
+    def id_condition(column, digits):
+        """Mã bằng digits hoặc bắt đầu bằng digits, dạng các khoảng trên khóa chính"""
+        value = int(digits)
+        if digits.startswith('0') or len(digits) >= AdminSearch.MAX_ID_DIGITS:
+            return column == value
+
+        ranges = [column == value]
+        for extra in range(1, AdminSearch.MAX_ID_DIGITS - len(digits) + 1):
+            scale = 10 ** extra
+            ranges.append(and_(column >= value * scale, column < (value + 1) * scale))
+        return or_(*ranges)
+
+    @staticmethod
+    def email_condition(column, email):
+        """Email bắt đầu bằng từ khóa"""
+        return column.like(AdminSearch._like_prefix(email), escape='/')
+
+    @staticmethod
+    def has_fulltext_index(indexes):
+        """Danh sách index phản chiếu của TaiKhoan có index FULLTEXT trên (Ho, Ten) hay không"""
+        for index in indexes:
+            if index.get('name') == AdminSearch.FULLTEXT_INDEX:
+                return True
+            prefix = (index.get('dialect_options') or {}).get('mysql_prefix') or index.get('type')
+            if (prefix or '').upper() == 'FULLTEXT' and index.get('column_names') == ['Ho', 'Ten']:
+                return True
+        return False
+
+    @classmethod
+    def fulltext_available(cls):
+        """Có dùng được MATCH ... AGAINST trên TaiKhoan(Ho, Ten) không
+
+        Chỉ MySQL và chỉ khi database đã có index FULLTEXT (migration 4); kết
+        quả được nhớ theo engine, trường hợp chưa có index thì kiểm tra lại
+        sau FULLTEXT_RECHECK giây.
+        """
+        engine = db.session.get_bind()
+        if engine.dialect.name != 'mysql':
+            return False
+
+        available, checked_at = cls._fulltext_checked.get(engine, (False, None))
+        if available or (checked_at is not None and time.monotonic() - checked_at < cls.FULLTEXT_RECHECK):
+            return available
+
+        with cls._fulltext_lock:
+            try:
+                available = cls.has_fulltext_index(inspect(engine).get_indexes(TaiKhoan.__tablename__))
+            except Exception as e:
+                print(f"Error checking FULLTEXT index: {e}")
+                available = False
+            if not available:
+                print(f"Warning: thiếu index {cls.FULLTEXT_INDEX}, tìm khách hàng theo tên dùng LIKE tiền tố")
+            cls._fulltext_checked[engine] = (available, time.monotonic())
+        return available
+
+    @staticmethod
+    def name_condition(words):
+        """Mọi từ khóa đều phải khớp họ hoặc tên khách hàng"""
+        conditions = []
+        fulltext_words = []
+        use_fulltext = AdminSearch.fulltext_available()
+
+        for word in words:
+            if use_fulltext and len(word) >= AdminSearch.FULLTEXT_MIN_TOKEN:
+                # Bỏ các toán tử của boolean mode trong từ khóa
+                word = ''.join(ch for ch in word if ch.isalnum())
+                if word:
+                    fulltext_words.append(f'+{word}*')
+                continue
+            pattern = AdminSearch._like_prefix(word)
+            conditions.append(or_(
+                TaiKhoan.Ho.like(pattern, escape='/'),
+                TaiKhoan.Ten.like(pattern, escape='/')
+            ))
+
+        if fulltext_words:
+            from sqlalchemy.dialects.mysql import match
+            conditions.append(
+                match(TaiKhoan.Ho, TaiKhoan.Ten, against=' '.join(fulltext_words)).in_boolean_mode()
+            )
+        return and_(*conditions)
+
+    @staticmethod
+    def account_email_condition(email):
+        """Tài khoản có email bắt đầu bằng từ khóa, dùng cho truy vấn không join DangNhap"""
+        return TaiKhoan.MaTaiKhoan.in_(
+            select(DangNhap.MaTaiKhoan).where(AdminSearch.email_condition(DangNhap.DiaChiEmail, email))
+        )
+
 
 class OrderService:
     @staticmethod
@@ -563,21 +1265,32 @@ class OrderService:
 
             db.session.add(don_hang)
             db.session.flush()  # Để lấy MaDonHang
+            RevenueRollupService.record_order(don_hang.NgayDat, 'pending', tong_tien)
 
-            # Tạo chi tiết đơn hàng
-            for item in cart_items:
-                chi_tiet = ChiTiet_DonHang(
-                    MaDonHang=don_hang.MaDonHang,
-                    MaSanPham=item.SanPham.MaSanPham,
-                    SoLuong=item.GioHang_SanPham.SoLuong,
-                    DonGia=item.SanPham.GiaBan
-                )
-                db.session.add(chi_tiet)
+            # Tạo chi tiết đơn hàng bằng một lệnh insert nhiều dòng
+            db.session.execute(insert(ChiTiet_DonHang), [
+                {
+                    'MaDonHang': don_hang.MaDonHang,
+                    'MaSanPham': item.SanPham.MaSanPham,
+                    'SoLuong': item.GioHang_SanPham.SoLuong,
+                    'DonGia': item.SanPham.GiaBan
+                }
+                for item in cart_items
+            ])
 
             # Xóa giỏ hàng
             GioHang_SanPham.query.filter_by(MaGioHang=cart.MaGioHang).delete()
             cart.TongSoLuong = 0
 
+            # Giữ tồn kho ngay trước commit
+            quantities = {}
+            for item in cart_items:
+                product_id = item.SanPham.MaSanPham
+                quantities[product_id] = quantities.get(product_id, 0) + item.GioHang_SanPham.SoLuong
+            if not InventoryService.reserve(quantities):
+                db.session.rollback()
+                return False, InventoryService.shortage_message(quantities)
+
             db.session.commit()
             return True, don_hang.MaDonHang
 
@@ -586,47 +1299,210 @@ class OrderService:
             return False, f"Lỗi: {str(e)}"
 
     @staticmethod
-    def get_user_orders(ma_tai_khoan):
-        """Lấy danh sách đơn hàng của user"""
+    def new_order_token():
+        """Cấp mã yêu cầu đặt hàng cho một lần checkout"""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def find_order_by_token(ma_tai_khoan, ma_yeu_cau):
+        """Mã đơn hàng đã tạo bằng mã yêu cầu này (tra index uq_DonHang_MaYeuCau), None nếu chưa có"""
+        if not ma_yeu_cau:
+            return None
+        return db.session.query(DonHang.MaDonHang).filter_by(
+            MaYeuCau=ma_yeu_cau,
+            MaTaiKhoan=ma_tai_khoan
+        ).scalar()
+
+    @staticmethod
+    def encode_order_cursor(ngay_dat, ma_don_hang):
+        """Tạo cursor phân trang từ (NgayDat, MaDonHang) của đơn cuối trang"""
+        return f"{ngay_dat.strftime('%Y%m%d%H%M%S%f')}-{ma_don_hang}"
+
+    @staticmethod
+    def decode_order_cursor(cursor):
+        """Đọc cursor phân trang, trả về (NgayDat, MaDonHang) hoặc None nếu không hợp lệ"""
         try:
-            orders = db.session.query(DonHang).filter_by(MaTaiKhoan=ma_tai_khoan).order_by(DonHang.NgayDat.desc()).all()
+            ngay_dat, ma_don_hang = cursor.split('-', 1)
+            return datetime.strptime(ngay_dat, '%Y%m%d%H%M%S%f'), int(ma_don_hang)
+        except (AttributeError, ValueError):
+            return None
 
-            result = []
-            for order in orders:
-                # Lấy chi tiết đơn hàng
-                chi_tiets = db.session.query(ChiTiet_DonHang, SanPham).join(SanPham).filter(
-                    ChiTiet_DonHang.MaDonHang == order.MaDonHang
-                ).all()
-
-                order_items = []
-                for chi_tiet, san_pham in chi_tiets:
-                    order_items.append({
-                        'name': san_pham.TenSanPham,
-                        'quantity': chi_tiet.SoLuong,
-                        'price': float(chi_tiet.DonGia),
-                        'subtotal': float(chi_tiet.DonGia) * chi_tiet.SoLuong
-                    })
-
-                result.append({
+    @staticmethod
+    def get_order_items(order_ids):
+        """Lấy chi tiết của nhiều đơn hàng bằng một truy vấn IN, nhóm theo mã đơn"""
+        items_by_order = {order_id: [] for order_id in order_ids}
+        if not order_ids:
+            return items_by_order
+
+        rows = db.session.query(
+            ChiTiet_DonHang.MaDonHang,
+            ChiTiet_DonHang.SoLuong,
+            ChiTiet_DonHang.DonGia,
+            SanPham.TenSanPham
+        ).join(
+            SanPham, ChiTiet_DonHang.MaSanPham == SanPham.MaSanPham
+        ).filter(
+            ChiTiet_DonHang.MaDonHang.in_(order_ids)
+        ).order_by(ChiTiet_DonHang.MaChiTietDH).all()
+
+        for row in rows:
+            items_by_order[row.MaDonHang].append({
+                'name': row.TenSanPham,
+                'quantity': row.SoLuong,
+                'price': float(row.DonGia),
+                'subtotal': float(row.DonGia) * row.SoLuong
+            })
+        return items_by_order
+
+    @staticmethod
+    def get_user_orders_page(ma_tai_khoan, cursor=None, per_page=20):
+        """Lấy một trang đơn hàng của user (mới nhất trước)
+
+        Phân trang keyset theo (NgayDat, MaDonHang); trả về (orders, next_cursor),
+        next_cursor là None khi đã hết đơn hàng.
+        """
+        try:
+            query = db.session.query(
+                DonHang.MaDonHang,
+                DonHang.NgayDat,
+                DonHang.Status,
+                DonHang.TongTien,
+                DiaChi.DiaChi,
+                DiaChi.QuanHuyen,
+                DiaChi.TinhThanh
+            ).outerjoin(
+                DiaChi, DonHang.MaDiaChi == DiaChi.MaDiaChi
+            ).filter(DonHang.MaTaiKhoan == ma_tai_khoan)
+
+            position = OrderService.decode_order_cursor(cursor) if cursor else None
+            if position:
+                ngay_dat, ma_don_hang = position
+                query = query.filter(or_(
+                    DonHang.NgayDat < ngay_dat,
+                    and_(DonHang.NgayDat == ngay_dat, DonHang.MaDonHang < ma_don_hang)
+                ))
+
+            query = query.order_by(DonHang.NgayDat.desc(), DonHang.MaDonHang.desc())
+            if per_page:
+                # Lấy dư 1 dòng để biết còn trang sau hay không
+                query = query.limit(per_page + 1)
+            orders = query.all()
+
+            next_cursor = None
+            if per_page and len(orders) > per_page:
+                orders = orders[:per_page]
+                next_cursor = OrderService.encode_order_cursor(orders[-1].NgayDat, orders[-1].MaDonHang)
+
+            items_by_order = OrderService.get_order_items([order.MaDonHang for order in orders])
+
+            result = [
+                {
                     'id': order.MaDonHang,
                     'date': order.NgayDat.strftime('%d/%m/%Y %H:%M'),
                     'status': order.Status,
                     'total': float(order.TongTien),
-                    'items': order_items,
+                    'address': f"{order.DiaChi}, {order.QuanHuyen}, {order.TinhThanh}",
+                    'items': items_by_order[order.MaDonHang],
                     'can_cancel': order.Status == 'pending'
-                })
-
-            return result
+                }
+                for order in orders
+            ]
+            return result, next_cursor
         except Exception as e:
             print(f"Error getting user orders: {e}")
-            return []
+            return [], None
+
+    @staticmethod
+    def get_admin_orders_page(status=None, order_date=None, search=None, cursor=None, limit=50,
+                              with_total=False):
+        """Danh sách đơn hàng cho admin, phân trang keyset theo (NgayDat, MaDonHang)
+
+        Bộ lọc được áp dụng trong SQL trước LIMIT. Trả về
+        (orders, next_cursor, total); total là None nếu không yêu cầu.
+        """
+        query = db.session.query(
+            DonHang.MaDonHang,
+            DonHang.NgayDat,
+            DonHang.TongTien,
+            DonHang.Status,
+            TaiKhoan.MaTaiKhoan,
+            TaiKhoan.Ho,
+            TaiKhoan.Ten
+        ).join(
+            TaiKhoan, DonHang.MaTaiKhoan == TaiKhoan.MaTaiKhoan
+        )
+
+        # Áp dụng các bộ lọc
+        if status:
+            query = query.filter(DonHang.Status == status)
+
+        if order_date:
+            # So sánh theo khoảng để dùng được index trên NgayDat
+            day_start = datetime.strptime(order_date, '%Y-%m-%d')
+            query = query.filter(DonHang.NgayDat >= day_start, DonHang.NgayDat < day_start + timedelta(days=1))
+
+        kind, value = AdminSearch.plan(search)
+        if kind == 'id':
+            query = query.filter(AdminSearch.id_condition(DonHang.MaDonHang, value))
+        elif kind == 'email':
+            query = query.filter(AdminSearch.account_email_condition(value))
+        elif kind == 'name':
+            query = query.filter(AdminSearch.name_condition(value))
+
+        total = None
+        if with_total:
+            if not (order_date or kind):
+                # Ước lượng từ bảng tổng hợp (đã cache), không cần COUNT trên DonHang
+                order_stats = DashboardService.get_stats()['orders']
+                total = order_stats.get(status, 0) if status else order_stats['total']
+            else:
+                total = query.order_by(None).count()
+
+        position = OrderService.decode_order_cursor(cursor) if cursor else None
+        if position:
+            ngay_dat, ma_don_hang = position
+            query = query.filter(or_(
+                DonHang.NgayDat < ngay_dat,
+                and_(DonHang.NgayDat == ngay_dat, DonHang.MaDonHang < ma_don_hang)
+            ))
+
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        rows = query.order_by(DonHang.NgayDat.desc(), DonHang.MaDonHang.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = OrderService.encode_order_cursor(rows[-1].NgayDat, rows[-1].MaDonHang)
+
+        orders = []
+        for row in rows:
+            # Tạo tên đầy đủ từ Ho và Ten
+            customer_name = f"{row.Ho or ''} {row.Ten or ''}".strip()
+            if not customer_name:
+                customer_name = f"Khách hàng #{row.MaTaiKhoan}"
+
+            orders.append({
+                'id': row.MaDonHang,
+                'customer_name': customer_name,
+                'date': row.NgayDat.isoformat() if row.NgayDat else '',
+                'total': float(row.TongTien) if row.TongTien else 0,
+                'status': row.Status or 'pending'
+            })
+
+        return orders, next_cursor, total
+
+    @staticmethod
+    def get_user_orders(ma_tai_khoan):
+        """Lấy danh sách đơn hàng của user"""
+        orders, _ = OrderService.get_user_orders_page(ma_tai_khoan, per_page=None)
+        return orders
 
     @staticmethod
     def cancel_order(ma_tai_khoan, ma_don_hang):
         """Hủy đơn hàng"""
         try:
-            # Kiểm tra đơn hàng có thuộc về user không
-            order = DonHang.query.filter_by(MaDonHang=ma_don_hang, MaTaiKhoan=ma_tai_khoan).first()
+            # Kiểm tra đơn hàng có thuộc về user không (khóa dòng để không hoàn kho hai lần)
+            order = DonHang.query.filter_by(MaDonHang=ma_don_hang, MaTaiKhoan=ma_tai_khoan).with_for_update().first()
 
             if not order:
                 return False, "Không tìm thấy đơn hàng"
@@ -634,12 +1510,1139 @@ class OrderService:
             if order.Status != 'pending':
                 return False, "Không thể hủy đơn hàng này"
 
-            # Cập nhật trạng thái
+            # Cập nhật trạng thái và hoàn lại tồn kho
+            RevenueRollupService.record_status_change(order.NgayDat, order.TongTien, order.Status, 'canceled')
+            InventoryService.apply_status_change(order.MaDonHang, order.Status, 'canceled')
             order.Status = 'canceled'
             db.session.commit()
+            ProductService.invalidate_catalog()
 
             return True, "Hủy đơn hàng thành công"
 
         except Exception as e:
             db.session.rollback()
             return False, f"Lỗi: {str(e)}"
+
+
+class CustomerService:
+    """Danh sách khách hàng cho admin, lọc/sắp xếp/phân trang trong SQL"""
+    SORT_COLUMNS = ('id', 'total_orders', 'total_spent')
+
+    @staticmethod
+    def encode_customer_cursor(value, ma_tai_khoan):
+        """Tạo cursor từ giá trị cột sắp xếp và mã tài khoản của dòng cuối trang"""
+        return f"{value}_{ma_tai_khoan}"
+
+    @staticmethod
+    def decode_customer_cursor(cursor, sort):
+        """Đọc cursor phân trang, trả về (giá trị sắp xếp, MaTaiKhoan) hoặc None nếu không hợp lệ"""
+        try:
+            value, ma_tai_khoan = cursor.split('_', 1)
+            value = Decimal(value) if sort == 'total_spent' else int(value)
+            return value, int(ma_tai_khoan)
+        except (AttributeError, ValueError, InvalidOperation):
+            return None
+
+    @staticmethod
+    def get_admin_customers_page(status=None, order_filter=None, search=None, sort='id', direction='desc',
+                                 cursor=None, limit=50, with_total=False):
+        """Danh sách khách hàng kèm số đơn và tổng chi tiêu, phân trang keyset
+
+        Bộ lọc trạng thái/đơn hàng là điều kiện HAVING trên các cột tổng hợp,
+        sắp xếp theo sort (id, total_orders, total_spent) rồi tới MaTaiKhoan.
+        Trả về (customers, next_cursor, total); total là None nếu không yêu cầu.
+        """
+        if sort not in CustomerService.SORT_COLUMNS:
+            sort = 'id'
+        descending = direction != 'asc'
+
+        total_orders = func.count(DonHang.MaDonHang)
+        total_spent = func.coalesce(func.sum(
+            case(
+                (DonHang.Status.in_(DashboardService.PAID_STATUSES), DonHang.TongTien),
+                else_=0
+            )
+        ), 0)
+
+        query = db.session.query(
+            TaiKhoan.MaTaiKhoan,
+            TaiKhoan.Ho,
+            TaiKhoan.Ten,
+            TaiKhoan.SoDienThoai,
+            DangNhap.DiaChiEmail,
+            total_orders.label('total_orders'),
+            total_spent.label('total_spent')
+        ).outerjoin(
+            DangNhap, TaiKhoan.MaTaiKhoan == DangNhap.MaTaiKhoan
+        ).outerjoin(
+            DonHang, TaiKhoan.MaTaiKhoan == DonHang.MaTaiKhoan
+        ).group_by(
+            TaiKhoan.MaTaiKhoan, TaiKhoan.Ho, TaiKhoan.Ten, TaiKhoan.SoDienThoai, DangNhap.DiaChiEmail
+        )
+
+        # Áp dụng các bộ lọc
+        kind, value = AdminSearch.plan(search)
+        if kind == 'id':
+            query = query.filter(AdminSearch.id_condition(TaiKhoan.MaTaiKhoan, value))
+        elif kind == 'email':
+            query = query.filter(AdminSearch.email_condition(DangNhap.DiaChiEmail, value))
+        elif kind == 'name':
+            query = query.filter(AdminSearch.name_condition(value))
+
+        # Khách hàng 'active' là khách đã có đơn hàng
+        if status == 'active' or order_filter == 'has_orders':
+            query = query.having(total_orders > 0)
+        if status == 'inactive' or order_filter == 'no_orders':
+            query = query.having(total_orders == 0)
+
+        total = None
+        if with_total:
+            if not (status or order_filter or kind):
+                # Không lọc: dùng số tài khoản đã cache của dashboard
+                total = DashboardService.get_stats()['users']['total']
+            else:
+                total = db.session.query(func.count()).select_from(query.order_by(None).subquery()).scalar()
+
+        sort_column = {
+            'id': TaiKhoan.MaTaiKhoan,
+            'total_orders': total_orders,
+            'total_spent': total_spent
+        }[sort]
+
+        position = CustomerService.decode_customer_cursor(cursor, sort) if cursor else None
+        if position:
+            value, ma_tai_khoan = position
+            if sort == 'id':
+                query = query.filter(
+                    TaiKhoan.MaTaiKhoan < ma_tai_khoan if descending else TaiKhoan.MaTaiKhoan > ma_tai_khoan
+                )
+            elif descending:
+                query = query.having(or_(
+                    sort_column < value,
+                    and_(sort_column == value, TaiKhoan.MaTaiKhoan < ma_tai_khoan)
+                ))
+            else:
+                query = query.having(or_(
+                    sort_column > value,
+                    and_(sort_column == value, TaiKhoan.MaTaiKhoan > ma_tai_khoan)
+                ))
+
+        if descending:
+            order_by = [sort_column.desc(), TaiKhoan.MaTaiKhoan.desc()]
+        else:
+            order_by = [sort_column.asc(), TaiKhoan.MaTaiKhoan.asc()]
+        if sort == 'id':
+            order_by = order_by[1:]
+
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        rows = query.order_by(*order_by).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            value = last.MaTaiKhoan if sort == 'id' else getattr(last, sort)
+            next_cursor = CustomerService.encode_customer_cursor(value, last.MaTaiKhoan)
+
+        customers = []
+        for row in rows:
+            # Tạo tên đầy đủ
+            full_name = f"{row.Ho or ''} {row.Ten or ''}".strip()
+            if not full_name:
+                full_name = f"Khách hàng #{row.MaTaiKhoan}"
+
+            customers.append({
+                'id': row.MaTaiKhoan,
+                'full_name': full_name,
+                'email': row.DiaChiEmail,
+                'phone': row.SoDienThoai,
+                'total_orders': row.total_orders or 0,
+                'total_spent': float(row.total_spent) if row.total_spent else 0,
+                'status': 'active' if row.total_orders else 'inactive'
+            })
+
+        return customers, next_cursor, total
+
+
+class DashboardService:
+    """Thống kê cho dashboard admin, tính bằng conditional aggregation.
+
+    Kết quả được cache chung cho mọi phiên admin trong DASHBOARD_STATS_TTL
+    giây, nên nhiều admin cùng mở dashboard không nhân số truy vấn lên.
+    """
+    DEFAULT_TTL = 5
+    MAX_ENTRIES = 256
+    PAID_STATUSES = ('delivered', 'shipped')
+
+    _lock = threading.Lock()
+    _cache = {}
+    _key_locks = {}
+    _pool = None
+
+    @classmethod
+    def _cached(cls, key, loader):
+        """Lấy giá trị từ cache theo key, gọi loader khi hết hạn"""
+        ttl = current_app.config.get('DASHBOARD_STATS_TTL', cls.DEFAULT_TTL)
+        entry = cls._cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        # Khóa riêng theo key để các số liệu khác nhau vẫn tính song song được
+        with cls._lock:
+            key_lock = cls._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            entry = cls._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            value = loader()
+            now = time.monotonic()
+            cls._cache[key] = (now + ttl, value)
+            if len(cls._cache) > cls.MAX_ENTRIES:
+                # Dọn các entry đã hết hạn (ví dụ biểu đồ theo khoảng ngày tùy chọn)
+                for stale_key in [k for k, v in list(cls._cache.items()) if v[0] <= now]:
+                    cls._cache.pop(stale_key, None)
+                    cls._key_locks.pop(stale_key, None)
+            return value
+
+    @classmethod
+    def invalidate(cls):
+        """Xóa cache thống kê (sau khi admin thay đổi dữ liệu)"""
+        with cls._lock:
+            cls._cache.clear()
+
+    @staticmethod
+    def _load_stats():
+        today = date.today()
+        month_start = today.replace(day=1)
+        paid = DoanhThuNgay.Status.in_(DashboardService.PAID_STATUSES)
+
+        # Sản phẩm theo trạng thái kho
+        products = db.session.query(
+            func.count(SanPham.MaSanPham),
+            func.sum(case((SanPham.SoLuong > 10, 1), else_=0)),
+            func.sum(case((SanPham.SoLuong.between(1, 10), 1), else_=0)),
+            func.sum(case((SanPham.SoLuong == 0, 1), else_=0))
+        ).filter(SanPham.TrangThai == 1).one()
+
+        # Đơn hàng theo trạng thái và doanh thu hôm nay / tháng này, đọc từ bảng tổng hợp DoanhThuNgay
+        orders = db.session.query(
+            func.sum(DoanhThuNgay.SoDonHang),
+            func.sum(case((DoanhThuNgay.Status == 'pending', DoanhThuNgay.SoDonHang), else_=0)),
+            func.sum(case((DoanhThuNgay.Status == 'shipped', DoanhThuNgay.SoDonHang), else_=0)),
+            func.sum(case((DoanhThuNgay.Status == 'delivered', DoanhThuNgay.SoDonHang), else_=0)),
+            func.sum(case((DoanhThuNgay.Status == 'canceled', DoanhThuNgay.SoDonHang), else_=0)),
+            func.sum(case((and_(paid, DoanhThuNgay.Ngay >= today), DoanhThuNgay.DoanhThu), else_=0)),
+            func.sum(case((and_(paid, DoanhThuNgay.Ngay >= month_start), DoanhThuNgay.DoanhThu), else_=0))
+        ).one()
+
+        total_users = db.session.query(func.count(TaiKhoan.MaTaiKhoan)).scalar() or 0
+
+        return {
+            'products': {
+                'total': products[0] or 0,
+                'in_stock': int(products[1] or 0),
+                'low_stock': int(products[2] or 0),
+                'out_of_stock': int(products[3] or 0)
+            },
+            'orders': {
+                'total': int(orders[0] or 0),
+                'pending': int(orders[1] or 0),
+                'shipped': int(orders[2] or 0),
+                'delivered': int(orders[3] or 0),
+                'canceled': int(orders[4] or 0)
+            },
+            'revenue': {
+                'today': float(orders[5] or 0),
+                'month': float(orders[6] or 0)
+            },
+            'users': {
+                'total': total_users,
+                # TaiKhoan không có NgayTao nên không thống kê user mới
+                'new_this_month': 0
+            }
+        }
+
+    @staticmethod
+    def get_stats():
+        """Toàn bộ số liệu thống kê dashboard (có cache)"""
+        return DashboardService._cached('stats', DashboardService._load_stats)
+
+    @staticmethod
+    def get_quick_stats():
+        """Số liệu cho thẻ thống kê nhanh trên dashboard"""
+        stats = DashboardService.get_stats()
+        return {
+            'products': stats['products'],
+            'orders': {
+                'total': stats['orders']['total'],
+                'pending': stats['orders']['pending'],
+                'shipped': stats['orders']['shipped'],
+                'delivered': stats['orders']['delivered']
+            },
+            'revenue': stats['revenue'],
+            'users': stats['users']
+        }
+
+    @staticmethod
+    def get_recent_orders(limit=10):
+        """Các đơn hàng gần đây nhất kèm tên khách hàng"""
+        recent_orders = db.session.query(
+            DonHang.MaDonHang,
+            DonHang.TongTien,
+            DonHang.NgayDat,
+            DonHang.Status,
+            TaiKhoan.MaTaiKhoan,
+            TaiKhoan.Ho,
+            TaiKhoan.Ten
+        ).join(
+            TaiKhoan, DonHang.MaTaiKhoan == TaiKhoan.MaTaiKhoan
+        ).order_by(
+            DonHang.NgayDat.desc()
+        ).limit(limit).all()
+
+        result = []
+        for order in recent_orders:
+            # Tạo tên đầy đủ từ Ho và Ten
+            customer_name = f"{order.Ho or ''} {order.Ten or ''}".strip()
+            if not customer_name:
+                customer_name = f"Khách hàng #{order.MaTaiKhoan}"
+
+            result.append({
+                'id': order.MaDonHang,
+                'customer_name': customer_name,
+                'total': float(order.TongTien) if order.TongTien else 0,
+                'date': order.NgayDat.strftime('%Y-%m-%d %H:%M:%S') if order.NgayDat else '',
+                'status': order.Status or 'pending'
+            })
+        return result
+
+    @staticmethod
+    def get_low_stock_products(limit=15):
+        """Các sản phẩm đang bán có số lượng <= 10, ít nhất trước"""
+        low_stock_products = db.session.query(
+            SanPham.MaSanPham,
+            SanPham.TenSanPham,
+            SanPham.SoLuong,
+            SanPham.GiaBan,
+            Loai.TenLoai
+        ).join(
+            Loai, SanPham.MaLoai == Loai.MaLoai
+        ).filter(
+            SanPham.TrangThai == 1,
+            SanPham.SoLuong <= 10
+        ).order_by(
+            SanPham.SoLuong.asc()
+        ).limit(limit).all()
+
+        return [
+            {
+                'id': product.MaSanPham,
+                'name': product.TenSanPham,
+                'category': product.TenLoai,
+                'quantity': product.SoLuong,
+                'price': float(product.GiaBan) if product.GiaBan else 0
+            }
+            for product in low_stock_products
+        ]
+
+    @classmethod
+    def _executor(cls):
+        with cls._lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='dashboard')
+            return cls._pool
+
+    @staticmethod
+    def _run_section(app, loader):
+        """Chạy một phần dashboard trong app context (và session) riêng của thread"""
+        with app.app_context():
+            started = time.perf_counter()
+            try:
+                return loader(), None, time.perf_counter() - started
+            except Exception as e:
+                return None, str(e), time.perf_counter() - started
+
+    @staticmethod
+    def get_overview(period='7'):
+        """Tổng hợp dữ liệu dashboard, các phần độc lập chạy song song
+
+        Trả về (overview, timings_ms, errors)
+        """
+        start_date, end_date, granularity = DashboardService.get_period_range(period)
+
+        def load_chart():
+            labels, values = DashboardService.get_revenue_series(start_date, end_date, granularity)
+            return {'labels': labels, 'values': values, 'period': period}
+
+        sections = {
+            'statistics': (DashboardService.get_quick_stats, {}),
+            'chart': (load_chart, {}),
+            'recent_orders': (DashboardService.get_recent_orders, []),
+            'low_stock_products': (DashboardService.get_low_stock_products, [])
+        }
+
+        app = current_app._get_current_object()
+        pool = DashboardService._executor()
+        futures = {
+            name: pool.submit(DashboardService._run_section, app, loader)
+            for name, (loader, _) in sections.items()
+        }
+
+        overview, timings, errors = {}, {}, {}
+        for name, future in futures.items():
+            value, error, elapsed = future.result()
+            overview[name] = value if error is None else sections[name][1]
+            timings[name] = round(elapsed * 1000, 2)
+            if error is not None:
+                errors[name] = error
+        return overview, timings, errors
+
+    @staticmethod
+    def _daily_revenue(start_date, end_date):
+        """Doanh thu từng ngày trong [start_date, end_date], đọc từ bảng tổng hợp DoanhThuNgay"""
+        rows = db.session.query(
+            DoanhThuNgay.Ngay,
+            func.sum(DoanhThuNgay.DoanhThu)
+        ).filter(
+            DoanhThuNgay.Ngay >= start_date,
+            DoanhThuNgay.Ngay <= end_date,
+            DoanhThuNgay.Status.in_(DashboardService.PAID_STATUSES)
+        ).group_by(DoanhThuNgay.Ngay).all()
+
+        return {bucket_day: float(total or 0) for bucket_day, total in rows}
+
+    @staticmethod
+    def _revenue_buckets(start_date, end_date, granularity):
+        """Danh sách bucket (nhãn, ngày bắt đầu, ngày kết thúc) phủ kín khoảng thời gian"""
+        buckets = []
+        if granularity == 'week':
+            current, index = start_date, 1
+            while current <= end_date:
+                bucket_end = min(current + timedelta(days=6), end_date)
+                buckets.append((f"Tuần {index}", current, bucket_end))
+                current, index = bucket_end + timedelta(days=1), index + 1
+        elif granularity == 'month':
+            current = start_date
+            while current <= end_date:
+                next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+                buckets.append((current, current, min(next_month - timedelta(days=1), end_date)))
+                current = next_month
+            # Nhãn "Tháng m" nếu không trùng tháng giữa các năm, ngược lại "mm/yyyy"
+            months = [bucket[0].month for bucket in buckets]
+            same_month_repeated = len(set(months)) != len(months)
+            buckets = [
+                (bucket_start.strftime('%m/%Y') if same_month_repeated else f"Tháng {bucket_start.month}",
+                 bucket_start, bucket_end)
+                for _, bucket_start, bucket_end in buckets
+            ]
+        else:
+            current = start_date
+            while current <= end_date:
+                buckets.append((current.strftime('%d/%m'), current, current))
+                current += timedelta(days=1)
+        return buckets
+
+    @staticmethod
+    def get_revenue_series(start_date, end_date, granularity='day'):
+        """Doanh thu theo ngày/tuần/tháng từ start_date đến end_date (tính cả hai đầu)
+
+        Chỉ một truy vấn GROUP BY theo ngày; gộp bucket và điền 0 cho bucket
+        trống được làm trong Python. Trả về (labels, values).
+        """
+        def load():
+            daily = DashboardService._daily_revenue(start_date, end_date)
+            labels, values = [], []
+            for label, bucket_start, bucket_end in DashboardService._revenue_buckets(
+                    start_date, end_date, granularity):
+                labels.append(label)
+                if bucket_start == bucket_end:
+                    values.append(daily.get(bucket_start, 0))
+                else:
+                    values.append(sum(total for day, total in daily.items() if bucket_start <= day <= bucket_end))
+            return labels, values
+
+        return DashboardService._cached(('revenue', start_date, end_date, granularity), load)
+
+    @staticmethod
+    def get_period_range(period, today=None):
+        """Khoảng thời gian và độ chia mặc định cho các period 7/30/90/365 ngày"""
+        today = today or date.today()
+        if period == '30':
+            # 4 tuần gần đây
+            return today - timedelta(days=27), today, 'week'
+        if period == '90':
+            # Tháng hiện tại và 2 tháng trước
+            start = today.replace(day=1)
+            for _ in range(2):
+                start = (start - timedelta(days=1)).replace(day=1)
+            return start, today, 'month'
+        if period == '365':
+            # 12 tháng gần đây
+            start = today.replace(day=1)
+            for _ in range(11):
+                start = (start - timedelta(days=1)).replace(day=1)
+            return start, today, 'month'
+        # Mặc định 7 ngày gần đây, bao gồm hôm nay
+        return today - timedelta(days=6), today, 'day'
+
+
+class RevenueRollupService:
+    """Duy trì bảng DoanhThuNgay (số đơn và doanh thu theo ngày + trạng thái).
+
+    Các hàm record_* chỉ thêm câu lệnh vào transaction hiện tại; caller tự
+    commit cùng với thay đổi đơn hàng.
+    """
+
+    @staticmethod
+    def _day(ngay_dat):
+        return (ngay_dat or datetime.utcnow()).date()
+
+    @staticmethod
+    def record_order(ngay_dat, status, tong_tien):
+        """Ghi nhận một đơn hàng mới"""
+        _upsert_increment(
+            DoanhThuNgay,
+            {'Ngay': RevenueRollupService._day(ngay_dat), 'Status': status or 'pending'},
+            {'SoDonHang': 1, 'DoanhThu': tong_tien or 0}
+        )
+
+    @staticmethod
+    def record_status_change(ngay_dat, tong_tien, old_status, new_status):
+        """Chuyển một đơn hàng từ trạng thái cũ sang trạng thái mới"""
+        old_status = old_status or 'pending'
+        if old_status == new_status:
+            return
+        day = RevenueRollupService._day(ngay_dat)
+        tong_tien = tong_tien or 0
+        _upsert_increment(DoanhThuNgay, {'Ngay': day, 'Status': old_status},
+                          {'SoDonHang': -1, 'DoanhThu': -tong_tien})
+        _upsert_increment(DoanhThuNgay, {'Ngay': day, 'Status': new_status},
+                          {'SoDonHang': 1, 'DoanhThu': tong_tien})
+
+    @staticmethod
+    def rebuild():
+        """Tính lại toàn bộ DoanhThuNgay từ DonHang (backfill hoặc sửa lệch)"""
+        try:
+            day = func.date(DonHang.NgayDat)
+            db.session.execute(DoanhThuNgay.__table__.delete())
+            db.session.execute(
+                insert(DoanhThuNgay.__table__).from_select(
+                    ['Ngay', 'Status', 'SoDonHang', 'DoanhThu'],
+                    select(
+                        day,
+                        DonHang.Status,
+                        func.count(DonHang.MaDonHang),
+                        func.coalesce(func.sum(DonHang.TongTien), 0)
+                    ).where(
+                        DonHang.NgayDat.isnot(None),
+                        DonHang.Status.isnot(None)
+                    ).group_by(day, DonHang.Status)
+                )
+            )
+            db.session.commit()
+            DashboardService.invalidate()
+            return True, db.session.query(func.count()).select_from(DoanhThuNgay).scalar()
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Lỗi: {str(e)}"
+
+    @staticmethod
+    def ensure_backfilled():
+        """Backfill DoanhThuNgay nếu bảng còn trống mà đã có đơn hàng"""
+        if db.session.query(DoanhThuNgay.Ngay).first() is not None:
+            return False
+        if db.session.query(DonHang.MaDonHang).first() is None:
+            return False
+        success, _ = RevenueRollupService.rebuild()
+        return success
+
+
+class InventoryService:
+    """Giữ và hoàn tồn kho cho đơn hàng bằng UPDATE có điều kiện.
+
+    Mỗi đơn hàng chỉ tốn một câu UPDATE cho mọi sản phẩm: số lượng lấy từ
+    CASE theo MaSanPham và điều kiện SoLuong >= số lượng đặt nằm ngay trong
+    WHERE, nên hai đơn đồng thời không thể cùng lấy phần hàng cuối cùng.
+    Các dòng SanPham bị khóa theo thứ tự khóa chính nên không deadlock giữa
+    các đơn; gọi reserve ngay trước commit để giữ khóa trên sản phẩm bán
+    chạy ngắn nhất có thể.
+    """
+    RESERVED_STATUSES = ('pending', 'shipped', 'delivered')
+
+    @staticmethod
+    def _quantities(items):
+        """Gộp {mã sản phẩm: số lượng}, bỏ số lượng không dương"""
+        return {int(product_id): int(quantity) for product_id, quantity in items.items() if quantity and quantity > 0}
+
+    @staticmethod
+    def reserve(items):
+        """Trừ tồn kho cho {mã sản phẩm: số lượng}, không commit
+
+        Trả về False nếu có sản phẩm không đủ hàng hoặc ngừng bán; khi đó một
+        phần tồn kho có thể đã bị trừ nên caller phải rollback transaction.
+        """
+        quantities = InventoryService._quantities(items)
+        if not quantities:
+            return True
+
+        # Sản phẩm bán chạy giữ kho trên các mảnh TonKhoManh
+        hot = HotStockService.hot_products(quantities)
+        for product_id in sorted(hot):
+            if not hot[product_id] or not HotStockService.reserve(product_id, quantities.pop(product_id)):
+                return False
+        if not quantities:
+            return True
+
+        ordered_quantity = case(quantities, value=SanPham.MaSanPham)
+        result = db.session.execute(
+            update(SanPham).where(
+                SanPham.MaSanPham.in_(sorted(quantities)),
+                SanPham.TrangThai == 1,
+                SanPham.SoLuong >= ordered_quantity,
+                # Sản phẩm vừa chuyển sang chế độ chia mảnh thì không trừ trên SanPham
+                ~HotStockService.is_sharded(SanPham.MaSanPham)
+            ).values(SoLuong=SanPham.SoLuong - ordered_quantity),
+            execution_options={'synchronize_session': False}
+        )
+        return result.rowcount == len(quantities)
+
+    @staticmethod
+    def release(items):
+        """Cộng lại tồn kho cho {mã sản phẩm: số lượng} bằng một câu UPDATE, không commit"""
+        quantities = InventoryService._quantities(items)
+        if not quantities:
+            return
+
+        for product_id in sorted(HotStockService.hot_products(quantities)):
+            if HotStockService.release(product_id, quantities[product_id]):
+                del quantities[product_id]
+        if not quantities:
+            return
+
+        released_quantity = case(quantities, value=SanPham.MaSanPham)
+        db.session.execute(
+            update(SanPham).where(
+                SanPham.MaSanPham.in_(sorted(quantities))
+            ).values(SoLuong=SanPham.SoLuong + released_quantity),
+            execution_options={'synchronize_session': False}
+        )
+
+    @staticmethod
+    def shortages(items):
+        """Các sản phẩm không đủ hàng: [(mã, tên, số lượng còn)], gọi sau khi rollback"""
+        quantities = InventoryService._quantities(items)
+        if not quantities:
+            return []
+
+        rows = db.session.query(
+            SanPham.MaSanPham,
+            SanPham.TenSanPham,
+            SanPham.SoLuong,
+            SanPham.TrangThai
+        ).filter(
+            SanPham.MaSanPham.in_(list(quantities))
+        ).all()
+        found = {row.MaSanPham for row in rows}
+        sharded = HotStockService.shard_totals(list(quantities))
+
+        result = [(product_id, None, 0) for product_id in quantities if product_id not in found]
+        for row in rows:
+            available = sharded.get(row.MaSanPham, row.SoLuong) if row.TrangThai == 1 else 0
+            if available < quantities[row.MaSanPham]:
+                result.append((row.MaSanPham, row.TenSanPham, available))
+        return result
+
+    @staticmethod
+    def shortage_message(items):
+        """Thông báo lỗi tồn kho cho người dùng"""
+        parts = [
+            f"{name or f'Sản phẩm #{product_id}'} (còn {available})"
+            for product_id, name, available in InventoryService.shortages(items)
+        ]
+        if not parts:
+            return "Không đủ hàng trong kho"
+        return "Không đủ hàng trong kho: " + ", ".join(parts)
+
+    @staticmethod
+    def order_quantities(ma_don_hang):
+        """Số lượng từng sản phẩm của một đơn hàng: {mã sản phẩm: số lượng}"""
+        rows = db.session.query(
+            ChiTiet_DonHang.MaSanPham,
+            func.sum(ChiTiet_DonHang.SoLuong)
+        ).filter(
+            ChiTiet_DonHang.MaDonHang == ma_don_hang
+        ).group_by(
+            ChiTiet_DonHang.MaSanPham
+        ).all()
+        return {product_id: int(quantity or 0) for product_id, quantity in rows}
+
+    @staticmethod
+    def apply_status_change(ma_don_hang, old_status, new_status):
+        """Cập nhật tồn kho khi đơn hàng đổi trạng thái, không commit
+
+        Hủy đơn thì hoàn kho; mở lại đơn đã hủy thì giữ kho lại. Trả về
+        (True, None) hoặc (False, thông báo) khi không đủ hàng để mở lại đơn.
+        """
+        was_reserved = (old_status or 'pending') in InventoryService.RESERVED_STATUSES
+        is_reserved = new_status in InventoryService.RESERVED_STATUSES
+        if was_reserved == is_reserved:
+            return True, None
+
+        quantities = InventoryService.order_quantities(ma_don_hang)
+        if not is_reserved:
+            InventoryService.release(quantities)
+            return True, None
+
+        if InventoryService.reserve(quantities):
+            return True, None
+        db.session.rollback()
+        return False, InventoryService.shortage_message(quantities)
+
+
+class HotStockService:
+    """Tồn kho chia mảnh cho sản phẩm bán chạy (flash sale).
+
+    Sản phẩm được bật chế độ này có tồn kho nằm trên SHARDS dòng TonKhoManh
+    thay vì một dòng SanPham, nên các đơn đồng thời trừ kho trên các mảnh
+    khác nhau và không phải xếp hàng chờ một khóa dòng. Mỗi lần giữ kho chọn
+    ngẫu nhiên một mảnh còn đủ hàng; chỉ khi không mảnh nào đủ mới khóa toàn
+    bộ các mảnh để lấy từ nhiều mảnh.
+
+    SanPham.SoLuong của các sản phẩm này là giá trị tổng hợp, được
+    consolidate() cập nhật định kỳ và là giá trị các trang admin đọc.
+    consolidate() chỉ chạy ở một nơi (consolidate_stock.py) để các process
+    của hai app không tranh nhau ghi cùng các dòng SanPham/TonKhoManh.
+    """
+    DEFAULT_SHARDS = 8
+    DEFAULT_INTERVAL = 5
+
+    @staticmethod
+    def is_sharded(product_id_column):
+        """Điều kiện SQL: sản phẩm đang ở chế độ chia mảnh"""
+        return select(TonKhoManh.MaSanPham).where(TonKhoManh.MaSanPham == product_id_column).exists()
+
+    @staticmethod
+    def hot_products(product_ids):
+        """{mã sản phẩm: đang bán} cho các sản phẩm đang chia mảnh trong product_ids (một truy vấn)"""
+        if not product_ids:
+            return {}
+        rows = db.session.query(SanPham.MaSanPham, SanPham.TrangThai).filter(
+            SanPham.MaSanPham.in_(list(product_ids)),
+            HotStockService.is_sharded(SanPham.MaSanPham)
+        ).all()
+        return {row.MaSanPham: row.TrangThai == 1 for row in rows}
+
+    @staticmethod
+    def shard_totals(product_ids):
+        """Tổng tồn kho trên các mảnh: {mã sản phẩm: số lượng}"""
+        if not product_ids:
+            return {}
+        rows = db.session.query(TonKhoManh.MaSanPham, func.sum(TonKhoManh.SoLuong)).filter(
+            TonKhoManh.MaSanPham.in_(list(product_ids))
+        ).group_by(TonKhoManh.MaSanPham).all()
+        return {product_id: int(total or 0) for product_id, total in rows}
+
+    @staticmethod
+    def _locked_shards(product_id):
+        """Khóa mọi mảnh của sản phẩm theo thứ tự MaManh"""
+        return TonKhoManh.query.filter_by(MaSanPham=product_id).order_by(TonKhoManh.MaManh).with_for_update().all()
+
+    @staticmethod
+    def _distribute(shards, total):
+        """Chia đều total cho các mảnh"""
+        base, extra = divmod(max(total, 0), len(shards))
+        for index, shard in enumerate(shards):
+            shard.SoLuong = base + (1 if index < extra else 0)
+
+    @staticmethod
+    def reserve(product_id, quantity):
+        """Trừ quantity trên các mảnh của sản phẩm, không commit. Trả về False nếu không đủ hàng"""
+        candidates = db.session.query(TonKhoManh.MaManh).filter(
+            TonKhoManh.MaSanPham == product_id,
+            TonKhoManh.SoLuong >= quantity
+        ).all()
+        random.shuffle(candidates)
+
+        for (shard_id,) in candidates:
+            result = db.session.execute(
+                update(TonKhoManh).where(
+                    TonKhoManh.MaSanPham == product_id,
+                    TonKhoManh.MaManh == shard_id,
+                    TonKhoManh.SoLuong >= quantity
+                ).values(SoLuong=TonKhoManh.SoLuong - quantity),
+                execution_options={'synchronize_session': False}
+            )
+            if result.rowcount:
+                return True
+
+        # Không mảnh nào đủ một mình: khóa hết các mảnh và lấy dần
+        shards = HotStockService._locked_shards(product_id)
+        if sum(shard.SoLuong for shard in shards) < quantity:
+            return False
+        remaining = quantity
+        for shard in sorted(shards, key=lambda item: -item.SoLuong):
+            taken = min(shard.SoLuong, remaining)
+            if not taken:
+                continue
+            # Vẫn trừ có điều kiện: database không hỗ trợ FOR UPDATE (SQLite) không giữ khóa ở trên
+            result = db.session.execute(
+                update(TonKhoManh).where(
+                    TonKhoManh.MaSanPham == product_id,
+                    TonKhoManh.MaManh == shard.MaManh,
+                    TonKhoManh.SoLuong >= taken
+                ).values(SoLuong=TonKhoManh.SoLuong - taken),
+                execution_options={'synchronize_session': False}
+            )
+            if not result.rowcount:
+                return False
+            remaining -= taken
+            if not remaining:
+                break
+        return True
+
+    @staticmethod
+    def release(product_id, quantity):
+        """Cộng quantity vào một mảnh ngẫu nhiên, không commit. Trả về False nếu sản phẩm không chia mảnh"""
+        shard_ids = db.session.query(TonKhoManh.MaManh).filter_by(MaSanPham=product_id).all()
+        if not shard_ids:
+            return False
+        db.session.execute(
+            update(TonKhoManh).where(
+                TonKhoManh.MaSanPham == product_id,
+                TonKhoManh.MaManh == random.choice(shard_ids)[0]
+            ).values(SoLuong=TonKhoManh.SoLuong + quantity),
+            execution_options={'synchronize_session': False}
+        )
+        return True
+
+    @staticmethod
+    def set_stock(product_id, quantity):
+        """Đặt lại tồn kho của sản phẩm đang chia mảnh (admin sửa số lượng), không commit.
+
+        Trả về False nếu sản phẩm không chia mảnh.
+        """
+        shards = HotStockService._locked_shards(product_id)
+        if not shards:
+            return False
+        HotStockService._distribute(shards, quantity)
+        return True
+
+    @staticmethod
+    def enable(product_id, shard_count=None):
+        """Bật chế độ chia mảnh: chuyển SanPham.SoLuong sang các dòng TonKhoManh"""
+        try:
+            shard_count = max(int(shard_count or HotStockService.DEFAULT_SHARDS), 1)
+            product = SanPham.query.filter_by(MaSanPham=product_id).with_for_update().first()
+            if not product:
+                return False, "Sản phẩm không tồn tại"
+
+            shards = HotStockService._locked_shards(product_id)
+            total = sum(shard.SoLuong for shard in shards) if shards else (product.SoLuong or 0)
+            for shard in shards:
+                db.session.delete(shard)
+            db.session.flush()
+
+            shards = [TonKhoManh(MaSanPham=product_id, MaManh=index) for index in range(shard_count)]
+            HotStockService._distribute(shards, total)
+            db.session.add_all(shards)
+            product.SoLuong = total
+
+            db.session.commit()
+            return True, f"Đã chia tồn kho thành {shard_count} mảnh"
+
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Lỗi: {str(e)}"
+
+    @staticmethod
+    def disable(product_id):
+        """Tắt chế độ chia mảnh: gộp các mảnh về SanPham.SoLuong"""
+        try:
+            product = SanPham.query.filter_by(MaSanPham=product_id).with_for_update().first()
+            if not product:
+                return False, "Sản phẩm không tồn tại"
+
+            shards = HotStockService._locked_shards(product_id)
+            if shards:
+                product.SoLuong = sum(shard.SoLuong for shard in shards)
+                TonKhoManh.query.filter_by(MaSanPham=product_id).delete()
+
+            db.session.commit()
+            return True, "Đã gộp tồn kho về một dòng"
+
+        except Exception as e:
+            db.session.rollback()
+            return False, f"Lỗi: {str(e)}"
+
+    @staticmethod
+    def consolidate():
+        """Ghi tổng các mảnh vào SanPham.SoLuong và chia lại các sản phẩm có mảnh đã cạn
+
+        Chỉ ghi các sản phẩm có tổng mảnh khác SoLuong hiện tại, và không làm
+        gì khi không có sản phẩm nào chia mảnh. Trả về số sản phẩm đã chia lại.
+        """
+        shard_stats = db.session.query(
+            TonKhoManh.MaSanPham,
+            func.sum(TonKhoManh.SoLuong),
+            func.min(TonKhoManh.SoLuong),
+            func.count(TonKhoManh.MaManh)
+        ).group_by(TonKhoManh.MaSanPham).all()
+        if not shard_stats:
+            db.session.rollback()
+            return 0
+
+        stored = dict(db.session.query(SanPham.MaSanPham, SanPham.SoLuong).filter(
+            SanPham.MaSanPham.in_([row[0] for row in shard_stats])
+        ).all())
+        changed = sorted(product_id for product_id, total, _, _ in shard_stats if stored.get(product_id) != total)
+        if changed:
+            total = select(func.coalesce(func.sum(TonKhoManh.SoLuong), 0)).where(
+                TonKhoManh.MaSanPham == SanPham.MaSanPham
+            ).scalar_subquery()
+            db.session.execute(
+                # Gộp tồn kho không phải sửa sản phẩm: giữ nguyên NgayCapNhat
+                update(SanPham).where(SanPham.MaSanPham.in_(changed)).values(
+                    SoLuong=total, NgayCapNhat=SanPham.NgayCapNhat
+                ),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.commit()
+
+        # Mảnh cạn làm đơn phải thử mảnh khác hoặc đi đường chậm: chia đều lại
+        skewed = [
+            product_id for product_id, total, smallest, count in shard_stats
+            if smallest == 0 and total >= count
+        ]
+        for product_id in skewed:
+            shards = HotStockService._locked_shards(product_id)
+            HotStockService._distribute(shards, sum(shard.SoLuong for shard in shards))
+            db.session.commit()
+        return len(skewed)
+
+
+class ImageUploadService:
+    """Upload ảnh sản phẩm chạy nền.
+
+    Ảnh được băm SHA-256 khi nhận: nội dung đã có trong AnhSanPham thì tác
+    vụ xong ngay với URL cũ, không gọi dịch vụ lưu trữ. Ảnh mới thì request
+    chỉ lưu file vào thư mục tạm (IMAGE_STAGING_DIR), ghi một dòng
+    TacVuTaiAnh và trả mã tác vụ ngay; một pool IMAGE_UPLOAD_WORKERS thread
+    upload lên dịch vụ lưu trữ rồi ghi URL vào tác vụ (và HinhAnh/HinhAnhPhu
+    của sản phẩm nếu có). Client hỏi trạng thái qua get_job().
+
+    uploader mặc định là backend lưu ảnh của app (IMAGE_STORAGE); test có
+    thể gán một backend khác, ví dụ services.image_storage.LocalStorage.
+    """
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    DEFAULT_WORKERS = 4
+    # Tác vụ 'processing' lâu hơn mức này coi như process chạy nó đã dừng
+    STALE_AFTER = timedelta(minutes=10)
+
+    uploader = None
+    _pool = None
+    _lock = threading.Lock()
+    _hash_locks = [threading.Lock() for _ in range(64)]
+
+    @staticmethod
+    def allowed_file(filename):
+        return '.' in (filename or '') and filename.rsplit('.', 1)[1].lower() in ImageUploadService.ALLOWED_EXTENSIONS
+
+    @classmethod
+    def get_uploader(cls):
+        return cls.uploader or get_storage()
+
+    @staticmethod
+    def _staging_dir():
+        directory = current_app.config.get('IMAGE_STAGING_DIR') or os.path.join(
+            tempfile.gettempdir(), 'pet_shop_uploads')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    @classmethod
+    def _executor(cls):
+        with cls._lock:
+            if cls._pool is None:
+                workers = current_app.config.get('IMAGE_UPLOAD_WORKERS', cls.DEFAULT_WORKERS)
+                cls._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-upload')
+            return cls._pool
+
+    @classmethod
+    def _enqueue(cls, job_id):
+        cls._executor().submit(cls._run, current_app._get_current_object(), job_id)
+
+    @classmethod
+    def submit(cls, file, product_id=None, kind='main'):
+        """Lưu file upload (werkzeug FileStorage) vào thư mục tạm và xếp hàng upload
+
+        Trả về TacVuTaiAnh vừa tạo (TrangThai 'done' nếu ảnh đã upload trước đây).
+        """
+        if not cls.allowed_file(file.filename):
+            raise ValueError('Invalid file type')
+
+        job_id = uuid.uuid4().hex
+        extension = file.filename.rsplit('.', 1)[1].lower()
+        staged_path = os.path.join(cls._staging_dir(), f"{job_id}.{extension}")
+        file.save(staged_path)
+
+        try:
+            known = AnhSanPham.query.filter_by(MaBam=content_hash(staged_path)).first()
+            job = TacVuTaiAnh(
+                MaTacVu=job_id,
+                MaSanPham=product_id,
+                LoaiAnh=kind,
+                TenFile=file.filename[:255],
+                DuongDanTam=None if known else staged_path,
+                TrangThai='pending'
+            )
+            if known:
+                job.URL = known.URL
+                job.PublicId = known.PublicId
+                job.TrangThai = 'done'
+                cls._attach(job)
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            os.remove(staged_path)
+            raise
+
+        if known:
+            os.remove(staged_path)
+            if product_id:
+                ProductService.invalidate_catalog()
+        else:
+            cls._enqueue(job_id)
+        return job
+
+    @classmethod
+    def _hash_lock(cls, file_hash):
+        """Khóa theo mã băm để các tác vụ cùng nội dung trong process chỉ upload một lần"""
+        return cls._hash_locks[int(file_hash[:8], 16) % len(cls._hash_locks)]
+
+    @staticmethod
+    def _register(result, file_hash):
+        """Ghi ảnh vừa upload vào AnhSanPham, trả về dòng đã đăng ký (không commit)
+
+        Hai tác vụ cùng nội dung chạy song song thì tác vụ ghi sau dùng lại
+        dòng của tác vụ ghi trước.
+        """
+        image = AnhSanPham(
+            URL=result['url'],
+            PublicId=result['public_id'],
+            BienThe=json.dumps(result.get('variants') or {}),
+            MaBam=file_hash
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(image)
+            return image
+        except IntegrityError:
+            return AnhSanPham.query.filter_by(MaBam=file_hash).first()
+
+    @classmethod
+    def _run(cls, app, job_id):
+        """Thực hiện một tác vụ upload trong thread của pool"""
+        with app.app_context():
+            try:
+                # Nhận tác vụ bằng UPDATE có điều kiện để mỗi tác vụ chỉ chạy một lần
+                claimed = db.session.execute(
+                    update(TacVuTaiAnh).where(
+                        TacVuTaiAnh.MaTacVu == job_id,
+                        TacVuTaiAnh.TrangThai == 'pending'
+                    ).values(TrangThai='processing', NgayCapNhat=datetime.utcnow())
+                ).rowcount
+                db.session.commit()
+                if not claimed:
+                    return
+
+                job = db.session.get(TacVuTaiAnh, job_id)
+                staged_path = job.DuongDanTam
+                try:
+                    # Ảnh trùng trong cùng một đợt upload có thể đã được tác vụ trước đăng ký
+                    file_hash = content_hash(staged_path)
+                    with cls._hash_lock(file_hash):
+                        # Bắt đầu transaction mới để thấy dòng tác vụ trước vừa commit
+                        db.session.commit()
+                        image = AnhSanPham.query.filter_by(MaBam=file_hash).first()
+                        if not image:
+                            public_id = f"product_{int(time.time())}_{job_id[:8]}"
+                            image = cls._register(cls.get_uploader().upload(staged_path, public_id), file_hash)
+                            db.session.commit()
+                    job.URL = image.URL
+                    job.PublicId = image.PublicId
+                    cls._attach(job)
+                    job.TrangThai = 'done'
+                    db.session.commit()
+                    if job.MaSanPham:
+                        ProductService.invalidate_catalog()
+                except Exception as e:
+                    db.session.rollback()
+                    job = db.session.get(TacVuTaiAnh, job_id)
+                    job.TrangThai = 'failed'
+                    job.LoiNhan = str(e)[:500]
+                    db.session.commit()
+                    print(f"Upload error: {str(e)}")
+
+                if os.path.exists(staged_path):
+                    os.remove(staged_path)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error running upload job {job_id}: {e}")
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _attach(job):
+        """Ghi URL ảnh vừa upload vào sản phẩm của tác vụ (không commit)"""
+        if not job.MaSanPham:
+            return
+        product = SanPham.query.filter_by(MaSanPham=job.MaSanPham).with_for_update().first()
+        if not product:
+            return
+
+        if job.LoaiAnh == 'main':
+            product.HinhAnh = job.URL
+            return
+
+        try:
+            images = json.loads(product.HinhAnhPhu) if product.HinhAnhPhu else []
+        except ValueError:
+            images = []
+        images.append(job.URL)
+        product.HinhAnhPhu = json.dumps(images)
+
+    @staticmethod
+    def get_job(job_id):
+        """Trạng thái tác vụ upload dạng dict, None nếu không có"""
+        job = db.session.get(TacVuTaiAnh, job_id)
+        if not job:
+            return None
+        return {
+            'job_id': job.MaTacVu,
+            'status': job.TrangThai,
+            'product_id': job.MaSanPham,
+            'kind': job.LoaiAnh,
+            'url': job.URL,
+            'public_id': job.PublicId,
+            'error': job.LoiNhan,
+            'created_at': job.NgayTao.isoformat() if job.NgayTao else None
+        }
+
+    @classmethod
+    def resume_pending(cls):
+        """Xếp hàng lại các tác vụ còn dở khi process trước dừng, trả về số tác vụ"""
+        db.session.execute(
+            update(TacVuTaiAnh).where(
+                TacVuTaiAnh.TrangThai == 'processing',
+                TacVuTaiAnh.NgayCapNhat < datetime.utcnow() - cls.STALE_AFTER
+            ).values(TrangThai='pending')
+        )
+        db.session.commit()
+
+        job_ids = db.session.execute(
+            select(TacVuTaiAnh.MaTacVu).where(TacVuTaiAnh.TrangThai == 'pending')
+        ).scalars().all()
+        for job_id in job_ids:
+            cls._enqueue(job_id)
+        return len(job_ids)
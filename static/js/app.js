@@ -673,7 +673,18 @@ document.addEventListener('DOMContentLoaded', function () {
         thumb.addEventListener('click', function () {
             const mainImg = document.getElementById('main-product-image');
             if (mainImg) {
-                mainImg.src = this.src;
+                // Ảnh nhỏ dùng biến thể thumb, ảnh chính dùng biến thể detail
+                mainImg.src = this.dataset.full || this.src;
+                mainImg.srcset = this.dataset.srcset || '';
+                const webpSource = document.getElementById('main-product-image-webp');
+                if (webpSource) {
+                    // Ảnh không có bản webp thì bỏ srcset để trình duyệt dùng <img> thay vì ảnh cũ
+                    if (this.dataset.webpSrcset) {
+                        webpSource.srcset = this.dataset.webpSrcset;
+                    } else {
+                        webpSource.removeAttribute('srcset');
+                    }
+                }
                 // Remove active class from all thumbs
                 document.querySelectorAll('.product-thumb').forEach(t => t.classList.remove('border-primary'));
                 // Add active class to clicked thumb
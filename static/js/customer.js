@@ -3,6 +3,11 @@ class CustomerManager {
     constructor() {
         this.customers = [];
         this.filteredCustomers = [];
+        this.nextCursor = null;
+        this.requestSeq = 0;
+        this.sort = 'id';
+        this.sortDir = 'desc';
+        this.searchTimer = null;
         this.currentCustomerId = null;
         this.confirmationCallback = null;
         this.init();
@@ -18,9 +23,24 @@ class CustomerManager {
         // Filter events
         document.getElementById('status-filter').addEventListener('change', () => this.applyFilters());
         document.getElementById('order-filter').addEventListener('change', () => this.applyFilters());
-        document.getElementById('search-filter').addEventListener('input', () => this.applyFilters());
+        document.getElementById('search-filter').addEventListener('input', () => {
+            // Chờ người dùng gõ xong rồi mới gọi server
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.applyFilters(), 300);
+        });
         document.getElementById('clear-filters').addEventListener('click', () => this.clearFilters());
 
+        // Sắp xếp theo cột
+        document.querySelectorAll('th[data-sort]').forEach(th => {
+            th.style.cursor = 'pointer';
+            th.addEventListener('click', () => this.changeSort(th.dataset.sort));
+        });
+
+        const loadMoreBtn = document.getElementById('load-more-customers');
+        if (loadMoreBtn) {
+            loadMoreBtn.addEventListener('click', () => this.loadCustomers(true));
+        }
+
         // Action events
         document.getElementById('refresh-customers').addEventListener('click', () => this.refreshCustomers());
 
@@ -87,25 +107,50 @@ class CustomerManager {
         if (vipCustomersEl) vipCustomersEl.textContent = stats.vip || 0;
     }
 
-    async loadCustomers() {
+    buildCustomersQuery(cursor) {
+        const params = new URLSearchParams();
+        const statusFilter = document.getElementById('status-filter').value;
+        const orderFilter = document.getElementById('order-filter').value;
+        const searchFilter = document.getElementById('search-filter').value.trim();
+
+        if (statusFilter) params.set('status', statusFilter);
+        if (orderFilter) params.set('order', orderFilter);
+        if (searchFilter) params.set('search', searchFilter);
+        params.set('sort', this.sort);
+        params.set('dir', this.sortDir);
+        if (cursor) params.set('cursor', cursor);
+
+        return params.toString();
+    }
+
+    async loadCustomers(append = false) {
+        if (append && !this.nextCursor) return;
+        // Chỉ nhận kết quả của lần gọi mới nhất: response cũ về sau bị bỏ qua
+        const requestId = ++this.requestSeq;
         this.showLoading(true);
 
         try {
-            const response = await fetch('/api/admin/customers');
+            const query = this.buildCustomersQuery(append ? this.nextCursor : null);
+            const response = await fetch('/api/admin/customers?' + query);
             const data = await response.json();
+            if (requestId !== this.requestSeq) return;
 
             if (data.success) {
-                this.customers = data.customers;
-                this.filteredCustomers = [...this.customers];
+                this.customers = append ? this.customers.concat(data.customers) : data.customers;
+                this.filteredCustomers = this.customers;
+                this.nextCursor = data.next_cursor;
                 this.renderCustomers();
             } else {
                 this.showToast('Lỗi khi tải khách hàng: ' + data.message, 'error');
             }
         } catch (error) {
+            if (requestId !== this.requestSeq) return;
             console.error('Error loading customers:', error);
             this.showToast('Lỗi khi tải khách hàng', 'error');
         } finally {
-            this.showLoading(false);
+            if (requestId === this.requestSeq) {
+                this.showLoading(false);
+            }
         }
     }
 
@@ -113,6 +158,17 @@ class CustomerManager {
         const tableBody = document.getElementById('customers-table-body');
         const noDataMessage = document.getElementById('no-data-message');
         const tableResponsive = document.querySelector('.table-responsive');
+        const loadMoreBtn = document.getElementById('load-more-customers');
+
+        if (loadMoreBtn) loadMoreBtn.style.display = this.nextCursor ? 'inline-block' : 'none';
+
+        document.querySelectorAll('th[data-sort]').forEach(th => {
+            const icon = th.querySelector('i');
+            if (icon) {
+                icon.className = th.dataset.sort !== this.sort ? 'fas fa-sort text-muted'
+                    : (this.sortDir === 'asc' ? 'fas fa-sort-up' : 'fas fa-sort-down');
+            }
+        });
 
         if (this.filteredCustomers.length === 0) {
             if (tableBody) tableBody.innerHTML = '';
@@ -150,37 +206,26 @@ class CustomerManager {
     }
 
     applyFilters() {
-        const statusFilter = document.getElementById('status-filter').value;
-        const orderFilter = document.getElementById('order-filter').value;
-        const searchFilter = document.getElementById('search-filter').value.toLowerCase();
-
-        this.filteredCustomers = this.customers.filter(customer => {
-            const matchStatus = !statusFilter || customer.status === statusFilter;
-
-            let matchOrder = true;
-            if (orderFilter === 'has_orders') {
-                matchOrder = customer.total_orders > 0;
-            } else if (orderFilter === 'no_orders') {
-                matchOrder = customer.total_orders === 0;
-            }
-
-            const matchSearch = !searchFilter ||
-                customer.id.toString().includes(searchFilter) ||
-                customer.full_name.toLowerCase().includes(searchFilter) ||
-                (customer.email && customer.email.toLowerCase().includes(searchFilter));
-
-            return matchStatus && matchOrder && matchSearch;
-        });
+        // Bộ lọc được áp dụng phía server, tải lại từ trang đầu
+        this.nextCursor = null;
+        this.loadCustomers();
+    }
 
-        this.renderCustomers();
+    changeSort(column) {
+        if (this.sort === column) {
+            this.sortDir = this.sortDir === 'desc' ? 'asc' : 'desc';
+        } else {
+            this.sort = column;
+            this.sortDir = 'desc';
+        }
+        this.applyFilters();
     }
 
     clearFilters() {
         document.getElementById('status-filter').value = '';
         document.getElementById('order-filter').value = '';
         document.getElementById('search-filter').value = '';
-        this.filteredCustomers = [...this.customers];
-        this.renderCustomers();
+        this.applyFilters();
     }
 
     async refreshCustomers() {
@@ -3,6 +3,9 @@ class OrderManager {
     constructor() {
         this.orders = [];
         this.filteredOrders = [];
+        this.nextCursor = null;
+        this.requestSeq = 0;
+        this.searchTimer = null;
         this.currentOrderId = null;
         this.init();
     }
@@ -17,9 +20,18 @@ class OrderManager {
         // Filter events
         document.getElementById('status-filter').addEventListener('change', () => this.applyFilters());
         document.getElementById('date-filter').addEventListener('change', () => this.applyFilters());
-        document.getElementById('search-filter').addEventListener('input', () => this.applyFilters());
+        document.getElementById('search-filter').addEventListener('input', () => {
+            // Chờ người dùng gõ xong rồi mới gọi server
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.applyFilters(), 300);
+        });
         document.getElementById('clear-filters').addEventListener('click', () => this.clearFilters());
 
+        const loadMoreBtn = document.getElementById('load-more-orders');
+        if (loadMoreBtn) {
+            loadMoreBtn.addEventListener('click', () => this.loadOrders(true));
+        }
+
         // Action events
         document.getElementById('refresh-orders').addEventListener('click', () => this.refreshOrders());
 
@@ -71,25 +83,48 @@ class OrderManager {
         if (deliveredOrdersEl) deliveredOrdersEl.textContent = stats.delivered || 0;
     }
 
-    async loadOrders() {
+    buildOrdersQuery(cursor) {
+        const params = new URLSearchParams();
+        const statusFilter = document.getElementById('status-filter').value;
+        const dateFilter = document.getElementById('date-filter').value;
+        const searchFilter = document.getElementById('search-filter').value.trim();
+
+        if (statusFilter) params.set('status', statusFilter);
+        if (dateFilter) params.set('date', dateFilter);
+        if (searchFilter) params.set('search', searchFilter);
+        if (cursor) params.set('cursor', cursor);
+
+        return params.toString();
+    }
+
+    async loadOrders(append = false) {
+        if (append && !this.nextCursor) return;
+        // Chỉ nhận kết quả của lần gọi mới nhất: response cũ về sau bị bỏ qua
+        const requestId = ++this.requestSeq;
         this.showLoading(true);
 
         try {
-            const response = await fetch('/api/admin/orders');
+            const query = this.buildOrdersQuery(append ? this.nextCursor : null);
+            const response = await fetch('/api/admin/orders' + (query ? '?' + query : ''));
             const data = await response.json();
+            if (requestId !== this.requestSeq) return;
 
             if (data.success) {
-                this.orders = data.orders;
-                this.filteredOrders = [...this.orders];
+                this.orders = append ? this.orders.concat(data.orders) : data.orders;
+                this.filteredOrders = this.orders;
+                this.nextCursor = data.next_cursor;
                 this.renderOrders();
             } else {
                 this.showToast('Lỗi khi tải đơn hàng: ' + data.message, 'error');
             }
         } catch (error) {
+            if (requestId !== this.requestSeq) return;
             console.error('Error loading orders:', error);
             this.showToast('Lỗi khi tải đơn hàng', 'error');
         } finally {
-            this.showLoading(false);
+            if (requestId === this.requestSeq) {
+                this.showLoading(false);
+            }
         }
     }
 
@@ -97,6 +132,9 @@ class OrderManager {
         const tableBody = document.getElementById('orders-table-body');
         const noDataMessage = document.getElementById('no-data-message');
         const tableResponsive = document.querySelector('.table-responsive');
+        const loadMoreBtn = document.getElementById('load-more-orders');
+
+        if (loadMoreBtn) loadMoreBtn.style.display = this.nextCursor ? 'inline-block' : 'none';
 
         if (this.filteredOrders.length === 0) {
             if (tableBody) tableBody.innerHTML = '';
@@ -127,29 +165,16 @@ class OrderManager {
     }
 
     applyFilters() {
-        const statusFilter = document.getElementById('status-filter').value;
-        const dateFilter = document.getElementById('date-filter').value;
-        const searchFilter = document.getElementById('search-filter').value.toLowerCase();
-
-        this.filteredOrders = this.orders.filter(order => {
-            const matchStatus = !statusFilter || order.status === statusFilter;
-            const matchDate = !dateFilter || order.date.startsWith(dateFilter);
-            const matchSearch = !searchFilter ||
-                order.id.toString().includes(searchFilter) ||
-                order.customer_name.toLowerCase().includes(searchFilter);
-
-            return matchStatus && matchDate && matchSearch;
-        });
-
-        this.renderOrders();
+        // Bộ lọc được áp dụng phía server, tải lại từ trang đầu
+        this.nextCursor = null;
+        this.loadOrders();
     }
 
     clearFilters() {
         document.getElementById('status-filter').value = '';
         document.getElementById('date-filter').value = '';
         document.getElementById('search-filter').value = '';
-        this.filteredOrders = [...this.orders];
-        this.renderOrders();
+        this.applyFilters();
     }
 
     async refreshOrders() {
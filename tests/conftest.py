@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, Loai, SanPham, TaiKhoan  # noqa: E402
+from services import image_storage  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App tối thiểu trên SQLite (file, để nhiều thread dùng chung được)"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'shop.db'}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    app.config['SECRET_KEY'] = 'test'
+    app.config['IMAGE_STORAGE'] = 'local'
+    app.config['IMAGE_LOCAL_DIR'] = str(tmp_path / 'uploads')
+    db.init_app(app)
+    image_storage.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def make_products(app):
+    """Tạo count sản phẩm đang bán, trả về danh sách mã sản phẩm"""
+    def make(count, stock=100):
+        loai = Loai.query.first()
+        if not loai:
+            loai = Loai(TenLoai='Chó')
+            db.session.add(loai)
+            db.session.flush()
+        products = [
+            SanPham(TenSanPham=f'Sản phẩm {i}', GiaBan=1000 + i, SoLuong=stock, MaLoai=loai.MaLoai)
+            for i in range(count)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.MaSanPham for product in products]
+    return make
+
+
+@pytest.fixture
+def customer(app):
+    """Mã tài khoản của một khách hàng"""
+    account = TaiKhoan(Ho='Nguyen', Ten='An')
+    db.session.add(account)
+    db.session.commit()
+    return account.MaTaiKhoan
@@ -0,0 +1,34 @@
+from sqlalchemy.dialects import mysql
+
+from services.services import AdminSearch
+
+
+def compile_mysql(condition):
+    return str(condition.compile(dialect=mysql.dialect()))
+
+
+def test_has_fulltext_index_reads_mysql_reflection():
+    assert AdminSearch.has_fulltext_index([
+        {'name': 'ft_TaiKhoan_Ho_Ten', 'column_names': ['Ho', 'Ten'], 'dialect_options': {'mysql_prefix': 'FULLTEXT'}}
+    ])
+    # Index FULLTEXT đặt tên khác nhưng đúng cột vẫn dùng được
+    assert AdminSearch.has_fulltext_index([
+        {'name': 'Ho', 'column_names': ['Ho', 'Ten'], 'dialect_options': {'mysql_prefix': 'FULLTEXT'}}
+    ])
+    assert not AdminSearch.has_fulltext_index([
+        {'name': 'ix_TaiKhoan_Ten', 'column_names': ['Ten'], 'dialect_options': {}}
+    ])
+
+
+def test_name_search_falls_back_to_prefix_like_without_fulltext_index(app, monkeypatch):
+    monkeypatch.setattr(AdminSearch, 'fulltext_available', classmethod(lambda cls: False))
+    sql = compile_mysql(AdminSearch.name_condition(['Nguyen', 'An']))
+    assert 'MATCH' not in sql and 'LIKE' in sql
+
+    monkeypatch.setattr(AdminSearch, 'fulltext_available', classmethod(lambda cls: True))
+    sql = compile_mysql(AdminSearch.name_condition(['Nguyen', 'An']))
+    assert 'MATCH' in sql
+
+
+def test_fulltext_is_never_used_outside_mysql(app):
+    assert not AdminSearch.fulltext_available()
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import event
+
+from models import db
+from services import CartService
+
+
+@pytest.fixture
+def count_statements(app):
+    """Đếm số câu SQL chạy trong khối with"""
+    class Counter:
+        def __init__(self):
+            self.count = 0
+
+        def __enter__(self):
+            self.count = 0
+            event.listen(db.engine, 'before_cursor_execute', self._on_execute)
+            return self
+
+        def __exit__(self, *exc):
+            event.remove(db.engine, 'before_cursor_execute', self._on_execute)
+
+        def _on_execute(self, *args):
+            self.count += 1
+
+    return Counter()
+
+
+def _statements_for_cart(customer, product_ids, count_statements):
+    CartService.clear_cart(customer)
+    for product_id in product_ids:
+        assert CartService.add_to_cart(customer, product_id, 1)[0]
+    db.session.expire_all()
+
+    with count_statements as counter:
+        items = CartService.get_cart_items(customer)
+    assert len(items) == len(product_ids)
+    return counter.count
+
+
+def test_get_cart_items_query_count_does_not_grow_with_cart(customer, make_products, count_statements):
+    product_ids = make_products(25)
+
+    counts = [
+        _statements_for_cart(customer, product_ids[:size], count_statements)
+        for size in (1, 10, 25)
+    ]
+
+    assert counts[0] == counts[1] == counts[2]
+    assert counts[0] == 1
@@ -0,0 +1,38 @@
+import re
+
+from sqlalchemy.dialects import mysql
+
+import services.services as services_module
+from models import db
+from services import CartService
+
+
+class _Result:
+    rowcount = 1
+
+
+def test_mysql_cart_upsert_has_no_ambiguous_columns(app, monkeypatch):
+    captured = []
+    monkeypatch.setattr(services_module, '_dialect_insert', lambda table: mysql.insert(table))
+    monkeypatch.setattr(db.session, 'execute', lambda stmt, *args, **kwargs: captured.append(stmt) or _Result())
+
+    assert CartService._upsert_cart_line(1, 2, 3)
+    sql = str(captured[0].compile(dialect=mysql.dialect()))
+
+    update_clause = sql.split('ON DUPLICATE KEY UPDATE', 1)[1]
+    # Vế phải chỉ tham chiếu GioHang_SanPham (bảng đích) hoặc bảng dẫn xuất dt
+    assert 'VALUES(' not in update_clause.upper()
+    assert '`GioHang_SanPham`.`SoLuong` + dt.`SoLuongThem`' in update_clause
+    assert not re.search(r'`SanPham`|GioHang_SanPham_1', update_clause)
+    assert ') AS dt ON DUPLICATE KEY UPDATE' in sql
+
+
+def test_add_to_cart_accumulates_and_respects_stock(app, customer, make_products):
+    product_id = make_products(1, stock=5)[0]
+
+    assert CartService.add_to_cart(customer, product_id, 2)[0]
+    assert CartService.add_to_cart(customer, product_id, 3)[0]
+    assert not CartService.add_to_cart(customer, product_id, 1)[0]
+
+    items = CartService.get_cart_items(customer)
+    assert [(item['id'], item['quantity']) for item in items] == [(product_id, 5)]
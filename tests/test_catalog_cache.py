@@ -0,0 +1,43 @@
+from sqlalchemy import update
+
+from models import db, SanPham, PhienBanCache
+from services import ProductService
+from services.services import CatalogCache, _upsert_increment
+
+
+def test_catalog_reloads_when_another_process_bumps_version(app, make_products):
+    app.config['CATALOG_VERSION_CHECK'] = 0
+    product_id = make_products(1)[0]
+    ProductService.invalidate_catalog()
+    assert ProductService.get_product_by_id(product_id)['price'] == 1000
+
+    # Process khác (admin) đổi giá rồi tăng version dùng chung, không đụng tới version trong bộ nhớ
+    db.session.execute(update(SanPham).where(SanPham.MaSanPham == product_id).values(GiaBan=2000))
+    _upsert_increment(PhienBanCache, {'Ten': CatalogCache.SHARED_KEY}, {'PhienBan': 1})
+    db.session.commit()
+
+    assert ProductService.get_product_by_id(product_id)['price'] == 2000
+
+
+def test_invalidate_in_same_process_bumps_shared_version(app, make_products):
+    make_products(1)
+    ProductService.invalidate_catalog()
+    ProductService.invalidate_catalog()
+    assert db.session.get(PhienBanCache, CatalogCache.SHARED_KEY).PhienBan >= 2
+
+
+def test_returned_products_do_not_share_nested_data_with_cache(app, make_products):
+    product_id = make_products(1)[0]
+    db.session.execute(update(SanPham).where(SanPham.MaSanPham == product_id).values(HinhAnh='a.jpg'))
+    db.session.commit()
+    ProductService.invalidate_catalog()
+
+    product = ProductService.get_all_products()[0]
+    product['images'].append('/uploads/x.jpg')
+    product['image_sets'].append(None)
+    product['image_set']['src'] = '/uploads/x.jpg'
+
+    cached = ProductService.get_product_by_id(product_id)
+    assert '/uploads/x.jpg' not in cached['images']
+    assert None not in cached['image_sets']
+    assert cached['image_set']['src'] == '/uploads/a.jpg'
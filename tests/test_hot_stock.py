@@ -0,0 +1,103 @@
+import threading
+
+from sqlalchemy import event
+
+from models import db, SanPham, TonKhoManh
+from services import InventoryService, HotStockService
+
+THREADS = 8
+RESERVATIONS_PER_THREAD = 20
+STOCK = 100
+
+
+def test_concurrent_reservations_never_oversell(app, make_products):
+    product_id = make_products(1, stock=STOCK)[0]
+    assert HotStockService.enable(product_id, 4)[0]
+
+    sold = []
+    errors = []
+    sold_lock = threading.Lock()
+
+    def buyer():
+        with app.app_context():
+            try:
+                for _ in range(RESERVATIONS_PER_THREAD):
+                    if InventoryService.reserve({product_id: 1}):
+                        db.session.commit()
+                        with sold_lock:
+                            sold.append(1)
+                    else:
+                        db.session.rollback()
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=buyer) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    # Nhu cầu (8 x 20) lớn hơn tồn kho nên phải bán hết, không hơn
+    assert sum(sold) == STOCK
+
+    db.session.expire_all()
+    shards = TonKhoManh.query.filter_by(MaSanPham=product_id).all()
+    assert all(shard.SoLuong >= 0 for shard in shards)
+    assert sum(shard.SoLuong for shard in shards) == 0
+
+    HotStockService.consolidate()
+    db.session.expire_all()
+    assert db.session.get(SanPham, product_id).SoLuong == 0
+
+
+def test_release_and_consolidate_restore_stock(app, make_products):
+    product_id = make_products(1, stock=10)[0]
+    HotStockService.enable(product_id, 4)
+
+    assert InventoryService.reserve({product_id: 7})
+    db.session.commit()
+    assert not InventoryService.reserve({product_id: 4})
+    db.session.rollback()
+
+    InventoryService.release({product_id: 7})
+    db.session.commit()
+    HotStockService.consolidate()
+    db.session.expire_all()
+    assert db.session.get(SanPham, product_id).SoLuong == 10
+
+
+def test_consolidate_only_writes_changed_products(app, make_products):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        # Không có sản phẩm chia mảnh: chỉ một câu SELECT, không UPDATE
+        make_products(1)
+        statements.clear()
+        assert HotStockService.consolidate() == 0
+        assert not [s for s in statements if s.lstrip().upper().startswith('UPDATE')]
+
+        product_id = make_products(1, stock=12)[0]
+        HotStockService.enable(product_id, 4)
+        updated_at = db.session.get(SanPham, product_id).NgayCapNhat
+
+        statements.clear()
+        HotStockService.consolidate()
+        assert not [s for s in statements if s.lstrip().upper().startswith('UPDATE')]
+
+        assert InventoryService.reserve({product_id: 2})
+        db.session.commit()
+        HotStockService.consolidate()
+        db.session.expire_all()
+        product = db.session.get(SanPham, product_id)
+        assert product.SoLuong == 10
+        assert product.NgayCapNhat == updated_at
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,85 @@
+import io
+import time
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from models import db, SanPham, TacVuTaiAnh
+from services import ImageUploadService
+from services.image_storage import LocalStorage
+
+POLL_TIMEOUT = 10
+
+
+@pytest.fixture
+def uploader(app, tmp_path, monkeypatch):
+    """Thay dịch vụ lưu ảnh thật bằng LocalStorage trong tmp_path"""
+    app.config['IMAGE_STAGING_DIR'] = str(tmp_path / 'staging')
+    storage = LocalStorage(tmp_path / 'store', base_url='/uploads')
+    monkeypatch.setattr(ImageUploadService, 'uploader', storage)
+    return storage
+
+
+def image_file(color, filename='cho.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (1000, 700), color).save(buffer, 'PNG')
+    buffer.seek(0)
+    return FileStorage(stream=buffer, filename=filename)
+
+
+def wait_for(job_id):
+    """Hỏi trạng thái như client cho tới khi tác vụ xong hoặc lỗi"""
+    deadline = time.monotonic() + POLL_TIMEOUT
+    while time.monotonic() < deadline:
+        # Mỗi lần hỏi là một request mới: bỏ dữ liệu cũ trong session
+        db.session.rollback()
+        job = ImageUploadService.get_job(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"upload job {job_id} did not finish")
+
+
+def test_upload_job_completes_and_attaches_image(app, uploader, make_products):
+    product_id = make_products(1)[0]
+
+    job_id = ImageUploadService.submit(image_file('red'), product_id=product_id, kind='main').MaTacVu
+
+    result = wait_for(job_id)
+    assert result['status'] == 'done'
+    assert result['url'].startswith('/uploads/product_')
+    assert db.session.get(SanPham, product_id).HinhAnh == result['url']
+
+    # Cùng nội dung upload lại thì xong ngay với URL cũ, không xếp hàng
+    again = ImageUploadService.submit(image_file('red', 'cho-2.png'))
+    assert again.TrangThai == 'done'
+    assert again.URL == result['url']
+
+
+def test_upload_job_failure_is_reported(app, uploader, tmp_path, monkeypatch):
+    # Thư mục lưu ảnh nằm dưới một file thường nên backend không ghi được
+    (tmp_path / 'blocked').write_text('')
+    monkeypatch.setattr(ImageUploadService, 'uploader', LocalStorage(tmp_path / 'blocked' / 'store'))
+
+    job = ImageUploadService.submit(image_file('blue'))
+    result = wait_for(job.MaTacVu)
+    assert result['status'] == 'failed'
+    assert result['error']
+    assert not list((tmp_path / 'staging').iterdir())
+
+
+def test_resume_pending_requeues_unfinished_jobs(app, uploader, tmp_path):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    staged_path = staging / 'left-over.png'
+    Image.new('RGB', (200, 200), 'green').save(staged_path)
+    db.session.add(TacVuTaiAnh(
+        MaTacVu='left-over', LoaiAnh='main', TenFile='left-over.png',
+        DuongDanTam=str(staged_path), TrangThai='pending'
+    ))
+    db.session.commit()
+
+    assert ImageUploadService.resume_pending() == 1
+    assert wait_for('left-over')['status'] == 'done'
+    assert not staged_path.exists()
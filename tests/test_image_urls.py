@@ -0,0 +1,11 @@
+from services.image_storage import CloudinaryStorage
+
+
+def test_cloudinary_url_keeps_storefront_mapping():
+    storage = CloudinaryStorage(None)
+    storage.cloud_name = 'demo'
+
+    assert storage.url('bare.jpg') == 'https://res.cloudinary.com/demo/image/upload/v1/bare.jpg'
+    assert storage.url('pet_shop/products/x.jpg') == \
+        'https://res.cloudinary.com/demo/image/upload/v1/pet_shop/products/x.jpg'
+    assert storage.url('https://cdn.example.com/y.png') == 'https://cdn.example.com/y.png'
@@ -0,0 +1,28 @@
+from PIL import Image
+
+from services import image_storage
+from services.image_storage import LocalStorage, VARIANTS
+
+
+def make_image(path):
+    Image.new('RGB', (1200, 900), 'white').save(path)
+    return str(path)
+
+
+def test_local_upload_writes_every_variant(tmp_path):
+    storage = LocalStorage(tmp_path / 'store')
+    result = storage.upload(make_image(tmp_path / 'cho.jpg'), 'cho')
+
+    assert sorted(result['variants']) == sorted(name for name, _, _, _, _ in VARIANTS)
+    assert result['variants']['webp'].endswith('.webp')
+    with Image.open(tmp_path / 'store' / 'cho_thumb.jpg') as thumb:
+        assert thumb.size == (150, 150)
+
+
+def test_missing_pillow_is_reported(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(image_storage, 'Image', None)
+    storage = LocalStorage(tmp_path / 'store')
+    result = storage.upload(make_image(tmp_path / 'meo.png'), 'meo')
+
+    assert result['variants'] == {}
+    assert 'Pillow' in capsys.readouterr().out
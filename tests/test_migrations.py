@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import text
+
+from models import db, AnhSanPham, DonHang
+from models.migrations import missing_columns, missing_indexes, upgrade_schema
+
+
+def drop_column(table_name, column_name, index_name):
+    """Đưa bảng về schema cũ (trước migration thêm cột)"""
+    with db.engine.begin() as connection:
+        connection.execute(text(f'DROP INDEX "{index_name}"'))
+        connection.execute(text(f'ALTER TABLE "{table_name}" DROP COLUMN "{column_name}"'))
+
+
+def test_startup_refuses_an_old_schema_without_auto_migrate(app):
+    drop_column('DonHang', 'MaYeuCau', 'uq_DonHang_MaYeuCau')
+
+    with pytest.raises(RuntimeError, match='DonHang.MaYeuCau'):
+        upgrade_schema(auto_migrate=False)
+
+
+def test_startup_applies_pending_migrations(app):
+    drop_column('DonHang', 'MaYeuCau', 'uq_DonHang_MaYeuCau')
+
+    assert upgrade_schema()
+    assert not missing_columns()
+    assert DonHang.query.count() == 0
+    # Chạy lại không còn gì để áp dụng
+    assert upgrade_schema() == []
+
+
+def test_startup_adds_image_content_hash_column(app):
+    drop_column('AnhSanPham', 'MaBam', 'uq_AnhSanPham_MaBam')
+
+    with pytest.raises(RuntimeError, match='AnhSanPham.MaBam'):
+        upgrade_schema(auto_migrate=False)
+
+    upgrade_schema()
+    assert 'uq_AnhSanPham_MaBam' not in [name for _, name, _ in missing_indexes()]
+    # Tra ảnh trùng theo mã băm chạy được ngay sau khi khởi động
+    assert AnhSanPham.query.filter_by(MaBam='0' * 64).first() is None
@@ -0,0 +1,86 @@
+from sqlalchemy import event, update
+
+from models import db, Loai, SanPham
+from services import ProductService
+
+
+def page_ids(products):
+    return [product['id'] for product in products]
+
+
+def test_cursor_pages_continue_offset_pages(app, make_products):
+    make_products(7)
+    # Trùng giá để keyset phải xét tới MaSanPham
+    db.session.execute(update(SanPham).values(GiaBan=5000))
+    db.session.commit()
+
+    for sort in ('name', 'price_low', 'price_high'):
+        everything, _, total = ProductService.query_products(sort=sort, per_page=100)
+        assert total == 7
+
+        walked = []
+        products, cursor, _ = ProductService.query_products(sort=sort, per_page=3)
+        walked += page_ids(products)
+        while cursor:
+            products, cursor, total = ProductService.query_products(sort=sort, per_page=3, cursor=cursor)
+            assert total is None
+            walked += page_ids(products)
+        assert walked == page_ids(everything)
+
+
+def test_count_is_bounded_and_deep_pages_need_a_cursor(app, make_products, monkeypatch):
+    monkeypatch.setattr(ProductService, 'COUNT_LIMIT', 4)
+    make_products(10)
+
+    products, next_cursor, total = ProductService.query_products(page=99, per_page=2)
+    assert total == 5
+    # Chỉ nhảy trang bằng OFFSET trong phạm vi đã đếm: page 99 thành trang cuối (2 x 2 sản phẩm)
+    assert page_ids(products) == page_ids(ProductService.query_products(page=2, per_page=2)[0])
+    assert next_cursor
+
+    pagination = ProductService.pagination(99, 2, total, None, next_cursor)
+    assert pagination['total'] == 4 and pagination['total_capped'] and pagination['pages'] == 2
+
+
+def test_category_filters_by_id_without_lower_on_product_rows(app, make_products):
+    make_products(3)
+    cat = Loai(TenLoai='Mèo')
+    db.session.add(cat)
+    db.session.commit()
+    db.session.add(SanPham(TenSanPham='Cát vệ sinh', GiaBan=10, SoLuong=1, MaLoai=cat.MaLoai))
+    db.session.commit()
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        products, _, total = ProductService.query_products(category='mèo')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert total == 1 and products[0]['name'] == 'Cát vệ sinh'
+    product_statements = [s for s in statements if '"SanPham"' in s or 'SanPham.' in s]
+    assert product_statements and not [s for s in product_statements if 'lower(' in s.lower()]
+    assert ProductService.query_products(category='không có') == ([], None, 0)
+
+
+def test_search_uses_the_index_not_like(app, make_products):
+    make_products(5)
+    ProductService.invalidate_catalog()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        products, next_cursor, total = ProductService.query_products(search='san pham 3')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert products and products[0]['name'] == 'Sản phẩm 3'
+    assert next_cursor is None and total == len(products)
+    assert not [s for s in statements if ' LIKE ' in s.upper()]
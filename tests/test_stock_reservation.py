@@ -0,0 +1,72 @@
+import threading
+
+from sqlalchemy import event
+
+from models import db, SanPham
+from services import InventoryService
+
+THREADS = 8
+RESERVATIONS_PER_THREAD = 20
+SCARCE_STOCK = 60
+PLENTIFUL_STOCK = 100
+
+
+def test_concurrent_batched_reservations_never_oversell(app, make_products):
+    # Sản phẩm thường (không chia mảnh): mọi đơn trừ cả hai sản phẩm trong một câu UPDATE
+    scarce_id, plentiful_id = make_products(2)
+    db.session.execute(db.update(SanPham).where(SanPham.MaSanPham == scarce_id).values(SoLuong=SCARCE_STOCK))
+    db.session.commit()
+
+    sold = []
+    errors = []
+    sold_lock = threading.Lock()
+
+    def buyer():
+        with app.app_context():
+            try:
+                for _ in range(RESERVATIONS_PER_THREAD):
+                    if InventoryService.reserve({scarce_id: 1, plentiful_id: 1}):
+                        db.session.commit()
+                        with sold_lock:
+                            sold.append(1)
+                    else:
+                        db.session.rollback()
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=buyer) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    # Nhu cầu (8 x 20) lớn hơn tồn kho sản phẩm hiếm: bán đúng bằng tồn kho, không hơn
+    assert sum(sold) == SCARCE_STOCK
+
+    db.session.expire_all()
+    assert db.session.get(SanPham, scarce_id).SoLuong == 0
+    # Đơn thiếu hàng được rollback cả đơn nên sản phẩm còn lại chỉ bị trừ theo đơn thành công
+    assert db.session.get(SanPham, plentiful_id).SoLuong == PLENTIFUL_STOCK - SCARCE_STOCK
+
+
+def test_reserve_uses_one_update_for_all_products(app, make_products):
+    product_ids = make_products(3, stock=5)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        assert InventoryService.reserve({product_id: 2 for product_id in product_ids})
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert len([s for s in statements if s.lstrip().upper().startswith('UPDATE')]) == 1
+    db.session.expire_all()
+    assert [db.session.get(SanPham, product_id).SoLuong for product_id in product_ids] == [3, 3, 3]